@@ -0,0 +1,344 @@
+# WaveAI - Benchmark hors ligne
+# Charge l'application avec des utilisateurs virtuels contre un serveur
+# simulant OpenAI, Anthropic, Hugging Face et Ollama (aucun appel réel)
+#
+#   python benchmark.py --users 20 --duration 30 --latency 300 --error-rate 0.05
+#   python benchmark.py --stream --providers openai,huggingface --fail-p95 2000
+#   python benchmark.py --target http://127.0.0.1:8000   # serveur déjà lancé
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+MOCK_TEXT = "Voici une réponse simulée par le serveur de benchmark WaveAI, découpée en plusieurs jetons."
+AGENTS = ['kai', 'alex', 'lina', 'marco', 'sofia']
+MESSAGES = [
+    "Aide-moi à organiser ma semaine",
+    "Rédige un court email de relance",
+    "Quelles sont les bonnes pratiques pour une réunion ?",
+    "Résume les avantages du télétravail",
+    "Propose trois idées de contenu pour LinkedIn"
+]
+
+# =============================================================================
+# SERVEUR FOURNISSEURS SIMULÉ
+# =============================================================================
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    """Émule les API OpenAI, Anthropic, Hugging Face et Ollama
+
+    Latence du premier octet, délai entre jetons et taux d'erreur sont lus
+    sur le serveur (voir start_mock_server).
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/api/tags'):
+            return self.send_json({'models': []})
+        self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = {}
+
+        config = self.server.config
+        time.sleep(max(0.0, config['latency'] + random.uniform(-config['jitter'], config['jitter'])))
+        if random.random() < config['error_rate']:
+            return self.send_json({'error': 'erreur simulée'}, 500)
+
+        stream = bool(body.get('stream'))
+        if self.path.endswith('/chat/completions'):
+            if stream:
+                return self.send_stream(lambda token: {'choices': [{'delta': {'content': token}, 'index': 0}]}, done='[DONE]')
+            return self.send_json({
+                'id': 'bench', 'object': 'chat.completion', 'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': MOCK_TEXT}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 20, 'total_tokens': 30}
+            })
+
+        if self.path.endswith('/complete'):
+            if stream:
+                return self.send_stream(lambda token: {'completion': token, 'stop_reason': None, 'model': body.get('model')}, event='completion')
+            return self.send_json({'completion': MOCK_TEXT, 'stop_reason': 'stop_sequence', 'model': body.get('model')})
+
+        if self.path.startswith('/models/'):
+            if stream:
+                return self.send_stream(lambda token: {'token': {'text': token, 'special': False}})
+            return self.send_json([{'generated_text': MOCK_TEXT}])
+
+        self.send_json({'error': 'not found'}, 404)
+
+    def send_json(self, data, status=200):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_stream(self, make_event, event=None, done=None):
+        """Réponse SSE jeton par jeton (connexion fermée à la fin du flux)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        prefix = f"event: {event}\n" if event else ""
+        for token in MOCK_TEXT.split(' '):
+            frame = f"{prefix}data: {json.dumps(make_event(token + ' '))}\n\n"
+            self.wfile.write(frame.encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.server.config['token_delay'])
+        if done:
+            self.wfile.write(f"data: {done}\n\n".encode('utf-8'))
+
+def start_mock_server(latency, jitter, token_delay, error_rate):
+    """Démarre le serveur simulé sur un port libre, retourne son URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockProviderHandler)
+    server.daemon_threads = True
+    server.config = {'latency': latency, 'jitter': jitter, 'token_delay': token_delay, 'error_rate': error_rate}
+    threading.Thread(target=server.serve_forever, name='mock-providers', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+# =============================================================================
+# APPLICATION SOUS TEST
+# =============================================================================
+
+def configure_environment(mock_url, args):
+    """Variables lues par waveai_main à l'import : base SQLite jetable et fournisseurs simulés"""
+    directory = tempfile.mkdtemp(prefix='waveai-bench-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(directory, 'bench.db')}")
+    os.environ.setdefault('JOB_QUEUE_PATH', os.path.join(directory, 'jobs.db'))
+    os.environ.setdefault('USAGE_SPILL_PATH', os.path.join(directory, 'usage_spill.jsonl'))
+    os.environ.setdefault('CONVERSATION_SPILL_PATH', os.path.join(directory, 'conversations_spill.jsonl'))
+    os.environ.setdefault('ARCHIVE_DIR', os.path.join(directory, 'archives'))
+    os.environ['OPENAI_API_BASE'] = f'{mock_url}/v1'
+    os.environ['ANTHROPIC_API_URL'] = mock_url
+    os.environ['HUGGINGFACE_API_URL'] = f'{mock_url}/models/bench'
+    os.environ['OLLAMA_API_URL'] = f'{mock_url}/api/tags'
+    os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'true' if args.cache_hits else 'false')
+    # Les limites par utilisateur fausseraient la mesure du débit
+    os.environ.setdefault('RATE_LIMIT_USER_PER_MINUTE', '1000000')
+    os.environ.setdefault('RATE_LIMIT_USER_BURST', '1000000')
+    os.environ.setdefault('RATE_LIMIT_PROVIDER_PER_MINUTE', '1000000')
+    os.environ.setdefault('RATE_LIMIT_PROVIDER_BURST', '1000000')
+    os.environ.setdefault('USAGE_DAILY_TOKEN_QUOTA', '0')
+    os.environ.setdefault('USAGE_DAILY_COST_QUOTA', '0')
+
+def start_app_server():
+    """Lance waveai_main dans un serveur WSGI threadé et compte les requêtes SQL par route"""
+    from flask import has_request_context, request
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import waveai_main
+
+    query_counts = defaultdict(int)
+    lock = threading.Lock()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        route = request.url_rule.rule if has_request_context() and request.url_rule else 'arrière-plan'
+        with lock:
+            query_counts[route] += 1
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, waveai_main.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name='waveai-bench', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", query_counts
+
+# =============================================================================
+# UTILISATEURS VIRTUELS
+# =============================================================================
+
+class Recorder:
+    """Latences et statuts par route"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+
+    def record(self, route, elapsed, status):
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            self.statuses[route][status] += 1
+
+def virtual_user(index, base_url, args, recorder, deadline):
+    """Connexion, configuration des fournisseurs puis boucle dashboard / chat / status"""
+    http = requests.Session()
+
+    def call(route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = http.request(method, base_url + path, timeout=args.timeout, allow_redirects=False, **kwargs)
+            if kwargs.get('stream'):
+                first = None
+                for chunk in response.iter_content(chunk_size=None):
+                    if first is None and chunk:
+                        first = time.perf_counter() - started
+                        recorder.record(route + ' (1er octet)', first, response.status_code)
+            else:
+                response.content
+            status = response.status_code
+        except requests.RequestException:
+            status = 'erreur'
+        recorder.record(route, time.perf_counter() - started, status)
+        return status
+
+    call('/login', 'POST', '/login', data={'email': f'bench{index}@waveai.test'})
+
+    providers = args.providers.split(',')
+    http.post(base_url + '/ai-settings', allow_redirects=False, data={
+        'openai_key': 'sk-bench' if 'openai' in providers else '',
+        'anthropic_key': 'sk-ant-bench' if 'anthropic' in providers else '',
+        'huggingface_token': 'hf-bench',
+        'default_model': providers[0],
+        'temperature': 0.0 if args.cache_hits else 0.7,
+        'max_tokens': 500
+    })
+
+    sent = 0
+    while time.monotonic() < deadline and (not args.requests or sent < args.requests):
+        message = random.choice(MESSAGES)
+        if not args.cache_hits:
+            message = f"{message} ({index}-{sent})"
+        payload = {'message': message, 'agent_type': random.choice(AGENTS)}
+
+        if args.stream:
+            call('/api/chat/stream', 'POST', '/api/chat/stream', json=payload, stream=True)
+        else:
+            call('/api/chat', 'POST', '/api/chat', json=payload)
+        sent += 1
+
+        if sent % args.dashboard_every == 0:
+            call('/dashboard', 'GET', '/dashboard')
+        if sent % args.status_every == 0:
+            call('/api/status', 'GET', '/api/status')
+
+        if args.think_time:
+            time.sleep(random.uniform(0, 2 * args.think_time))
+
+# =============================================================================
+# RAPPORT
+# =============================================================================
+
+def percentile(values, fraction):
+    """Percentile au rang le plus proche (valeurs triées)"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[rank]
+
+def build_report(recorder, query_counts, elapsed):
+    rows = []
+    for route in sorted(recorder.latencies):
+        values = sorted(recorder.latencies[route])
+        statuses = dict(recorder.statuses[route])
+        errors = sum(count for status, count in statuses.items() if status == 'erreur' or status >= 500)
+        row = {
+            'route': route,
+            'requests': len(values),
+            'rps': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+            'errors': errors,
+            'rejected': statuses.get(429, 0) + statuses.get(503, 0),
+            'statuses': {str(status): count for status, count in statuses.items()}
+        }
+        if query_counts is not None and not route.endswith('(1er octet)'):
+            row['queries_per_request'] = round(query_counts.get(route, 0) / len(values), 2)
+        rows.append(row)
+
+    report = {'duration_s': round(elapsed, 2), 'routes': rows}
+    if query_counts is not None:
+        report['background_queries'] = query_counts.get('arrière-plan', 0)
+    return report
+
+def print_report(report):
+    print(f"\nDurée : {report['duration_s']} s")
+    print(f"{'route':<32}{'req':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'err':>6}{'429':>6}{'sql/req':>9}")
+    for row in report['routes']:
+        queries = row.get('queries_per_request', 'n/d')
+        print(f"{row['route']:<32}{row['requests']:>7}{row['rps']:>9}{row['p50_ms']:>9}"
+              f"{row['p95_ms']:>9}{row['p99_ms']:>9}{row['errors']:>6}{row['rejected']:>6}{queries:>9}")
+    if 'background_queries' in report:
+        print(f"Requêtes SQL hors requête HTTP (écriture différée, sondes) : {report['background_queries']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne de WaveAI avec fournisseurs simulés")
+    parser.add_argument('--users', type=int, default=10, help="utilisateurs virtuels simultanés")
+    parser.add_argument('--duration', type=float, default=20, help="durée maximale en secondes")
+    parser.add_argument('--requests', type=int, default=0, help="messages par utilisateur (0 = jusqu'à la fin de la durée)")
+    parser.add_argument('--think-time', type=float, default=0.0, help="pause moyenne entre deux messages, en secondes")
+    parser.add_argument('--dashboard-every', type=int, default=5, help="un /dashboard tous les N messages")
+    parser.add_argument('--status-every', type=int, default=10, help="un /api/status tous les N messages")
+    parser.add_argument('--providers', default='huggingface', help="fournisseurs configurés, le premier est préféré (openai,anthropic,huggingface)")
+    parser.add_argument('--stream', action='store_true', help="utiliser /api/chat/stream au lieu de /api/chat")
+    parser.add_argument('--cache-hits', action='store_true', help="messages répétés et température 0 (mesure du cache de réponses)")
+    parser.add_argument('--latency', type=float, default=200, help="latence simulée du premier octet, en ms")
+    parser.add_argument('--jitter', type=float, default=50, help="variation de la latence simulée, en ms")
+    parser.add_argument('--token-delay', type=float, default=10, help="délai entre jetons en streaming, en ms")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="proportion de réponses 500 du serveur simulé")
+    parser.add_argument('--timeout', type=float, default=60, help="timeout client HTTP, en secondes")
+    parser.add_argument('--target', help="URL d'une instance déjà lancée (pas de comptage SQL)")
+    parser.add_argument('--json', help="écrire le rapport JSON dans ce fichier")
+    parser.add_argument('--fail-p95', type=float, help="code de sortie 1 si un p95 dépasse ce seuil, en ms")
+    args = parser.parse_args()
+
+    mock_url = start_mock_server(args.latency / 1000, args.jitter / 1000, args.token_delay / 1000, args.error_rate)
+    if args.target:
+        base_url, query_counts = args.target.rstrip('/'), None
+    else:
+        configure_environment(mock_url, args)
+        base_url, query_counts = start_app_server()
+
+    print(f"Fournisseurs simulés : {mock_url}")
+    print(f"Application : {base_url} ({args.users} utilisateurs, {args.duration} s max)")
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [
+        threading.Thread(target=virtual_user, args=(index, base_url, args, recorder, deadline), daemon=True)
+        for index in range(args.users)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+
+    report = build_report(recorder, query_counts, time.monotonic() - started)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2, ensure_ascii=False)
+
+    if args.fail_p95 and any(row['p95_ms'] > args.fail_p95 for row in report['routes']):
+        print(f"❌ p95 au-delà de {args.fail_p95} ms")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+# WaveAI - Configuration Gunicorn (production)
+# Les appels aux fournisseurs IA sont des attentes réseau : des workers
+# threadés (ou gevent) servent d'autres requêtes pendant ces attentes.
+#
+#   gunicorn -c gunicorn.conf.py "waveai_main:create_app()"
+
+import os
+import sys
+import subprocess
+
+# Modèle de concurrence : sync, gthread (défaut) ou gevent (pip install gevent)
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+if worker_class == 'threaded':
+    worker_class = 'gthread'
+
+wsgi_app = 'waveai_main:create_app()'
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Un worker occupe ~100 Mo : 2 workers tiennent dans les 512 Mo du plan gratuit
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# gthread : requêtes simultanées par worker ; gevent : connexions simultanées
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Un chat peut attendre plusieurs fournisseurs (30 s chacun) puis streamer
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recyclage périodique des workers (fuites mémoire des SDK)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+def on_starting(server):
+    """Initialise la base une seule fois, avant le démarrage des workers
+
+    L'initialisation tourne dans un processus séparé : le maître n'importe
+    pas l'application (compatible gevent, qui doit patcher avant l'import).
+    """
+    result = subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'waveai_main', 'init-db'],
+        env=dict(os.environ, WAVEAI_INIT_DB='false')
+    )
+    if result.returncode != 0:
+        server.log.error("❌ Échec initialisation de la base de données")
+        sys.exit(1)
+
+    # Les workers n'ont plus à initialiser la base à l'import
+    os.environ['WAVEAI_INIT_DB'] = 'false'
@@ -0,0 +1,180 @@
+document.addEventListener('DOMContentLoaded', function() {
+    // Éléments
+    const temperatureSlider = document.getElementById('temperature');
+    const temperatureValue = document.getElementById('temperatureValue');
+    const tokensSlider = document.getElementById('max_tokens');
+    const tokensValue = document.getElementById('tokensValue');
+    const defaultModelSelect = document.getElementById('default_model');
+    const modelPreview = document.getElementById('modelPreview');
+
+    // Descriptions des modèles
+    const modelDescriptions = {
+        'huggingface': {
+            name: 'Hugging Face',
+            description: 'Modèle gratuit, toujours disponible. Performances correctes pour la plupart des tâches.'
+        },
+        'openai': {
+            name: 'OpenAI GPT',
+            description: 'Modèle premium très performant. Excellent pour toutes les tâches, nécessite une clé API.'
+        },
+        'anthropic': {
+            name: 'Anthropic Claude',
+            description: 'Modèle premium axé sur la sécurité. Excellent pour l\'analyse et les tâches complexes.'
+        }
+    };
+
+    // Mise à jour des sliders
+    temperatureSlider.addEventListener('input', function() {
+        temperatureValue.textContent = this.value;
+    });
+
+    tokensSlider.addEventListener('input', function() {
+        tokensValue.textContent = this.value;
+    });
+
+    document.getElementById('hedge_delay_ms').addEventListener('input', function() {
+        document.getElementById('hedgeDelayValue').textContent = this.value;
+    });
+
+    // Mise à jour de l'aperçu du modèle
+    defaultModelSelect.addEventListener('change', function() {
+        const selectedModel = this.value;
+        const modelInfo = modelDescriptions[selectedModel];
+
+        if (modelInfo) {
+            const previewTitle = modelPreview.querySelector('.model-preview-title');
+            const previewText = modelPreview.querySelector('.model-preview-text');
+
+            previewTitle.textContent = `Modèle sélectionné : ${modelInfo.name}`;
+            previewText.textContent = modelInfo.description;
+        }
+    });
+
+    // Test de connexions individuelles
+    function testConnection(apiType, apiKey) {
+        const testElement = document.getElementById(`${apiType}-test`);
+        const resultElement = testElement.querySelector('.test-result');
+
+        testElement.style.display = 'flex';
+        resultElement.className = 'test-result test-loading';
+        resultElement.textContent = 'Test en cours...';
+
+        // Simulation du test (en production, faire un appel API réel)
+        setTimeout(() => {
+            if (apiKey && apiKey.length > 10 && !apiKey.includes('●')) {
+                resultElement.className = 'test-result test-success';
+                resultElement.textContent = '✅ Connexion réussie';
+            } else {
+                resultElement.className = 'test-result test-error';
+                resultElement.textContent = '❌ Clé API invalide ou manquante';
+            }
+        }, 1500);
+    }
+
+    // Tests automatiques au changement des clés
+    document.getElementById('openai_key').addEventListener('blur', function() {
+        if (this.value && !this.value.includes('●')) {
+            testConnection('openai', this.value);
+        }
+    });
+
+    document.getElementById('anthropic_key').addEventListener('blur', function() {
+        if (this.value && !this.value.includes('●')) {
+            testConnection('anthropic', this.value);
+        }
+    });
+
+    // Fonction globale pour tester toutes les connexions
+    window.testAllConnections = function() {
+        const openaiKey = document.getElementById('openai_key').value;
+        const anthropicKey = document.getElementById('anthropic_key').value;
+
+        if (openaiKey && !openaiKey.includes('●')) {
+            testConnection('openai', openaiKey);
+        }
+        if (anthropicKey && !anthropicKey.includes('●')) {
+            testConnection('anthropic', anthropicKey);
+        }
+
+        if (!openaiKey && !anthropicKey) {
+            alert('ℹ️ Aucune clé API à tester.\n\nHugging Face fonctionne sans clé API.');
+        }
+    };
+
+    // Gestion du formulaire
+    const form = document.getElementById('settingsForm');
+    form.addEventListener('submit', function(e) {
+        const submitBtn = form.querySelector('button[type="submit"]');
+
+        // Animation de sauvegarde
+        submitBtn.innerHTML = '💾 Sauvegarde...';
+        submitBtn.disabled = true;
+
+        // Validation simple
+        const temperature = parseFloat(temperatureSlider.value);
+        const maxTokens = parseInt(tokensSlider.value);
+
+        if (temperature < 0 || temperature > 1) {
+            e.preventDefault();
+            alert('❌ La température doit être entre 0 et 1');
+            submitBtn.innerHTML = '💾 Sauvegarder';
+            submitBtn.disabled = false;
+            return;
+        }
+
+        if (maxTokens < 100 || maxTokens > 4000) {
+            e.preventDefault();
+            alert('❌ Le nombre de tokens doit être entre 100 et 4000');
+            submitBtn.innerHTML = '💾 Sauvegarder';
+            submitBtn.disabled = false;
+            return;
+        }
+
+        // Le formulaire sera soumis normalement après ces vérifications
+    });
+
+    // Effets visuels
+    const inputs = document.querySelectorAll('.form-input, .form-select');
+    inputs.forEach(input => {
+        input.addEventListener('focus', function() {
+            this.parentElement.style.transform = 'scale(1.01)';
+            this.parentElement.style.transition = 'transform 0.2s ease';
+        });
+
+        input.addEventListener('blur', function() {
+            this.parentElement.style.transform = 'scale(1)';
+        });
+    });
+
+    // Animation des sections au scroll
+    const sections = document.querySelectorAll('.form-section');
+    const observerOptions = {
+        threshold: 0.1,
+        rootMargin: '0px 0px -50px 0px'
+    };
+
+    const observer = new IntersectionObserver(function(entries) {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                entry.target.style.animation = 'slideInUp 0.6s ease-out forwards';
+            }
+        });
+    }, observerOptions);
+
+    sections.forEach(section => {
+        observer.observe(section);
+    });
+
+    // Tooltip pour les éléments d'aide
+    const infoBoxes = document.querySelectorAll('.info-box, .warning-box');
+    infoBoxes.forEach(box => {
+        box.addEventListener('mouseenter', function() {
+            this.style.transform = 'scale(1.02)';
+            this.style.transition = 'transform 0.2s ease';
+        });
+
+        box.addEventListener('mouseleave', function() {
+            this.style.transform = 'scale(1)';
+        });
+    });
+});
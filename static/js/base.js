@@ -0,0 +1,135 @@
+// PWA Service Worker
+if ('serviceWorker' in navigator) {
+    window.addEventListener('load', () => {
+        navigator.serviceWorker.register('/static/sw.js')
+            .then((registration) => {
+                console.log('SW registered: ', registration);
+            })
+            .catch((registrationError) => {
+                console.log('SW registration failed: ', registrationError);
+            });
+    });
+}
+
+// Auto-hide flash messages
+document.addEventListener('DOMContentLoaded', function() {
+    const flashMessages = document.querySelectorAll('.flash-message');
+    flashMessages.forEach(function(message) {
+        setTimeout(function() {
+            message.style.animation = 'slideOut 0.3s ease-in-out forwards';
+            setTimeout(function() {
+                message.remove();
+            }, 300);
+        }, 5000);
+    });
+});
+
+// Animation slide out
+const style = document.createElement('style');
+style.textContent = `
+    @keyframes slideOut {
+        from {
+            opacity: 1;
+            transform: translateY(0);
+        }
+        to {
+            opacity: 0;
+            transform: translateY(-10px);
+        }
+    }
+`;
+document.head.appendChild(style);
+
+// Statut poussé par le serveur (Server-Sent Events), partagé par les scripts de page
+const WaveAIStatus = (function() {
+    const listeners = [];
+    const minDelay = 5000;
+    const maxDelay = 300000;
+    // Sans flux (canal saturé, navigateur sans EventSource) : polling de /api/status
+    const pollInterval = 30000;
+    let source = null;
+    let pollTimer = null;
+    let lastStatus = null;
+    let retryDelay = minDelay;
+    let retryTimer = null;
+
+    function notify(status) {
+        lastStatus = status;
+        listeners.forEach(listener => listener(status));
+    }
+
+    function fetchOnce() {
+        fetch('/api/status')
+            .then(response => response.json())
+            .then(notify)
+            .catch(error => console.error('❌ Erreur de connexion:', error));
+    }
+
+    function startPolling() {
+        if (pollTimer) return;
+        fetchOnce();
+        pollTimer = setInterval(fetchOnce, pollInterval);
+    }
+
+    function stopPolling() {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+
+    function connect() {
+        if (source || document.hidden) return;
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+
+        source = new EventSource('/api/status/stream');
+        source.addEventListener('status', function(event) {
+            retryDelay = minDelay;
+            stopPolling();
+            notify(JSON.parse(event.data));
+        });
+        source.onerror = function() {
+            // Coupure réseau : le navigateur se reconnecte seul.
+            // Refus du serveur (canal saturé) : polling en attendant une reconnexion avec backoff exponentiel.
+            if (source.readyState === EventSource.CLOSED) {
+                source = null;
+                startPolling();
+                scheduleReconnect();
+            }
+        };
+    }
+
+    function scheduleReconnect() {
+        clearTimeout(retryTimer);
+        const delay = retryDelay * (0.5 + Math.random());
+        retryDelay = Math.min(retryDelay * 2, maxDelay);
+        retryTimer = setTimeout(connect, delay);
+    }
+
+    function disconnect() {
+        clearTimeout(retryTimer);
+        stopPolling();
+        if (source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    // Aucun flux ouvert pour les onglets en arrière-plan
+    document.addEventListener('visibilitychange', function() {
+        if (document.hidden) {
+            disconnect();
+        } else {
+            connect();
+        }
+    });
+
+    return {
+        subscribe(listener) {
+            listeners.push(listener);
+            if (lastStatus) listener(lastStatus);
+            connect();
+        }
+    };
+})();
@@ -0,0 +1,417 @@
+// Variables globales
+let isTyping = false;
+const chatMessages = document.getElementById('chatMessages');
+const chatInput = document.getElementById('chatInput');
+const chatForm = document.getElementById('chatForm');
+const sendBtn = document.getElementById('sendBtn');
+const typingIndicator = document.getElementById('typingIndicator');
+const welcomeMessage = document.getElementById('welcomeMessage');
+
+// Configuration de l'agent
+const agentConfig = window.waveaiAgent;
+
+// Fil de discussion courant (conservé pendant la session de l'onglet)
+const threadStorageKey = `waveai-thread-${agentConfig.type}`;
+let threadId = sessionStorage.getItem(threadStorageKey);
+
+function setThreadId(id) {
+    if (!id) return;
+    threadId = id;
+    sessionStorage.setItem(threadStorageKey, id);
+}
+
+// Envoi non abouti : renvoyer le même message reprend la même clé d'idempotence
+let pendingSend = null;
+
+function newIdempotencyKey() {
+    return window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Initialisation
+document.addEventListener('DOMContentLoaded', function() {
+    // Auto-resize du textarea
+    chatInput.addEventListener('input', function() {
+        this.style.height = 'auto';
+        this.style.height = Math.min(this.scrollHeight, 120) + 'px';
+
+        // Activer/désactiver le bouton d'envoi
+        sendBtn.disabled = !this.value.trim();
+    });
+
+    // Envoi avec Entrée (Shift+Entrée pour nouvelle ligne)
+    chatInput.addEventListener('keydown', function(e) {
+        if (e.key === 'Enter' && !e.shiftKey) {
+            e.preventDefault();
+            if (this.value.trim() && !isTyping) {
+                sendMessage();
+            }
+        }
+    });
+
+    // Gestion du formulaire
+    chatForm.addEventListener('submit', function(e) {
+        e.preventDefault();
+        if (chatInput.value.trim() && !isTyping) {
+            sendMessage();
+        }
+    });
+
+    // Focus initial
+    chatInput.focus();
+
+    // Première page d'historique
+    loadHistory();
+});
+
+// Fonction d'envoi de message
+async function sendMessage() {
+    const message = chatInput.value.trim();
+    if (!message || isTyping) return;
+
+    // Masquer le message de bienvenue
+    if (welcomeMessage) {
+        welcomeMessage.style.display = 'none';
+    }
+
+    // Ajouter le message utilisateur
+    addMessage(message, 'user');
+
+    // Vider l'input et reset
+    chatInput.value = '';
+    chatInput.style.height = 'auto';
+    sendBtn.disabled = true;
+
+    // Montrer l'indicateur de frappe
+    showTyping();
+
+    try {
+        // Une clé par message, reprise à chaque nouvel essai (pas de double traitement)
+        if (!pendingSend || pendingSend.message !== message) {
+            pendingSend = { message: message, key: newIdempotencyKey() };
+        }
+        const response = await postChat(message, pendingSend.key);
+
+        if (!response.ok || !response.body) {
+            const data = await response.json();
+            hideTyping();
+            addErrorMessage(data.error || 'Erreur de communication avec l\'agent');
+        } else {
+            await readStream(response);
+            pendingSend = null;
+        }
+
+    } catch (error) {
+        console.error('Erreur:', error);
+        hideTyping();
+        addErrorMessage('Erreur de connexion. Veuillez réessayer.');
+    }
+
+    // Refocus sur l'input
+    chatInput.focus();
+}
+
+// Envoyer à l'API en streaming ; une coupure réseau est retentée une fois avec la même clé
+async function postChat(message, idempotencyKey, retries = 1) {
+    try {
+        return await fetch('/api/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey,
+            },
+            body: JSON.stringify({
+                message: message,
+                agent_type: agentConfig.type,
+                thread_id: threadId
+            })
+        });
+    } catch (error) {
+        if (retries <= 0) throw error;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        return postChat(message, idempotencyKey, retries - 1);
+    }
+}
+
+// Lire le flux SSE et afficher les tokens au fil de l'eau
+async function readStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let content = '';
+    let bubble = null;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop();
+
+        for (const frame of frames) {
+            const event = parseSseFrame(frame);
+            if (!event) continue;
+
+            if (event.type === 'token') {
+                if (!bubble) {
+                    hideTyping();
+                    bubble = addMessage('', 'ai');
+                }
+                content += event.data.text;
+                bubble.querySelector('.message-bubble-ai').innerHTML = escapeHtml(content);
+                scrollToBottom();
+            } else if (event.type === 'done') {
+                setThreadId(event.data.thread_id);
+                if (!bubble) {
+                    hideTyping();
+                    bubble = addMessage(event.data.response, 'ai', event.data.model);
+                } else {
+                    bubble.querySelector('.message-bubble-ai').innerHTML = escapeHtml(event.data.response);
+                    setMessageModel(bubble, event.data.model);
+                }
+                if (event.data.truncated) {
+                    addErrorMessage('Réponse interrompue : elle est incomplète et n\'a pas été sauvegardée.');
+                }
+            } else if (event.type === 'error') {
+                hideTyping();
+                addErrorMessage(event.data.error || 'Erreur de communication avec l\'agent');
+            }
+        }
+    }
+
+    hideTyping();
+}
+
+// Décoder une trame "event: ...\ndata: ..."
+function parseSseFrame(frame) {
+    let type = 'message';
+    let data = '';
+    frame.split('\n').forEach(line => {
+        if (line.startsWith('event:')) type = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+    });
+    if (!data) return null;
+    try {
+        return { type: type, data: JSON.parse(data) };
+    } catch (e) {
+        return null;
+    }
+}
+
+// Afficher le modèle utilisé sous une réponse
+function setMessageModel(messageDiv, model) {
+    if (!model) return;
+    const badge = document.createElement('small');
+    badge.style.color = 'var(--text-muted)';
+    badge.style.fontSize = '0.7rem';
+    badge.textContent = `(${model})`;
+    messageDiv.querySelector('.message-time').appendChild(badge);
+}
+
+// Ajouter un message au chat
+function addMessage(content, sender, model = null) {
+    const messageDiv = createMessage(content, sender, model, new Date());
+    chatMessages.appendChild(messageDiv);
+    scrollToBottom();
+    return messageDiv;
+}
+
+// Construire l'élément d'un message
+function createMessage(content, sender, model, date) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message message-${sender}`;
+
+    const timeString = date.toLocaleTimeString('fr-FR', { 
+        hour: '2-digit', 
+        minute: '2-digit' 
+    });
+
+    if (sender === 'user') {
+        messageDiv.innerHTML = `
+            <div class="message-bubble message-bubble-user">
+                ${escapeHtml(content)}
+                <div class="message-time">${timeString}</div>
+            </div>
+        `;
+    } else {
+        const modelBadge = model ? `<small style="color: var(--text-muted); font-size: 0.7rem;">(${model})</small>` : '';
+        messageDiv.innerHTML = `
+            <div class="message-avatar">${agentConfig.emoji}</div>
+            <div style="flex: 1;">
+                <div class="message-bubble message-bubble-ai">
+                    ${escapeHtml(content)}
+                </div>
+                <div class="message-time">${timeString} ${modelBadge}</div>
+            </div>
+        `;
+    }
+
+    return messageDiv;
+}
+
+// Historique : chargement des pages plus anciennes au défilement
+let historyCursor = null;
+let historyDone = false;
+let historyLoading = false;
+
+async function loadHistory() {
+    if (historyLoading || historyDone) return;
+    historyLoading = true;
+
+    try {
+        const params = new URLSearchParams({ agent_type: agentConfig.type, limit: 20 });
+        if (historyCursor) params.set('before', historyCursor);
+
+        const response = await fetch(`/api/conversations?${params}`);
+        if (!response.ok) return;
+        const data = await response.json();
+
+        const previousHeight = chatMessages.scrollHeight;
+        const anchor = chatMessages.querySelector('.message, .error-message');
+        const fragment = document.createDocumentFragment();
+
+        // Les conversations arrivent de la plus récente à la plus ancienne
+        data.conversations.slice().reverse().forEach(conversation => {
+            const date = conversation.created_at ? new Date(conversation.created_at + 'Z') : new Date();
+            fragment.appendChild(createMessage(conversation.message, 'user', null, date));
+            if (conversation.response) {
+                fragment.appendChild(createMessage(conversation.response, 'ai', null, date));
+            }
+        });
+        chatMessages.insertBefore(fragment, anchor);
+
+        if (data.conversations.length && welcomeMessage) {
+            welcomeMessage.style.display = 'none';
+        }
+
+        if (historyCursor) {
+            // Conserver la position de lecture après l'ajout en haut
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+        } else {
+            scrollToBottom();
+        }
+
+        historyCursor = data.next_cursor;
+        historyDone = !data.next_cursor;
+    } catch (error) {
+        console.error('Erreur historique:', error);
+    } finally {
+        historyLoading = false;
+    }
+}
+
+chatMessages.addEventListener('scroll', function() {
+    if (this.scrollTop < 80) {
+        loadHistory();
+    }
+});
+
+// Ajouter un message d'erreur
+function addErrorMessage(error) {
+    const errorDiv = document.createElement('div');
+    errorDiv.className = 'error-message';
+    errorDiv.innerHTML = `
+        <strong>❌ Erreur:</strong> ${escapeHtml(error)}
+        <br><small>Vérifiez vos paramètres IA ou réessayez plus tard.</small>
+    `;
+    chatMessages.appendChild(errorDiv);
+    scrollToBottom();
+}
+
+// Afficher l'indicateur de frappe
+function showTyping() {
+    isTyping = true;
+    typingIndicator.style.display = 'flex';
+    scrollToBottom();
+}
+
+// Cacher l'indicateur de frappe
+function hideTyping() {
+    isTyping = false;
+    typingIndicator.style.display = 'none';
+}
+
+// Scroll vers le bas
+function scrollToBottom() {
+    setTimeout(() => {
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }, 100);
+}
+
+// Échapper le HTML
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML.replace(/\n/g, '<br>');
+}
+
+// Envoyer un message rapide
+function sendQuickMessage(message) {
+    chatInput.value = message;
+    sendMessage();
+}
+
+// Effacer le chat
+function clearChat() {
+    if (confirm('Êtes-vous sûr de vouloir effacer cette conversation ?')) {
+        // Supprimer tous les messages sauf le welcome
+        const messages = chatMessages.querySelectorAll('.message, .error-message');
+        messages.forEach(msg => msg.remove());
+
+        // Nouveau fil : l'agent repart sans historique
+        threadId = null;
+        sessionStorage.removeItem(threadStorageKey);
+
+        // Réafficher le message de bienvenue
+        if (welcomeMessage) {
+            welcomeMessage.style.display = 'block';
+        }
+
+        // Reset de l'input
+        chatInput.value = '';
+        chatInput.style.height = 'auto';
+        sendBtn.disabled = true;
+        chatInput.focus();
+    }
+}
+
+// Toggle emoji picker (simple simulation)
+function toggleEmojiPicker() {
+    const emojis = ['😊', '😂', '🤔', '👍', '👎', '❤️', '🔥', '💡', '🎉', '🚀'];
+    const randomEmoji = emojis[Math.floor(Math.random() * emojis.length)];
+    chatInput.value += randomEmoji;
+    chatInput.focus();
+
+    // Trigger input event pour resize
+    chatInput.dispatchEvent(new Event('input'));
+}
+
+// Animation d'apparition progressive
+function animateWelcome() {
+    if (welcomeMessage) {
+        const elements = welcomeMessage.querySelectorAll('h3, p, .quick-prompts');
+        elements.forEach((el, index) => {
+            el.style.opacity = '0';
+            el.style.transform = 'translateY(20px)';
+            setTimeout(() => {
+                el.style.transition = 'all 0.6s ease-out';
+                el.style.opacity = '1';
+                el.style.transform = 'translateY(0)';
+            }, index * 200);
+        });
+    }
+}
+
+// Démarrer l'animation au chargement
+setTimeout(animateWelcome, 500);
+
+// Status de connexion (poussé par le serveur à chaque changement)
+WaveAIStatus.subscribe(function(data) {
+    if (data.status === 'ok') {
+        console.log('✅ Connexion WaveAI active');
+    } else {
+        console.warn('⚠️ Problème de connexion WaveAI');
+    }
+});
@@ -0,0 +1,94 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('loginForm');
+    const btn = document.getElementById('loginBtn');
+    const emailInput = document.getElementById('email');
+
+    // Animation d'input focus
+    emailInput.addEventListener('focus', function() {
+        this.parentElement.style.transform = 'scale(1.02)';
+    });
+
+    emailInput.addEventListener('blur', function() {
+        this.parentElement.style.transform = 'scale(1)';
+    });
+
+    // Validation en temps réel
+    emailInput.addEventListener('input', function() {
+        const email = this.value;
+        const isValid = /^[^\s@]+@[^\s@]+\.[^\s@]+$/.test(email);
+
+        if (email.length > 0) {
+            if (isValid) {
+                this.style.borderColor = 'var(--success)';
+                btn.disabled = false;
+                btn.textContent = '🚀 Se Connecter avec WaveAI';
+            } else {
+                this.style.borderColor = 'var(--error)';
+                btn.disabled = true;
+                btn.textContent = '❌ Email invalide';
+            }
+        } else {
+            this.style.borderColor = 'var(--border)';
+            btn.disabled = false;
+            btn.textContent = '🚀 Se Connecter avec WaveAI';
+        }
+    });
+
+    // Gestion de la soumission
+    form.addEventListener('submit', function(e) {
+        const email = emailInput.value.trim();
+
+        if (!email) {
+            e.preventDefault();
+            alert('Veuillez saisir votre adresse email');
+            emailInput.focus();
+            return;
+        }
+
+        // Animation de chargement
+        btn.classList.add('loading');
+        btn.disabled = true;
+        btn.textContent = 'Connexion en cours...';
+
+        // Simulation connexion (en mode démo)
+        // En production, le formulaire sera soumis normalement
+    });
+
+    // Auto-complétion suggestions
+    const commonDomains = ['gmail.com', 'outlook.com', 'yahoo.fr', 'hotmail.com'];
+
+    emailInput.addEventListener('keyup', function() {
+        const value = this.value;
+        const atIndex = value.indexOf('@');
+
+        if (atIndex > 0 && atIndex === value.length - 1) {
+            // L'utilisateur vient de taper @
+            const suggestions = commonDomains.map(domain => value + domain);
+            console.log('Suggestions:', suggestions);
+            // Ici on pourrait afficher une liste de suggestions
+        }
+    });
+
+    // Easter egg - animation spéciale pour certains emails
+    emailInput.addEventListener('change', function() {
+        const email = this.value.toLowerCase();
+        if (email.includes('wave') || email.includes('ai')) {
+            this.style.background = 'linear-gradient(45deg, rgba(14, 165, 233, 0.1), rgba(6, 182, 212, 0.1))';
+            setTimeout(() => {
+                this.style.background = 'var(--bg-secondary)';
+            }, 2000);
+        }
+    });
+});
+
+// Animation d'apparition séquentielle
+const elements = document.querySelectorAll('.login-info, .login-form, .security-note');
+elements.forEach((el, index) => {
+    el.style.opacity = '0';
+    el.style.transform = 'translateY(20px)';
+    setTimeout(() => {
+        el.style.transition = 'all 0.6s ease-out';
+        el.style.opacity = '1';
+        el.style.transform = 'translateY(0)';
+    }, 100 + (index * 150));
+});
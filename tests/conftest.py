@@ -0,0 +1,31 @@
+"""Configuration des tests WaveAI : base SQLite et fichiers dans un répertoire jetable"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+TEST_DIR = tempfile.mkdtemp(prefix='waveai-tests-')
+
+# Lues par waveai_main à l'import
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}")
+os.environ.setdefault('CONVERSATION_SPILL_PATH', os.path.join(TEST_DIR, 'conversations_spill.jsonl'))
+os.environ.setdefault('USAGE_SPILL_PATH', os.path.join(TEST_DIR, 'usage_spill.jsonl'))
+os.environ.setdefault('JOB_QUEUE_PATH', os.path.join(TEST_DIR, 'jobs.db'))
+os.environ.setdefault('ARCHIVE_DIR', os.path.join(TEST_DIR, 'archives'))
+os.environ.setdefault('JOB_WORKERS', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import waveai_main  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def database():
+    assert waveai_main.init_database()
+
+
+@pytest.fixture
+def ai_system():
+    return waveai_main.ai_system
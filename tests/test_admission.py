@@ -0,0 +1,37 @@
+"""Contrôle d'admission : un refus après coup ne consomme pas de jeton"""
+
+import os
+import threading
+
+import waveai_main
+from conftest import TEST_DIR
+
+
+def test_refund_restores_a_token():
+    for path in (None, os.path.join(TEST_DIR, 'rate_limits.db')):
+        limiter = waveai_main.RateLimiter(per_minute=1, burst=2, path=path)
+        assert limiter.acquire('user:1')[0]
+        assert limiter.acquire('user:1')[0]
+        assert not limiter.acquire('user:1')[0]
+
+        limiter.refund('user:1')
+        assert limiter.acquire('user:1')[0]
+        assert not limiter.acquire('user:1')[0]
+
+
+def test_rejected_admission_refunds_the_token(monkeypatch):
+    limiter = waveai_main.RateLimiter(per_minute=1, burst=1)
+    monkeypatch.setattr(waveai_main, 'user_limiter', limiter)
+    monkeypatch.setattr(waveai_main, 'inflight_chats', threading.BoundedSemaphore(1))
+    monkeypatch.setitem(waveai_main.app.config, 'ADMISSION_WAIT', 0)
+    waveai_main.inflight_chats.acquire()
+
+    with waveai_main.app.test_request_context():
+        for _ in range(3):
+            rejected = waveai_main.admit_chat(42)
+            assert rejected.status_code == 429
+            assert 'sollicité' in rejected.get_json()['error']
+
+        waveai_main.inflight_chats.release()
+        assert waveai_main.admit_chat(42) is None
+    waveai_main.inflight_chats.release()
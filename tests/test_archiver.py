@@ -0,0 +1,66 @@
+"""Archivage et suppression des conversations anciennes"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import waveai_main
+from waveai_main import AISettings, Conversation, ConversationArchive, User, db
+
+
+@pytest.fixture
+def user():
+    with waveai_main.app.app_context():
+        user = User(email=f"archive-{datetime.utcnow().timestamp()}@example.com", name='Archive')
+        db.session.add(user)
+        db.session.commit()
+        yield user
+
+
+def add_conversations(user, agent_type, ages):
+    now = datetime.utcnow()
+    db.session.add_all([
+        Conversation(user_id=user.id, agent_type=agent_type, message=f"question {age}", response='réponse',
+                     created_at=now - timedelta(days=age))
+        for age in ages
+    ])
+    db.session.commit()
+
+
+def test_archive_indexes_each_batch_once_per_agent(user, tmp_path):
+    archiver = waveai_main.ConversationArchiver(str(tmp_path), default_days=30, batch_size=3)
+    add_conversations(user, 'kai', [40, 41, 42, 43])
+    add_conversations(user, 'alex', [40, 5])
+
+    assert archiver.archive_user(user.id, datetime.utcnow() - timedelta(days=30)) == 5
+
+    entries = {entry.agent_type: entry for entry in ConversationArchive.query.filter_by(user_id=user.id)}
+    assert sum(entry.row_count for entry in entries.values()) == 5
+    assert entries['alex'].row_count == 1
+    assert entries['kai'].first_at < entries['kai'].last_at
+    assert Conversation.query.filter_by(user_id=user.id).count() == 1
+
+
+def test_delete_delay_applies_without_archiving(user, tmp_path):
+    archiver = waveai_main.ConversationArchiver(str(tmp_path), default_days=0)
+    db.session.add(AISettings(user_id=user.id, delete_after_days=10))
+    add_conversations(user, 'kai', [20, 15, 2])
+
+    assert archiver.archive() == 0
+    archiver.purge()
+
+    remaining = Conversation.query.filter_by(user_id=user.id).all()
+    assert [conversation.message for conversation in remaining] == ['question 2']
+
+
+def test_undated_rows_do_not_block_archiving(user, tmp_path):
+    archiver = waveai_main.ConversationArchiver(str(tmp_path), default_days=30)
+    add_conversations(user, 'kai', [40, 41])
+    undated = Conversation(user_id=user.id, agent_type='kai', message='sans date', response='')
+    db.session.add(undated)
+    db.session.commit()
+    Conversation.query.filter_by(id=undated.id).update({'created_at': None})
+    db.session.commit()
+
+    assert archiver.archive_user(user.id, datetime.utcnow() - timedelta(days=30)) == 2
+    assert [c.message for c in Conversation.query.filter_by(user_id=user.id)] == ['sans date']
@@ -0,0 +1,63 @@
+"""Résumé de l'historique d'un fil quand la fenêtre glisse"""
+
+from collections import deque
+
+import waveai_main
+
+
+def fill(turns, indexes):
+    for index in indexes:
+        turns.append((f"question numéro {index:02d} " * 3, f"réponse numéro {index:02d} " * 3))
+
+
+def assert_window_follows_summary(summary, recent):
+    # L'échange juste avant la fenêtre récente doit figurer dans le résumé
+    previous = int(recent[0][0].split()[2]) - 1
+    assert summary and f"question numéro {previous:02d}" in summary
+
+
+def test_summary_follows_the_sliding_window():
+    turns = deque(maxlen=10)
+    cache = waveai_main.SnapshotCache(ttl=3600)
+    budgets = {'openai': 200}
+
+    fill(turns, range(10))
+    summary, recent = waveai_main.ConversationContext((1, 'fil'), turns, budgets, cache).for_model('openai')
+    assert_window_follows_summary(summary, recent)
+
+    # Historique plein : le nombre d'échanges résumés ne change plus
+    fill(turns, range(10, 13))
+    new_summary, new_recent = waveai_main.ConversationContext((1, 'fil'), turns, budgets, cache).for_model('openai')
+
+    assert len(new_recent) == len(recent)
+    assert new_summary != summary
+    assert_window_follows_summary(new_summary, new_recent)
+
+
+def history(user_id, thread_id):
+    return [message for message, _ in waveai_main.get_conversation_context(user_id, thread_id).turns]
+
+
+def test_history_follows_other_workers_and_queued_rows(monkeypatch):
+    user_id, thread_id = 501, 'fil-partage'
+    with waveai_main.app.app_context():
+        assert history(user_id, thread_id) == []
+
+        # Échange traité par un autre worker : déjà en base, absent de la copie locale
+        waveai_main.db.session.add(waveai_main.Conversation(
+            user_id=user_id, agent_type='kai', thread_id=thread_id, message='autre worker', response='ok'
+        ))
+        waveai_main.db.session.commit()
+        assert history(user_id, thread_id) == ['autre worker']
+
+        # Échange encore dans la file d'écriture différée, copie locale perdue (autre cache)
+        writer = waveai_main.ConversationWriter()
+        writer.queue.put(writer.prepare({'user_id': user_id, 'agent_type': 'kai', 'thread_id': thread_id,
+                                         'message': 'en file', 'response': 'ok'}))
+        monkeypatch.setattr(waveai_main, 'conversation_writer', writer)
+        waveai_main.thread_history.invalidate((user_id, thread_id))
+        assert history(user_id, thread_id) == ['autre worker', 'en file']
+
+        # Écrit en base entre-temps : ni perdu ni dupliqué
+        writer.flush()
+        assert history(user_id, thread_id) == ['autre worker', 'en file']
@@ -0,0 +1,56 @@
+"""Déversement sur disque de l'écriture différée des conversations"""
+
+import json
+import os
+
+import waveai_main
+
+
+def make_writer(tmp_path):
+    return waveai_main.ConversationWriter(spill_path=str(tmp_path / 'spill.jsonl'))
+
+
+def test_spill_goes_to_a_file_per_process(tmp_path):
+    writer = make_writer(tmp_path)
+    writer.spill([{'user_id': 1, 'agent_type': 'kai', 'message': 'a', 'response': 'b'}])
+
+    assert os.path.exists(f"{writer.spill_path}.{os.getpid()}")
+
+
+def test_replay_skips_bad_lines_and_keeps_them_aside(tmp_path):
+    writer = make_writer(tmp_path)
+    good = {'user_id': 1, 'agent_type': 'kai', 'message': 'a', 'response': 'b', 'created_at': '2024-01-01T00:00:00'}
+    with open(f"{writer.spill_path}.{os.getpid()}", 'w', encoding='utf-8') as handle:
+        handle.write(json.dumps(good) + '\n{"user_id": 1, "mess\n' + json.dumps(good) + '\n')
+
+    writer.load_spill()
+
+    assert writer.queue.qsize() == 2
+    assert os.path.exists(f"{writer.spill_path}.bad")
+    assert not os.path.exists(f"{writer.spill_path}.{os.getpid()}")
+
+
+def test_replay_leaves_files_of_live_processes(tmp_path):
+    writer = make_writer(tmp_path)
+    other = f"{writer.spill_path}.{os.getppid()}"
+    with open(other, 'w', encoding='utf-8') as handle:
+        handle.write('{}\n')
+
+    writer.load_spill()
+
+    assert os.path.exists(other)
+    assert writer.queue.qsize() == 0
+
+
+def test_usage_ledger_spills_through_the_generic_writer(tmp_path):
+    ledger = waveai_main.UsageLedger(spill_path=str(tmp_path / 'usage.jsonl'))
+    assert not isinstance(ledger, waveai_main.ConversationWriter)
+
+    row = ledger.prepare({'user_id': 1, 'agent_type': 'kai', 'provider': 'openai', 'model': 'gpt',
+                          'prompt_tokens': 3, 'completion_tokens': 4, 'cost': 0.0})
+    ledger.spill([row])
+    ledger.load_spill()
+
+    replayed = ledger.queue.get_nowait()
+    assert replayed == row
+    assert 'thread_id' not in replayed and 'updated_at' not in replayed
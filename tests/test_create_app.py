@@ -0,0 +1,24 @@
+"""create_app(config) : refus des clés qui resteraient sans effet"""
+
+import pytest
+
+import waveai_main
+
+
+@pytest.mark.parametrize('key, value', [
+    ('SQLALCHEMY_DATABASE_URI', 'sqlite://'),
+    ('MAX_INFLIGHT_CHATS', 1),
+    ('RATE_LIMIT_PATH', '/tmp/limits.db'),
+])
+def test_import_time_keys_are_rejected(key, value, monkeypatch):
+    monkeypatch.setitem(waveai_main.app.extensions, 'waveai_started', False)
+    with pytest.raises(ValueError, match=key):
+        waveai_main.create_app(config={key: value})
+    assert waveai_main.app.config.get(key) != value
+
+
+def test_config_after_start_is_rejected(monkeypatch):
+    monkeypatch.setitem(waveai_main.app.extensions, 'waveai_started', True)
+    assert waveai_main.create_app() is waveai_main.app
+    with pytest.raises(ValueError, match='déjà appelé'):
+        waveai_main.create_app(config={'STARTUP_BUDGET_MS': 1})
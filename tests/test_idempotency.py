@@ -0,0 +1,63 @@
+"""Rejeu des requêtes idempotentes : même nature, même code HTTP"""
+
+import pytest
+
+import waveai_main
+
+
+@pytest.fixture
+def client():
+    waveai_main.app.config['TESTING'] = True
+    with waveai_main.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['user_id'] = 7
+        yield client
+
+
+def test_queued_job_is_replayed_as_202(client):
+    headers = {'Idempotency-Key': 'job-replay', 'Prefer': 'respond-async'}
+    body = {'message': 'Bonjour', 'agent_type': 'kai'}
+
+    first = client.post('/api/chat', json=body, headers=headers)
+    assert first.status_code == 202
+
+    again = client.post('/api/chat', json=body, headers=headers)
+    assert again.status_code == 202
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert again.headers['Location'] == first.headers['Location']
+    assert again.get_json()['job_id'] == first.get_json()['job_id']
+
+    # Le même envoi sur le flux ne doit ni échouer ni créer un second travail
+    stream = client.post('/api/chat/stream', json=body, headers=headers)
+    assert stream.status_code == 202
+    assert stream.get_json()['job_id'] == first.get_json()['job_id']
+
+
+def test_chat_response_is_replayed_on_the_stream(client):
+    payload = {'success': True, 'response': 'Salut !', 'agent': 'kai', 'model': 'test', 'thread_id': 'fil'}
+    fingerprint = waveai_main.request_fingerprint({}, 'Salut', 'kai')
+    waveai_main.remember_response(7, 'chat-replay', fingerprint, payload)
+
+    stream = client.post('/api/chat/stream', json={'message': 'Salut', 'agent_type': 'kai'},
+                         headers={'Idempotency-Key': 'chat-replay'})
+    body = stream.get_data(as_text=True)
+    assert stream.status_code == 200
+    assert 'event: token' in body and 'Salut !' in body and 'event: done' in body
+
+    replay = client.post('/api/chat', json={'message': 'Salut', 'agent_type': 'kai'},
+                         headers={'Idempotency-Key': 'chat-replay'})
+    assert replay.status_code == 200
+    assert replay.get_json() == payload
+
+
+def test_reused_key_with_another_request_is_rejected(client):
+    headers = {'Idempotency-Key': 'reused-key', 'Prefer': 'respond-async'}
+    first = client.post('/api/chat', json={'message': 'Bonjour', 'agent_type': 'kai'}, headers=headers)
+    assert first.status_code == 202
+
+    for url, body in (('/api/chat', {'message': 'Autre chose', 'agent_type': 'kai'}),
+                      ('/api/chat', {'message': 'Bonjour', 'agent_type': 'alex'}),
+                      ('/api/chat/stream', {'message': 'Bonjour', 'agent_type': 'kai', 'thread_id': 'autre-fil'})):
+        response = client.post(url, json=body, headers=headers)
+        assert response.status_code == 422
+        assert 'Idempotent-Replayed' not in response.headers
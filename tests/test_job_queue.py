@@ -0,0 +1,42 @@
+"""File de travaux SQLite : réclamation et reprise des baux expirés"""
+
+import time
+
+import waveai_main
+
+
+def make_queue(tmp_path, **options):
+    queue = waveai_main.JobQueue(str(tmp_path / 'jobs.db'), workers=0, **options)
+    queue.register('echo', lambda user_id, payload: {'echo': payload['text']})
+    return queue
+
+
+def test_idle_claim_takes_no_write_lock(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.connect().close()
+
+    # Un autre processus tient le verrou d'écriture : une file vide ne doit pas attendre
+    blocker = queue.connect()
+    blocker.execute('BEGIN IMMEDIATE')
+    try:
+        started = time.monotonic()
+        assert queue.claim() is None
+        assert time.monotonic() - started < 1
+    finally:
+        blocker.execute('ROLLBACK')
+        blocker.close()
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = make_queue(tmp_path, lease=0)
+    job_id = queue.enqueue('echo', 1, {'text': 'bonjour'})
+
+    assert queue.claim()[0] == job_id
+    time.sleep(0.01)
+    # Bail expiré (processus mort) : le travail est repris
+    assert queue.claim()[0] == job_id
+
+    queue.finish(job_id, result={'echo': 'bonjour'})
+    assert queue.claim() is None
+    assert queue.get(job_id, 1)['status'] == 'done'
+
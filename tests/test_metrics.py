@@ -0,0 +1,42 @@
+"""Agrégation des métriques entre workers"""
+
+import json
+import os
+import subprocess
+import sys
+
+import waveai_main
+
+
+def test_dead_worker_gauges_are_ignored(tmp_path):
+    # pid d'un processus terminé
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+
+    snapshot = {
+        'counters': [['waveai_requests_total', [], 3]],
+        'gauges': [['waveai_inflight', [], 5]],
+        'histograms': []
+    }
+    (tmp_path / f'metrics_{child.pid}.json').write_text(json.dumps(snapshot))
+
+    metrics = waveai_main.Metrics(directory=str(tmp_path))
+    metrics.describe('waveai_inflight', 'gauge', 'Requêtes en cours')
+    metrics.set('waveai_inflight', 1)
+    metrics.inc('waveai_requests_total', 2)
+
+    text = metrics.render()
+    assert 'waveai_inflight 1' in text
+    # Les compteurs du worker terminé restent dans le total
+    assert 'waveai_requests_total 5' in text
+    assert os.path.exists(tmp_path / f'metrics_{os.getpid()}.json')
+
+    # Fichier du worker terminé regroupé puis supprimé, sans changer les totaux
+    assert not os.path.exists(tmp_path / f'metrics_{child.pid}.json')
+    assert os.path.exists(tmp_path / 'metrics_aggregate.json')
+    assert 'waveai_requests_total 5' in metrics.render()
+
+
+def test_label_values_are_escaped():
+    labels = (('path', 'a\\b"c\nd'),)
+    assert waveai_main.format_labels(labels) == '{path="a\\\\b\\"c\\nd"}'
@@ -0,0 +1,25 @@
+"""Cache des paramètres IA : une copie plus ancienne que la version connue est relue"""
+
+from datetime import datetime, timedelta
+
+import waveai_main
+
+
+def test_stale_snapshot_is_reloaded():
+    with waveai_main.app.app_context():
+        user = waveai_main.User(email='cache@waveai.test', name='Cache')
+        waveai_main.db.session.add(user)
+        waveai_main.db.session.commit()
+
+        settings = waveai_main.get_cached_settings(user.id)
+        assert settings.temperature == 0.7
+
+        # Sauvegarde traitée par un autre worker : ce cache n'est pas invalidé
+        row = waveai_main.AISettings.query.filter_by(user_id=user.id).first()
+        row.temperature = 0.2
+        row.updated_at = settings.updated_at + timedelta(seconds=1)
+        waveai_main.db.session.commit()
+
+        assert waveai_main.get_cached_settings(user.id).temperature == 0.7
+        version = waveai_main.settings_version(row)
+        assert waveai_main.get_cached_settings(user.id, version).temperature == 0.2
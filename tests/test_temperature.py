@@ -0,0 +1,76 @@
+"""Température effective : une valeur de 0.0 reste 0.0 jusqu'au fournisseur"""
+
+from types import SimpleNamespace
+
+
+def make_settings(temperature):
+    return SimpleNamespace(
+        user_id=1, temperature=temperature, max_tokens=None, default_model='openai',
+        openai_api_key='sk-test', anthropic_api_key=None, huggingface_token=None
+    )
+
+
+def test_zero_temperature_reaches_openai(ai_system, monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        message = SimpleNamespace(content='Réponse')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    fake_openai = SimpleNamespace(ChatCompletion=SimpleNamespace(create=create))
+    monkeypatch.setitem(ai_system.sdks, 'openai', fake_openai)
+
+    result = ai_system.get_openai_response('Bonjour', 'kai', make_settings(0.0))
+
+    assert result['response'] == 'Réponse'
+    assert calls[0]['temperature'] == 0.0
+
+
+def test_zero_temperature_reaches_huggingface(ai_system):
+    agent = ai_system.get_agent('kai')
+    _, payload = ai_system.build_huggingface_request('Bonjour', agent, make_settings(0.0))
+
+    assert payload['parameters']['temperature'] == 0.0
+    assert payload['parameters']['do_sample'] is False
+
+
+def test_missing_temperature_uses_agent_default(ai_system):
+    agent = ai_system.get_agent('kai')
+    assert ai_system.get_temperature(agent, make_settings(None)) == agent['temperature']
+
+
+def test_cache_only_for_deterministic_temperature(ai_system):
+    assert ai_system.get_cache_key('Bonjour', 'kai', make_settings(0.0)) is not None
+    assert ai_system.get_cache_key('Bonjour', 'kai', make_settings(0.7)) is None
+
+
+def test_generation_params_use_agent_defaults_only_when_unset(ai_system):
+    agent = ai_system.get_agent('kai')
+    settings = make_settings(0.0)
+
+    max_tokens, temperature = ai_system.get_generation_params(agent, 'openai', settings)
+    assert (max_tokens, temperature) == (agent['max_tokens'], 0.0)
+
+    settings.max_tokens = 200
+    assert ai_system.get_generation_params(agent, 'openai', settings)[0] == 200
+
+    settings.max_tokens = 10 ** 6
+    assert ai_system.get_generation_params(agent, 'openai', settings)[0] == agent['max_tokens_limit']['openai']
+
+
+def test_fallback_answer_is_not_served_under_the_preferred_provider(ai_system, monkeypatch):
+    monkeypatch.setattr(ai_system, 'cache_enabled', True)
+    settings = make_settings(0.0)
+    message = 'Quelle est la capitale de la France ?'
+    assert ai_system.get_provider_order(settings, 'kai')[0] == 'openai'
+
+    # Réponse d'un fournisseur de repli : rangée sous ce fournisseur seulement
+    ai_system.cache_response({'success': True, 'response': 'Paris (repli)', 'model': 'huggingface'},
+                             message, 'kai', settings)
+    assert ai_system.response_cache.get(ai_system.get_cache_key(message, 'kai', settings)) is None
+    assert ai_system.response_cache.get(
+        ai_system.get_cache_key(message, 'kai', settings, provider='huggingface'))['response'] == 'Paris (repli)'
+
+    ai_system.cache_response({'success': True, 'response': 'Paris', 'model': 'openai'}, message, 'kai', settings)
+    assert ai_system.response_cache.get(ai_system.get_cache_key(message, 'kai', settings))['response'] == 'Paris'
@@ -6,19 +6,59 @@ import os
 import logging
 import secrets
 import re
+import json
+import time
+import math
+import random
+import hashlib
+import sqlite3
+import unicodedata
+import queue
+import uuid
+import glob
+import gzip
+import mimetypes
+import base64
+import atexit
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from types import SimpleNamespace
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (développement local) : pas de verrou d'archivage entre workers
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:
+    # Variantes brotli optionnelles (pip install brotli), gzip sinon
+    brotli = None
+
+# Début de l'import du module (budget de démarrage des workers)
+IMPORT_STARTED = time.perf_counter()
 
 # CORRECTION: Import ordre optimisé pour éviter conflits SQLAlchemy
 try:
     # Flask Core
-    from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+    from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, stream_with_context, g, has_request_context
     
     # SQLAlchemy avec version fixée
     from flask_sqlalchemy import SQLAlchemy
+    from flask_sqlalchemy.session import Session as FlaskSession
     from flask_migrate import Migrate
     
     # Sécurité
     from werkzeug.security import generate_password_hash, check_password_hash
+    from markupsafe import escape
+    from jinja2 import FileSystemBytecodeCache
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
     
 except ImportError as e:
     print(f"Erreur d'import: {e}")
@@ -37,14 +77,171 @@ if database_url.startswith('postgres://'):
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,
-    'pool_recycle': 300,
+    # Le ping à chaque emprunt coûte un aller-retour : désactivable si pool_recycle suffit
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 300)),
 }
+
+# Pool par worker : une connexion par requête simultanée du modèle gunicorn
+if not database_url.startswith('sqlite'):
+    worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+    default_pool_size = {'sync': 2, 'gevent': 20}.get(worker_class, int(os.environ.get('GUNICORN_THREADS', 8)))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', default_pool_size)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    })
+
+# Durée maximale d'une requête SQL (PostgreSQL), 0 pour désactiver
+statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+if statement_timeout and database_url.startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+
+# Réplique en lecture optionnelle (dashboard, paramètres, historique)
+replica_url = os.environ.get('DATABASE_REPLICA_URL')
+if replica_url:
+    if replica_url.startswith('postgres://'):
+        replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+    app.config['SQLALCHEMY_BINDS'] = {'replica': replica_url}
+# Après une écriture, les lectures de l'utilisateur restent sur le primaire (retard de réplication)
+app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 
+# Connexions sortantes vers les fournisseurs IA
+app.config['PROVIDER_POOL_SIZE'] = int(os.environ.get('PROVIDER_POOL_SIZE', 10))
+app.config['PROVIDER_MAX_WORKERS'] = int(os.environ.get('PROVIDER_MAX_WORKERS', 16))
+app.config['PROVIDER_TIMEOUTS'] = {
+    'openai': float(os.environ.get('OPENAI_TIMEOUT', 30)),
+    'anthropic': float(os.environ.get('ANTHROPIC_TIMEOUT', 30)),
+    'huggingface': float(os.environ.get('HUGGINGFACE_TIMEOUT', 15)),
+    'ollama': float(os.environ.get('OLLAMA_TIMEOUT', 2)),
+}
+
+# Sonde Ollama en arrière-plan (secondes entre deux vérifications)
+app.config['OLLAMA_PROBE_INTERVAL'] = float(os.environ.get('OLLAMA_PROBE_INTERVAL', 30))
+
+# Cache local des profils et paramètres utilisateur (secondes)
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 300))
+
+# Écriture différée et groupée des conversations
+app.config['CONVERSATION_WRITE_BEHIND'] = os.environ.get('CONVERSATION_WRITE_BEHIND', 'true').lower() == 'true'
+app.config['CONVERSATION_BATCH_SIZE'] = int(os.environ.get('CONVERSATION_BATCH_SIZE', 50))
+app.config['CONVERSATION_FLUSH_INTERVAL'] = float(os.environ.get('CONVERSATION_FLUSH_INTERVAL', 1.0))
+app.config['CONVERSATION_SPILL_PATH'] = os.environ.get('CONVERSATION_SPILL_PATH', 'conversations_spill.jsonl')
+
+# Comptabilité des tokens : registre des appels écrit par lots, quotas quotidiens (0 = illimité)
+app.config['USAGE_BATCH_SIZE'] = int(os.environ.get('USAGE_BATCH_SIZE', 200))
+app.config['USAGE_FLUSH_INTERVAL'] = float(os.environ.get('USAGE_FLUSH_INTERVAL', 5.0))
+app.config['USAGE_SPILL_PATH'] = os.environ.get('USAGE_SPILL_PATH', 'usage_spill.jsonl')
+app.config['USAGE_DAILY_TOKEN_QUOTA'] = int(os.environ.get('USAGE_DAILY_TOKEN_QUOTA', 0))
+app.config['USAGE_DAILY_COST_QUOTA'] = float(os.environ.get('USAGE_DAILY_COST_QUOTA', 0))
+app.config['USAGE_QUOTA_REFRESH'] = float(os.environ.get('USAGE_QUOTA_REFRESH', 60))
+
+# Prix en dollars pour 1000 tokens [entrée, sortie] par modèle (USAGE_PRICES en JSON pour compléter)
+app.config['USAGE_PRICES'] = {
+    'gpt-3.5-turbo': [0.0015, 0.002],
+    'gpt-4': [0.03, 0.06],
+    'claude-instant-1.2': [0.0008, 0.0024],
+    'claude-2': [0.008, 0.024],
+}
+app.config['USAGE_PRICES'].update(json.loads(os.environ.get('USAGE_PRICES') or '{}'))
+
+# Historique des fils de discussion envoyé aux modèles (budgets en tokens)
+app.config['CONTEXT_TOKEN_BUDGETS'] = {
+    'openai': int(os.environ.get('CONTEXT_TOKENS_OPENAI', 2000)),
+    'anthropic': int(os.environ.get('CONTEXT_TOKENS_ANTHROPIC', 4000)),
+    'huggingface': 0,
+}
+app.config['CONTEXT_MAX_TURNS'] = int(os.environ.get('CONTEXT_MAX_TURNS', 50))
+
+# Registre des agents (fichier JSON rechargé à chaud, 0 = pas de rechargement)
+app.config['AGENTS_CONFIG'] = os.environ.get('AGENTS_CONFIG', os.path.join(app.root_path, 'agents.json'))
+app.config['AGENTS_RELOAD_INTERVAL'] = float(os.environ.get('AGENTS_RELOAD_INTERVAL', 5))
+
+# Cache des réponses pour les messages identiques
+app.config['RESPONSE_CACHE'] = {
+    'enabled': os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true',
+    'ttl': float(os.environ.get('RESPONSE_CACHE_TTL', 3600)),
+    'max_entries': int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+    'max_bytes': int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 10 * 1024 * 1024)),
+    'path': os.environ.get('RESPONSE_CACHE_PATH'),
+    'max_temperature': float(os.environ.get('RESPONSE_CACHE_MAX_TEMPERATURE', 0.0)),
+}
+
+# Limitation de débit (seaux à jetons) et admission des appels de chat
+app.config['RATE_LIMITS'] = {
+    'user': (float(os.environ.get('RATE_LIMIT_USER_PER_MINUTE', 20)), int(os.environ.get('RATE_LIMIT_USER_BURST', 10))),
+    'provider': (float(os.environ.get('RATE_LIMIT_PROVIDER_PER_MINUTE', 120)), int(os.environ.get('RATE_LIMIT_PROVIDER_BURST', 30))),
+}
+app.config['RATE_LIMIT_PATH'] = os.environ.get('RATE_LIMIT_PATH')
+app.config['MAX_INFLIGHT_CHATS'] = int(os.environ.get('MAX_INFLIGHT_CHATS', 32))
+app.config['ADMISSION_WAIT'] = float(os.environ.get('ADMISSION_WAIT', 2.0))
+
+# Mode asynchrone de /api/chat : file de travaux SQLite traitée par des threads
+# (CHAT_JOB_MODE : optional = au choix du client, always, off)
+app.config['CHAT_JOB_MODE'] = os.environ.get('CHAT_JOB_MODE', 'optional')
+app.config['JOB_QUEUE_PATH'] = os.environ.get('JOB_QUEUE_PATH', 'jobs.db')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['JOB_LEASE'] = float(os.environ.get('JOB_LEASE', 120))
+app.config['JOB_RESULT_TTL'] = float(os.environ.get('JOB_RESULT_TTL', 3600))
+app.config['JOB_QUEUE_MAX'] = int(os.environ.get('JOB_QUEUE_MAX', 1000))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+
+# Canal de statut poussé (/api/status/stream) : un flux SSE occupe un thread
+# gthread pendant sa durée de vie, d'où une limite par worker ; sous gevent
+# un flux ne coûte qu'une connexion. Au-delà, les pages interrogent /api/status.
+app.config['STATUS_CHECK_INTERVAL'] = float(os.environ.get('STATUS_CHECK_INTERVAL', 5))
+app.config['STATUS_HEARTBEAT'] = float(os.environ.get('STATUS_HEARTBEAT', 25))
+app.config['STATUS_STREAM_TTL'] = float(os.environ.get('STATUS_STREAM_TTL', 300))
+app.config['STATUS_STREAM_MAX'] = int(os.environ.get('STATUS_STREAM_MAX', {
+    'sync': 0,
+    'gevent': int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200)) // 2
+}.get(os.environ.get('WORKER_CLASS', 'gthread'), max(1, int(os.environ.get('GUNICORN_THREADS', 8)) // 4))))
+
+# Assets statiques versionnés et cache de bytecode Jinja partagé entre workers
+app.config['ASSET_MAX_AGE'] = int(os.environ.get('ASSET_MAX_AGE', 31536000))
+app.config['JINJA_CACHE_DIR'] = os.environ.get('JINJA_CACHE_DIR')
+
+# Archivage des conversations anciennes vers des fichiers JSONL gzip (0 jour = désactivé)
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 0))
+app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR', 'archives')
+app.config['ARCHIVE_INTERVAL'] = float(os.environ.get('ARCHIVE_INTERVAL', 3600))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+
+# Démarrage des workers : create_app() journalise un dépassement du budget
+app.config['STARTUP_BUDGET_MS'] = int(os.environ.get('STARTUP_BUDGET_MS', 3000))
+
+# Métriques Prometheus (/metrics) ; METRICS_DIR agrège les workers gunicorn
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# Disjoncteurs par fournisseur / clé API
+app.config['BREAKER_CONFIG'] = {
+    'window': int(os.environ.get('BREAKER_WINDOW', 20)),
+    'failure_threshold': int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5)),
+    'error_rate': float(os.environ.get('BREAKER_ERROR_RATE', 0.5)),
+    'cooldown': float(os.environ.get('BREAKER_COOLDOWN', 30)),
+    'half_open_probes': int(os.environ.get('BREAKER_HALF_OPEN_PROBES', 1)),
+}
+
+class RoutingSession(FlaskSession):
+    """Session qui envoie les lectures marquées par read_replica() à la réplique
+
+    Les écritures (flush) et tout ce qui n'est pas dans read_replica() vont
+    au primaire.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('replica') and not self._flushing:
+            engine = self._db.engines.get('replica')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 # Initialisation avec gestion d'erreur
 try:
-    db = SQLAlchemy(app)
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
     migrate = Migrate(app, db)
 except Exception as e:
     print(f"Erreur initialisation SQLAlchemy: {e}")
@@ -54,11 +251,290 @@ except Exception as e:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# =============================================================================
+# MÉTRIQUES
+# =============================================================================
+
+class Metrics:
+    """Compteurs et histogrammes au format texte Prometheus
+
+    Avec un répertoire partagé, chaque worker y écrit périodiquement son
+    instantané (un fichier par pid) et /metrics additionne tous les fichiers.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def describe(self, name, kind, help_text):
+        self.descriptions[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self.start()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for index, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+        self.start()
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_collector(self, collector):
+        """Fonction appelée avant chaque instantané pour mettre à jour des jauges"""
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Erreur collecte métriques: {e}")
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, list(labels), list(h[0]), h[1], h[2]] for (name, labels), h in self.histograms.items()]
+            }
+
+    # Agrégation multi-workers -------------------------------------------------
+
+    def start(self):
+        """Démarre l'écriture périodique de l'instantané (une fois par worker)"""
+        if not self.directory or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self.run, name='waveai-metrics', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        try:
+            path = os.path.join(self.directory, f'metrics_{os.getpid()}.json')
+            with open(path + '.tmp', 'w', encoding='utf-8') as handle:
+                json.dump(self.snapshot(), handle)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            logger.error(f"Erreur écriture métriques: {e}")
+
+    def collect(self):
+        """Instantanés de tous les workers (ou du seul processus courant)
+
+        Les compteurs d'un worker terminé restent comptés ; ses jauges, qui
+        décrivent un état disparu avec lui, sont écartées.
+        """
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+        try:
+            self.fold_dead_workers()
+        except Exception as e:
+            logger.error(f"Erreur regroupement métriques: {e}")
+
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path, encoding='utf-8') as handle:
+                    snapshot = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            pid = os.path.basename(path)[len('metrics_'):-len('.json')]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_alive(int(pid)):
+                snapshot['gauges'] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def fold_dead_workers(self):
+        """Regroupe les fichiers des workers terminés dans metrics_aggregate.json
+
+        Leurs compteurs et histogrammes y sont additionnés puis leurs
+        fichiers supprimés : le répertoire ne grossit plus à chaque
+        recyclage de worker, et les totaux ne reculent pas.
+        """
+        dead = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            pid = os.path.basename(path)[len('metrics_'):-len('.json')]
+            if pid.isdigit() and int(pid) != os.getpid() and not process_alive(int(pid)):
+                dead.append(path)
+        if not dead:
+            return
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            aggregate_path = os.path.join(self.directory, 'metrics_aggregate.json')
+            snapshots = []
+            for path in [aggregate_path] + dead:
+                try:
+                    with open(path, encoding='utf-8') as handle:
+                        snapshots.append(json.load(handle))
+                except FileNotFoundError:
+                    continue
+                except ValueError:
+                    logger.error(f"Fichier de métriques illisible ignoré: {path}")
+
+            counters, histograms = self.merge(snapshots, gauges=False)
+            with open(aggregate_path + '.tmp', 'w', encoding='utf-8') as handle:
+                json.dump({
+                    'counters': [[name, [list(pair) for pair in labels], value] for (name, labels), value in counters.items()],
+                    'gauges': [],
+                    'histograms': [[name, [list(pair) for pair in labels], buckets, total, count]
+                                   for (name, labels), (buckets, total, count) in histograms.items()]
+                }, handle)
+            os.replace(aggregate_path + '.tmp', aggregate_path)
+            for path in dead:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def merge(self, snapshots, gauges=True):
+        """Additionne des instantanés : ({(nom, labels): valeur}, {(nom, labels): histogramme})"""
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            # Les jauges (connexions du pool...) s'additionnent aussi entre workers
+            values = snapshot['counters'] + (snapshot.get('gauges', []) if gauges else [])
+            for name, labels, value in values:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, total, count in snapshot['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                merged = histograms.setdefault(key, [[0] * len(self.BUCKETS), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms
+
+    def render(self):
+        """Texte d'exposition Prometheus, agrégé sur les workers"""
+        counters, histograms = self.merge(self.collect())
+
+        lines = []
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+        for name in names:
+            kind, help_text = self.descriptions.get(name, ('counter' if any(n == name for n, _ in counters) else 'histogram', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(self.BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", repr(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+def escape_label_value(value):
+    """Échappement d'une valeur de label Prometheus : antislash, guillemet, saut de ligne"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label_value(value)}"' for key, value in labels) + '}'
+
+@contextmanager
+def timed_phase(phase):
+    """Mesure une étape du traitement d'une requête de chat"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('waveai_chat_phase_duration_seconds', time.perf_counter() - started, phase=phase)
+
+metrics = Metrics(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+atexit.register(metrics.flush)
+metrics.describe('waveai_http_request_duration_seconds', 'histogram', 'Durée des requêtes HTTP par route')
+metrics.describe('waveai_chat_phase_duration_seconds', 'histogram', 'Durée des étapes de /api/chat')
+metrics.describe('waveai_provider_request_duration_seconds', 'histogram', 'Durée des appels aux fournisseurs IA')
+metrics.describe('waveai_provider_attempts_total', 'counter', 'Tentatives par fournisseur et résultat')
+metrics.describe('waveai_agent_response_duration_seconds', 'histogram', 'Durée de génération par agent')
+metrics.describe('waveai_responses_total', 'counter', 'Réponses servies par modèle (dont fallback / emergency_fallback)')
+metrics.describe('waveai_tokens_total', 'counter', 'Tokens consommés par fournisseur et type (prompt / completion)')
+metrics.describe('waveai_db_query_duration_seconds', 'histogram', 'Durée des requêtes SQL par type')
+metrics.describe('waveai_startup_duration_seconds', 'histogram', 'Durée de démarrage des workers (import, create_app)')
+metrics.describe('waveai_db_pool_connections', 'gauge', 'Connexions du pool SQLAlchemy par base et état')
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if started:
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        metrics.observe('waveai_db_query_duration_seconds', time.perf_counter() - started.pop(), statement=kind)
+
+def collect_pool_usage():
+    """Jauges d'utilisation des pools de connexions (primaire et réplique)"""
+    with app.app_context():
+        engines = dict(db.engines)
+    for key, engine in engines.items():
+        pool = engine.pool
+        if not hasattr(pool, 'checkedout'):
+            continue
+        name = key or 'primary'
+        metrics.set('waveai_db_pool_connections', pool.size(), engine=name, state='size')
+        metrics.set('waveai_db_pool_connections', pool.checkedout(), engine=name, state='checked_out')
+        metrics.set('waveai_db_pool_connections', pool.checkedin(), engine=name, state='idle')
+        metrics.set('waveai_db_pool_connections', max(pool.overflow(), 0), engine=name, state='overflow')
+
+metrics.add_collector(collect_pool_usage)
+
 # =============================================================================
 # MODÈLES DE BASE DE DONNÉES - VERSION COMPATIBLE
 # =============================================================================
 
-class User(db.Model):
+class SnapshotMixin:
+    """Copie détachée d'une ligne, utilisable hors session et depuis d'autres threads"""
+
+    def snapshot(self):
+        return SimpleNamespace(**{column.name: getattr(self, column.name) for column in self.__table__.columns})
+
+class User(SnapshotMixin, db.Model):
     """Utilisateurs WaveAI"""
     __tablename__ = 'users'
     
@@ -78,7 +554,7 @@ class User(db.Model):
             'last_login': self.last_login.isoformat() if self.last_login else None
         }
 
-class AISettings(db.Model):
+class AISettings(SnapshotMixin, db.Model):
     """Paramètres IA utilisateur"""
     __tablename__ = 'ai_settings'
     
@@ -95,6 +571,14 @@ class AISettings(db.Model):
     use_ollama = db.Column(db.Boolean, default=True)
     temperature = db.Column(db.Float, default=0.7)
     max_tokens = db.Column(db.Integer, default=1000)
+
+    # Requêtes parallèles (hedging) entre fournisseurs
+    hedge_enabled = db.Column(db.Boolean, default=False)
+    hedge_delay_ms = db.Column(db.Integer, default=2500)
+
+    # Conservation de l'historique (None = valeur par défaut du serveur / jamais)
+    archive_after_days = db.Column(db.Integer)
+    delete_after_days = db.Column(db.Integer)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -102,15 +586,97 @@ class AISettings(db.Model):
 class Conversation(db.Model):
     """Conversations utilisateur"""
     __tablename__ = 'conversations'
+    __table_args__ = (
+        db.Index('ix_conversations_user_created', 'user_id', 'created_at'),
+        db.Index('ix_conversations_user_agent_created', 'user_id', 'agent_type', 'created_at', 'id'),
+        db.Index('ix_conversations_user_thread', 'user_id', 'thread_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     agent_type = db.Column(db.String(50), nullable=False)
+    thread_id = db.Column(db.String(36))
     message = db.Column(db.Text, nullable=False)
     response = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'agent': self.agent_type,
+            'thread_id': self.thread_id,
+            'message': self.message,
+            'response': self.response,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class UserAgentStats(db.Model):
+    """Statistiques précalculées par utilisateur et par agent"""
+    __tablename__ = 'user_agent_stats'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'agent_type', name='uq_user_agent_stats'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    agent_type = db.Column(db.String(50), nullable=False)
+    conversation_count = db.Column(db.Integer, nullable=False, default=0)
+    tokens_used = db.Column(db.Integer, nullable=False, default=0)
+    last_activity = db.Column(db.DateTime)
+
+class ConversationArchive(db.Model):
+    """Index des conversations archivées (un fichier par utilisateur et par mois)"""
+    __tablename__ = 'conversation_archives'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', 'agent_type', name='uq_conversation_archives'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    month = db.Column(db.String(7), nullable=False)
+    agent_type = db.Column(db.String(50), nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    first_at = db.Column(db.DateTime)
+    last_at = db.Column(db.DateTime)
+
+class UsageEvent(db.Model):
+    """Registre des appels fournisseurs (ajout seul, jamais modifié)"""
+    __tablename__ = 'usage_events'
+    __table_args__ = (
+        db.Index('ix_usage_events_user_created', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    agent_type = db.Column(db.String(50), nullable=False)
+    provider = db.Column(db.String(50), nullable=False)
+    model = db.Column(db.String(100))
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    estimated = db.Column(db.Boolean, default=False)
+    latency_ms = db.Column(db.Integer)
+    cost = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UsageDaily(db.Model):
+    """Consommation cumulée par utilisateur, jour et agent"""
+    __tablename__ = 'usage_daily'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'agent_type', name='uq_usage_daily'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    day = db.Column(db.Date, nullable=False)
+    agent_type = db.Column(db.String(50), nullable=False)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0.0)
+
 class AppVersion(db.Model):
     """Versions application"""
     __tablename__ = 'app_versions'
@@ -125,261 +691,3232 @@ class AppVersion(db.Model):
 # SYSTÈME IA WAVEAI - OPTIMISÉ
 # =============================================================================
 
-class WaveAISystem:
-    """Système IA WaveAI avec 5 agents spécialisés"""
-    
-    def __init__(self):
-        self.agents = {
-            'alex': {
-                'name': 'Alex',
-                'emoji': '🏢',
-                'speciality': 'Agent Productivité',
-                'description': 'Expert en emails, tâches et organisation professionnelle',
-                'color': '#1e40af',
-                'prompt': 'Tu es Alex, assistant IA spécialisé en productivité et organisation professionnelle. Tu aides avec les emails, la gestion des tâches, l\'optimisation du workflow et l\'organisation du travail.'
-            },
-            'lina': {
-                'name': 'Lina',
-                'emoji': '💼',
-                'speciality': 'Agent LinkedIn',
-                'description': 'Spécialiste du réseautage professionnel et LinkedIn',
-                'color': '#0077b5',
-                'prompt': 'Tu es Lina, experte en réseautage professionnel et LinkedIn. Tu aides à créer du contenu LinkedIn, développer son réseau professionnel, optimiser son profil et créer des posts engageants.'
-            },
-            'marco': {
-                'name': 'Marco',
-                'emoji': '📱',
-                'speciality': 'Agent Social',
-                'description': 'Expert réseaux sociaux et contenu viral',
-                'color': '#f97316',
-                'prompt': 'Tu es Marco, spécialiste des réseaux sociaux et du contenu viral. Tu aides à créer du contenu engageant, développer sa présence sociale, comprendre les tendances et optimiser sa stratégie sociale.'
-            },
-            'sofia': {
-                'name': 'Sofia',
-                'emoji': '📅',
-                'speciality': 'Agent Planning',
-                'description': 'Experte en calendriers et gestion du temps',
-                'color': '#7c3aed',
-                'prompt': 'Tu es Sofia, assistante spécialisée en gestion du temps et planification. Tu aides avec les calendriers, la programmation de rendez-vous, l\'organisation du temps et la gestion des priorités.'
-            },
-            'kai': {
-                'name': 'Kai',
-                'emoji': '💬',
-                'speciality': 'Agent Conversationnel',
-                'description': 'Compagnon IA pour discussions libres',
-                'color': '#059669',
-                'prompt': 'Tu es Kai, assistant IA conversationnel polyvalent. Tu peux discuter de tout, répondre aux questions générales, aider avec diverses tâches et être un compagnon IA amical et utile.'
+# API Hugging Face avec model plus stable
+HUGGINGFACE_API_URL = os.environ.get('HUGGINGFACE_API_URL', "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium")
+
+OLLAMA_API_URL = os.environ.get('OLLAMA_API_URL', "http://localhost:11434/api/tags")
+
+# Points d'entrée surchargeables (serveur simulé du benchmark, proxy d'entreprise)
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE', "https://api.openai.com/v1")
+ANTHROPIC_API_URL = os.environ.get('ANTHROPIC_API_URL')
+
+class CircuitBreaker:
+    """Disjoncteur d'un fournisseur IA
+
+    Fermé : les appels passent. Ouvert : les appels sont refusés pendant
+    cooldown secondes, après trop d'échecs consécutifs ou un taux d'erreur
+    trop élevé sur la fenêtre glissante. Semi-ouvert : quelques appels de
+    sonde décident de la refermeture ou d'une nouvelle ouverture.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window=20, failure_threshold=5, error_rate=0.5, cooldown=30, half_open_probes=1):
+        self.calls = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate
+        self.min_calls = max(1, window // 2)
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probes_in_flight = 0
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Indique si un appel peut être tenté maintenant"""
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self.probes_in_flight = 0
+
+            if self.state == self.HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    return False
+                self.probes_in_flight += 1
+
+            return True
+
+    def record(self, success, latency):
+        """Enregistre le résultat d'un appel autorisé par allow_request"""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+            self.calls.append((success, latency))
+
+            if success:
+                self.consecutive_failures = 0
+                if self.state == self.HALF_OPEN:
+                    self.state = self.CLOSED
+                    self.calls.clear()
+                    self.calls.append((success, latency))
+                return
+
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold \
+                    or (len(self.calls) >= self.min_calls and self.error_rate() >= self.error_rate_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def error_rate(self):
+        if not self.calls:
+            return 0.0
+        return sum(1 for success, _ in self.calls if not success) / len(self.calls)
+
+    def to_dict(self):
+        with self.lock:
+            latencies = [latency for _, latency in self.calls]
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'calls': len(self.calls),
+                'error_rate': round(self.error_rate(), 3),
+                'avg_latency_ms': round(sum(latencies) / len(latencies) * 1000) if latencies else None,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in_seconds': retry_in
             }
-        }
 
-    def check_ollama_availability(self):
-        """Vérifie la disponibilité d'Ollama"""
+class ConversationContext:
+    """Historique d'un fil de discussion, tronqué au budget de chaque modèle
+
+    Les échanges récents sont conservés tels quels tant qu'ils tiennent dans
+    le budget ; les plus anciens sont condensés en un résumé mis en cache.
+    """
+
+    def __init__(self, key, turns, budgets, summary_cache):
+        self.key = key
+        self.turns = list(turns)
+        self.budgets = budgets
+        self.summary_cache = summary_cache
+
+    def __bool__(self):
+        return bool(self.turns)
+
+    def for_model(self, provider):
+        """Retourne (résumé ou None, [(message, réponse), ...]) pour le fournisseur"""
+        budget = self.budgets.get(provider, 0)
+        if not budget or not self.turns:
+            return None, []
+
+        costs = [estimate_tokens(message) + estimate_tokens(response) for message, response in self.turns]
+        if sum(costs) <= budget:
+            return None, self.turns
+
+        # Réserver une part du budget au résumé des échanges les plus anciens
+        summary_budget = budget // 5
+        used = 0
+        start = len(self.turns)
+        while start > 0 and used + costs[start - 1] <= budget - summary_budget:
+            start -= 1
+            used += costs[start]
+
+        return self.summarize(start, summary_budget), self.turns[start:]
+
+    def summarize(self, count, max_tokens):
+        """Résumé extractif des count premiers échanges (en cache)
+
+        La clé porte sur les échanges résumés eux-mêmes : une fois l'historique
+        plein, count ne change plus alors que la fenêtre glisse.
+        """
+        if not count:
+            return None
+        covered = hashlib.sha256(repr((self.turns[0], self.turns[count - 1])).encode('utf-8')).hexdigest()[:16]
+        cache_key = (self.key, count, covered, max_tokens)
+        summary = self.summary_cache.get(cache_key)
+        if summary is not None:
+            return summary
+
+        lines = []
+        remaining = max_tokens * 4
+        # Les échanges les plus proches de la fenêtre récente sont prioritaires
+        for message, response in reversed(self.turns[:count]):
+            line = f"- Utilisateur : {shorten(message, 120)} / Assistant : {shorten(response, 160)}"
+            if len(line) > remaining:
+                break
+            lines.append(line)
+            remaining -= len(line) + 1
+
+        summary = "Résumé des échanges précédents :\n" + "\n".join(reversed(lines)) if lines else None
+        self.summary_cache.set(cache_key, summary)
+        return summary
+
+def shorten(text, limit):
+    """Première phrase du texte, tronquée à limit caractères"""
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1].rstrip() + '…'
+
+class ResponseCache:
+    """Cache LRU + TTL des réponses IA, limité en nombre d'entrées et en mémoire
+
+    Avec un chemin SQLite, un second niveau partagé permet aux différents
+    workers gunicorn de profiter des réponses déjà calculées.
+    """
+
+    def __init__(self, ttl=3600, max_entries=1000, max_bytes=10 * 1024 * 1024, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if self.path:
+            with self.connect() as connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS response_cache ('
+                    'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)'
+                )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.remove(key)
+
+        value = self.get_shared(key, now)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.store(key, value, now + self.ttl)
+        return value
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        self.store(key, value, expires_at)
+        self.set_shared(key, value, expires_at)
+
+    def store(self, key, value, expires_at):
+        size = len(json.dumps(value, ensure_ascii=False))
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, expires_at, size)
+            self.size += size
+
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def get_shared(self, key, now):
+        if not self.path:
+            return None
         try:
-            import requests
-            response = requests.get('http://localhost:11434/api/tags', timeout=2)
-            return response.status_code == 200
-        except Exception:
-            return False
+            with self.connect() as connection:
+                row = connection.execute(
+                    'SELECT value FROM response_cache WHERE key = ? AND expires_at > ?', (key, now)
+                ).fetchone()
+                if row:
+                    connection.execute('UPDATE response_cache SET last_used = ? WHERE key = ?', (now, key))
+                    return json.loads(row[0])
+        except Exception as e:
+            logger.error(f"Erreur cache partagé: {e}")
+        return None
 
-    def get_huggingface_response(self, message, agent_type, settings=None):
-        """Génère une réponse via Hugging Face (gratuit)"""
+    def set_shared(self, key, value, expires_at):
+        if not self.path:
+            return
         try:
-            import requests
-            
-            agent = self.agents.get(agent_type, self.agents['kai'])
-            
-            # Configuration headers
-            headers = {'Content-Type': 'application/json'}
-            if settings and settings.huggingface_token:
-                headers['Authorization'] = f'Bearer {settings.huggingface_token}'
+            with self.connect() as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), expires_at, time.time())
+                )
+                connection.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+                connection.execute(
+                    'DELETE FROM response_cache WHERE key IN ('
+                    'SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+        except Exception as e:
+            logger.error(f"Erreur cache partagé: {e}")
 
-            # API Hugging Face avec model plus stable
-            url = "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium"
-            
-            payload = {
-                "inputs": f"{agent['prompt']}\n\nUtilisateur: {message}\nAssistant:",
-                "parameters": {
-                    "max_length": min(settings.max_tokens if settings else 1000, 1000),
-                    "temperature": settings.temperature if settings else 0.7,
-                    "do_sample": True,
-                    "return_full_text": False
-                },
-                "options": {
-                    "wait_for_model": True
-                }
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'shared': bool(self.path)
             }
 
-            response = requests.post(url, headers=headers, json=payload, timeout=15)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if isinstance(result, list) and len(result) > 0:
-                    generated = result[0].get('generated_text', '').strip()
-                    if generated and generated != message:
-                        # Nettoyer la réponse
-                        clean_response = generated.replace(f"{agent['prompt']}", "").replace(f"Utilisateur: {message}", "").replace("Assistant:", "").strip()
-                        if clean_response:
-                            return {
-                                'success': True,
-                                'response': clean_response,
-                                'agent': agent_type,
-                                'model': 'huggingface',
-                                'timestamp': datetime.utcnow().isoformat()
-                            }
-                            
-        except Exception as e:
-            logger.error(f"Erreur Hugging Face: {e}")
-        
-        # Fallback response si API échoue
-        agent = self.agents.get(agent_type, self.agents['kai'])
+class RateLimiter:
+    """Seaux à jetons par clé (rate jetons par minute, capacité burst)
+
+    En mémoire par défaut ; avec un chemin SQLite, les seaux sont partagés
+    entre les workers gunicorn d'une même machine.
+    """
+
+    def __init__(self, per_minute=20, burst=10, path=None, max_keys=10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.path = path
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+        if self.path:
+            with sqlite3.connect(self.path, timeout=5) as connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+                )
+
+    def refill(self, tokens, updated, now):
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def acquire(self, key):
+        """Consomme un jeton ; retourne (autorisé, secondes avant le prochain jeton)"""
+        if self.rate <= 0:
+            return True, 0.0
+        if self.path:
+            try:
+                return self.acquire_shared(key)
+            except Exception as e:
+                logger.error(f"Erreur limiteur partagé: {e}")
+
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = self.refill(tokens, updated, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+
+            if len(self.buckets) > self.max_keys:
+                # Les seaux pleins n'apportent aucune information
+                for stale in [k for k, (t, u) in self.buckets.items() if self.refill(t, u, now) >= self.burst]:
+                    del self.buckets[stale]
+
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+    def acquire_shared(self, key):
+        now = time.time()
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT tokens, updated FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            tokens = self.refill(row[0], row[1], now) if row else float(self.burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            if random.random() < 0.01:
+                connection.execute('DELETE FROM rate_limits WHERE updated < ?', (now - 3600,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+        return allowed, 0.0 if allowed else (1 - tokens) / self.rate
+
+    def refund(self, key):
+        """Rend le jeton d'une requête finalement refusée pour une autre raison"""
+        if self.rate <= 0:
+            return
+        if self.path:
+            try:
+                connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+                try:
+                    connection.execute(
+                        'UPDATE rate_limits SET tokens = MIN(?, tokens + 1) WHERE key = ?', (float(self.burst), key)
+                    )
+                finally:
+                    connection.close()
+                return
+            except Exception as e:
+                logger.error(f"Erreur limiteur partagé: {e}")
+
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (min(self.burst, tokens + 1), updated)
+
+def normalize_message(message):
+    """Forme canonique d'un message pour la clé de cache"""
+    text = unicodedata.normalize('NFKC', message).casefold()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip(' .!?…')
+
+class AgentRegistry:
+    """Registre des agents chargé depuis un fichier JSON, rechargé à chaud
+
+    Prompts et messages fixes sont compilés une fois au chargement. Chaque
+    worker vérifie la date de modification du fichier au plus toutes les
+    reload_interval secondes et remplace le registre d'un bloc ; un fichier
+    invalide est ignoré et le registre précédent reste en service.
+    """
+
+    REQUIRED_FIELDS = ('name', 'emoji', 'speciality', 'description', 'prompt')
+    MERGED_FIELDS = ('models', 'max_tokens_limit')
+
+    def __init__(self, path, reload_interval=5):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.checked_at = time.monotonic()
+        self.lock = threading.Lock()
+
+        # Au démarrage, un registre invalide est une erreur de déploiement
+        self.mtime = os.stat(self.path).st_mtime_ns
+        # (agents, agent par défaut) remplacés ensemble lors d'un rechargement
+        self.state = self.load()
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            config = json.load(f)
+
+        defaults = config.get('defaults', {})
+        agents = {agent_id: self.compile(agent_id, defaults, options)
+                  for agent_id, options in config.get('agents', {}).items()}
+
+        default = config.get('default_agent', 'kai')
+        if default not in agents:
+            raise ValueError(f"Agent par défaut inconnu: {default}")
+        return agents, default
+
+    def compile(self, agent_id, defaults, options):
+        """Fusionne les valeurs par défaut et précalcule prompts et messages fixes"""
+        agent = dict(defaults, **options)
+        for field in self.MERGED_FIELDS:
+            agent[field] = dict(defaults.get(field) or {}, **(options.get(field) or {}))
+
+        missing = [field for field in self.REQUIRED_FIELDS if not agent.get(field)]
+        if missing:
+            raise ValueError(f"Agent {agent_id} incomplet: {', '.join(missing)}")
+
+        try:
+            prompt = agent['prompt'].format_map(agent)
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Prompt invalide pour l'agent {agent_id}: {e}")
+
+        speciality = agent['speciality'].lower()
+        greeting = f"Bonjour ! Je suis {agent['name']}, {speciality}. Comment puis-je vous aider aujourd'hui ?"
+        raw = json.dumps([defaults, options], sort_keys=True, ensure_ascii=False)
+        agent.update({
+            'id': agent_id,
+            'prompt': prompt,
+            'greeting': greeting,
+            'fallback': f"{greeting} (Note: Service IA temporairement limité)",
+            'emergency': f"Je suis {agent['name']}, {speciality}. Je rencontre des difficultés techniques temporaires. Pouvez-vous reformuler votre question ?",
+            'system_message': {"role": "system", "content": prompt},
+            'huggingface_prefix': f"{prompt}\n\nUtilisateur: ",
+            'anthropic_prefix': f"\n\nHuman: {prompt}",
+            'echo': re.compile(f"{re.escape(prompt)}|Assistant:"),
+            'fingerprint': hashlib.sha256(raw.encode('utf-8')).hexdigest()[:12]
+        })
+        return agent
+
+    def check(self):
+        """Recharge le fichier s'il a changé depuis le dernier chargement"""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                logger.error(f"Erreur registre agents: {e}")
+                return
+            if mtime == self.mtime:
+                return
+
+            # Une version invalide n'est signalée qu'une fois
+            self.mtime = mtime
+            try:
+                self.state = self.load()
+                logger.info(f"🔄 Registre agents rechargé ({len(self.state[0])} agents)")
+            except Exception as e:
+                logger.error(f"Erreur rechargement agents: {e}")
+        finally:
+            self.lock.release()
+
+    def get_state(self):
+        if self.reload_interval and time.monotonic() - self.checked_at >= self.reload_interval:
+            self.check()
+        return self.state
+
+    def get_agents(self):
+        return self.get_state()[0]
+
+    def get(self, agent_type):
+        """Agent demandé, ou l'agent par défaut s'il n'existe pas"""
+        agents, default = self.get_state()
+        return agents.get(agent_type) or agents[default]
+
+    def describe(self):
+        """Informations publiques des agents (pages et JavaScript)"""
         return {
-            'success': True,
-            'response': f"Bonjour ! Je suis {agent['name']}, {agent['speciality'].lower()}. Comment puis-je vous aider aujourd'hui ? (Note: Service IA temporairement limité)",
-            'agent': agent_type,
-            'model': 'fallback',
-            'timestamp': datetime.utcnow().isoformat()
+            agent_id: {
+                'name': agent['name'],
+                'emoji': agent['emoji'],
+                'speciality': agent['speciality'],
+                'description': agent['description'],
+                'capabilities': agent.get('capabilities', [])
+            }
+            for agent_id, agent in self.get_agents().items()
         }
 
-    def get_openai_response(self, message, agent_type, settings):
-        """Génère une réponse via OpenAI"""
-        try:
-            if not settings or not settings.openai_api_key:
-                return None
+class WaveAISystem:
+    """Système IA WaveAI avec des agents spécialisés (registre agents.json)"""
+    
+    def __init__(self, agent_registry, pool_size=10, max_workers=16, timeouts=None, breaker_config=None, probe_interval=30,
+                 cache_config=None, provider_limiter=None):
+        # Connexions HTTP keep-alive partagées (une session par hôte)
+        self.pool_size = pool_size
+        self.timeouts = {'openai': 30, 'anthropic': 30, 'huggingface': 15, 'ollama': 2}
+        self.timeouts.update(timeouts or {})
+        self.http_sessions = {}
+        self.anthropic_clients = OrderedDict()
+        self.sdks = {}
+        self.max_anthropic_clients = 256
+        self.lock = threading.Lock()
+
+        # Exécuteur partagé pour les appels concurrents aux fournisseurs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='waveai-provider')
+
+        # Disjoncteurs par (fournisseur, clé API)
+        self.breaker_config = breaker_config or {}
+        self.breakers = OrderedDict()
+        self.max_breakers = 1024
+
+        # Disponibilité Ollama mise en cache, rafraîchie par un thread de fond
+        self.probe_interval = probe_interval
+        self.ollama_status = {'available': False, 'checked_at': None, 'latency_ms': None}
+        self.refresher_pid = None
+        self.stopping = threading.Event()
+
+        # Cache des réponses pour les messages identiques
+        cache_config = dict(cache_config or {})
+        self.cache_enabled = cache_config.pop('enabled', True)
+        self.cache_max_temperature = cache_config.pop('max_temperature', 0.0)
+        self.response_cache = ResponseCache(**cache_config)
+
+        # Débit maximal par (fournisseur, clé API), ex. quota Hugging Face partagé
+        self.provider_limiter = provider_limiter
+
+        # Requêtes identiques en cours (single-flight) : clé -> Future du meneur
+        self.inflight = {}
+        self.flight_timeout = sum(self.timeouts[provider] for provider in ('openai', 'anthropic', 'huggingface')) + 5
+
+        # Agents (configuration rechargée à chaud)
+        self.registry = agent_registry
+
+    @property
+    def agents(self):
+        return self.registry.get_agents()
+
+    def get_agent(self, agent_type):
+        return self.registry.get(agent_type)
+
+    def get_generation_params(self, agent, provider, settings=None):
+        """Limite de tokens et température : réglages utilisateur bornés par l'agent"""
+        limit = agent['max_tokens_limit'].get(provider, agent['max_tokens'])
+        max_tokens = getattr(settings, 'max_tokens', None)
+        if max_tokens is None:
+            max_tokens = agent['max_tokens']
+        return min(max_tokens, limit), self.get_temperature(agent, settings)
+
+    def get_temperature(self, agent, settings=None):
+        """Température effective : réglage utilisateur (0.0 compris), sinon celle de l'agent
+
+        Lue par les appels fournisseurs et par le cache, qui ne garde que les
+        réponses déterministes : les deux doivent voir la même valeur.
+        """
+        temperature = getattr(settings, 'temperature', None)
+        return agent['temperature'] if temperature is None else temperature
+
+    # -------------------------------------------------------------------------
+    # Connexions partagées
+    # -------------------------------------------------------------------------
+
+    def get_http_session(self, url):
+        """Session HTTP keep-alive réutilisée pour l'hôte de l'URL"""
+        host = urlsplit(url).netloc
+        session = self.http_sessions.get(host)
+        if session is not None:
+            return session
+
+        with self.lock:
+            session = self.http_sessions.get(host)
+            if session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.http_sessions[host] = session
+        return session
+
+    def get_anthropic_client(self, api_key):
+        """Client Anthropic réutilisé par clé API (pool httpx interne)"""
+        with self.lock:
+            client = self.anthropic_clients.get(api_key)
+            if client is not None:
+                self.anthropic_clients.move_to_end(api_key)
+                return client
+
+        anthropic = self.sdks.get('anthropic') or self.load_sdk('anthropic')
+        options = {'base_url': ANTHROPIC_API_URL} if ANTHROPIC_API_URL else {}
+        client = anthropic.Client(api_key=api_key, timeout=self.timeouts['anthropic'], max_retries=0, **options)
+
+        with self.lock:
+            self.anthropic_clients[api_key] = client
+            while len(self.anthropic_clients) > self.max_anthropic_clients:
+                self.anthropic_clients.popitem(last=False)
+        return client
+
+    def get_openai_module(self):
+        """Module OpenAI branché sur la session keep-alive partagée"""
+        openai = self.sdks.get('openai') or self.load_sdk('openai')
+        session = self.get_http_session(OPENAI_API_BASE)
+        if getattr(openai, 'requestssession', None) is not session:
+            openai.requestssession = session
+        return openai
+
+    def load_sdk(self, name):
+        """Importe un SDK fournisseur une seule fois (ImportError si absent)"""
+        module = __import__(name)
+        if name == 'openai':
+            module.api_base = OPENAI_API_BASE
+        self.sdks[name] = module
+        return module
+
+    def warm_up(self):
+        """Charge les SDK installés au démarrage du worker plutôt qu'à la première requête"""
+        for name in ('openai', 'anthropic'):
+            try:
+                self.load_sdk(name)
+            except ImportError:
+                logger.info(f"SDK {name} non installé")
+        self.get_http_session(HUGGINGFACE_API_URL)
+
+    def close(self):
+        """Ferme les connexions et l'exécuteur partagés"""
+        self.stopping.set()
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            for session in self.http_sessions.values():
+                session.close()
+            self.http_sessions.clear()
+            self.anthropic_clients.clear()
+
+    def probe_ollama(self):
+        """Interroge Ollama et met à jour le statut en cache"""
+        started = time.monotonic()
+        available = False
+        try:
+            session = self.get_http_session(OLLAMA_API_URL)
+            response = session.get(OLLAMA_API_URL, timeout=self.timeouts['ollama'])
+            available = response.status_code == 200
+        except Exception:
+            pass
+
+        self.ollama_status = {
+            'available': available,
+            'checked_at': datetime.utcnow().isoformat(),
+            'latency_ms': round((time.monotonic() - started) * 1000)
+        }
+        return available
+
+    def start_health_refresher(self):
+        """Démarre le rafraîchissement de fond (une fois par processus worker)"""
+        pid = os.getpid()
+        if self.refresher_pid == pid:
+            return
+
+        with self.lock:
+            if self.refresher_pid == pid:
+                return
+            self.refresher_pid = pid
+
+        thread = threading.Thread(target=self.refresh_health, name='waveai-health', daemon=True)
+        thread.start()
+
+    def refresh_health(self):
+        while not self.stopping.is_set():
+            self.probe_ollama()
+            self.stopping.wait(self.probe_interval)
+
+    def get_ollama_status(self):
+        """Dernier statut Ollama connu (disponibilité, date et latence de la sonde)"""
+        self.start_health_refresher()
+        return dict(self.ollama_status)
+
+    def check_ollama_availability(self):
+        """Vérifie la disponibilité d'Ollama (valeur en cache, sans appel réseau)"""
+        return self.get_ollama_status()['available']
+
+    def build_huggingface_request(self, message, agent, settings=None):
+        """Construit les headers et le payload Hugging Face"""
+        headers = {'Content-Type': 'application/json'}
+        if settings and settings.huggingface_token:
+            headers['Authorization'] = f'Bearer {settings.huggingface_token}'
+
+        max_tokens, temperature = self.get_generation_params(agent, 'huggingface', settings)
+        payload = {
+            "inputs": agent['huggingface_prefix'] + message + "\nAssistant:",
+            "parameters": {
+                "max_length": max_tokens,
+                "temperature": temperature,
+                # Température nulle : génération gloutonne (déterministe)
+                "do_sample": temperature > 0,
+                "return_full_text": False
+            },
+            "options": {
+                "wait_for_model": True
+            }
+        }
+        return headers, payload
+
+    def clean_huggingface_output(self, generated, message, agent):
+        """Retire l'écho du prompt renvoyé par Hugging Face
+
+        Avec return_full_text=False la sortie est le plus souvent déjà propre :
+        on ne la parcourt alors qu'une fois.
+        """
+        prefix = agent['huggingface_prefix']
+        if generated.startswith(prefix):
+            generated = generated[len(prefix):]
+            if generated.startswith(message):
+                generated = generated[len(message):]
+        elif 'Assistant:' not in generated:
+            return generated.strip()
+
+        if 'Utilisateur: ' in generated:
+            generated = generated.replace(f"Utilisateur: {message}", "")
+        return agent['echo'].sub('', generated).strip()
+
+    def get_fallback_response(self, agent_type):
+        """Réponse de secours quand Hugging Face ne répond pas"""
+        return {
+            'success': True,
+            'response': self.get_agent(agent_type)['fallback'],
+            'agent': agent_type,
+            'model': 'fallback',
+            'timestamp': datetime.utcnow().isoformat()
+        }
+
+    def get_huggingface_response(self, message, agent_type, settings=None, context=None):
+        """Génère une réponse via Hugging Face (gratuit)"""
+        try:
+            agent = self.get_agent(agent_type)
+            headers, payload = self.build_huggingface_request(message, agent, settings)
+
+            session = self.get_http_session(HUGGINGFACE_API_URL)
+            response = session.post(HUGGINGFACE_API_URL, headers=headers, json=payload,
+                                    timeout=self.timeouts['huggingface'])
+            
+            if response.status_code == 200:
+                result = response.json()
+                if isinstance(result, list) and len(result) > 0:
+                    generated = result[0].get('generated_text', '').strip()
+                    if generated and generated != message:
+                        # Nettoyer la réponse
+                        clean_response = self.clean_huggingface_output(generated, message, agent)
+                        if clean_response:
+                            return {
+                                'success': True,
+                                'response': clean_response,
+                                'agent': agent_type,
+                                'model': 'huggingface',
+                                'timestamp': datetime.utcnow().isoformat()
+                            }
+                            
+        except Exception as e:
+            logger.error(f"Erreur Hugging Face: {e}")
+        
+        # Fallback response si API échoue
+        return self.get_fallback_response(agent_type)
+
+    def build_openai_messages(self, agent, message, context=None):
+        """Messages OpenAI : prompt agent, résumé, historique récent puis message"""
+        summary, turns = context.for_model('openai') if context else (None, [])
+        messages = [agent['system_message']]
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        for previous, answer in turns:
+            messages.append({"role": "user", "content": previous})
+            messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def build_anthropic_prompt(self, agent, message, context=None):
+        """Prompt Anthropic : prompt agent, résumé, historique récent puis message"""
+        summary, turns = context.for_model('anthropic') if context else (None, [])
+        parts = [agent['anthropic_prefix']]
+        if summary:
+            parts += ["\n\n", summary]
+
+        # Le premier tour partage le bloc Human du prompt agent
+        for index, (previous, answer) in enumerate(turns):
+            parts += ["\n\n" if index == 0 else "\n\nHuman: ", previous, "\n\nAssistant: ", answer]
+        parts += ["\n\n" if not turns else "\n\nHuman: ", message, "\n\nAssistant:"]
+        return ''.join(parts)
+
+    def get_openai_response(self, message, agent_type, settings, context=None):
+        """Génère une réponse via OpenAI"""
+        try:
+            if not settings or not settings.openai_api_key:
+                return None
+
+            openai = self.get_openai_module()
+            
+            agent = self.get_agent(agent_type)
+            max_tokens, temperature = self.get_generation_params(agent, 'openai', settings)
+
+            response = openai.ChatCompletion.create(
+                api_key=settings.openai_api_key,
+                request_timeout=self.timeouts['openai'],
+                model=agent['models']['openai'],
+                messages=self.build_openai_messages(agent, message, context),
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+
+            usage = getattr(response, 'usage', None)
+            return {
+                'success': True,
+                'response': response.choices[0].message.content.strip(),
+                'model': 'openai',
+                'agent': agent_type,
+                'usage': {'prompt_tokens': usage.prompt_tokens, 'completion_tokens': usage.completion_tokens} if usage else None,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"Erreur OpenAI: {e}")
+            return None
+
+    def get_anthropic_response(self, message, agent_type, settings, context=None):
+        """Génère une réponse via Anthropic Claude"""
+        try:
+            if not settings or not settings.anthropic_api_key:
+                return None
+
+            client = self.get_anthropic_client(settings.anthropic_api_key)
+            
+            agent = self.get_agent(agent_type)
+            max_tokens, temperature = self.get_generation_params(agent, 'anthropic', settings)
+
+            response = client.completions.create(
+                model=agent['models']['anthropic'],
+                max_tokens_to_sample=max_tokens,
+                temperature=temperature,
+                prompt=self.build_anthropic_prompt(agent, message, context)
+            )
+
+            return {
+                'success': True,
+                'response': response.completion.strip(),
+                'model': 'anthropic',
+                'agent': agent_type,
+                'timestamp': datetime.utcnow().isoformat()
+            }
+            
+        except Exception as e:
+            logger.error(f"Erreur Anthropic: {e}")
+            return None
+
+    def get_provider_order(self, user_settings=None, agent_type=None):
+        """Ordre des fournisseurs : préférence utilisateur, puis celle de l'agent"""
+        providers = []
+
+        if user_settings:
+            if user_settings.default_model == 'openai' and user_settings.openai_api_key:
+                providers.append('openai')
+            elif user_settings.default_model == 'anthropic' and user_settings.anthropic_api_key:
+                providers.append('anthropic')
+
+            # Ajouter les autres APIs disponibles (fournisseur préféré de l'agent d'abord)
+            available = ['openai', 'anthropic']
+            preferred = self.get_agent(agent_type).get('provider') if agent_type else None
+            if preferred in available:
+                available.remove(preferred)
+                available.insert(0, preferred)
+            for provider in available:
+                if getattr(user_settings, f'{provider}_api_key') and provider not in providers:
+                    providers.append(provider)
+
+        # Hugging Face comme fallback gratuit (toujours disponible)
+        providers.append('huggingface')
+        return providers
+
+    def get_response(self, message, agent_type='kai', user_settings=None, context=None):
+        """Génère une réponse avec système de fallback robuste"""
+        if not message or not message.strip():
+            return {
+                'success': True,
+                'response': self.get_agent(agent_type)['greeting'],
+                'agent': agent_type,
+                'model': 'default',
+                'timestamp': datetime.utcnow().isoformat()
+            }
+
+        cache_key = self.get_cache_key(message, agent_type, user_settings, context)
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached:
+                return dict(cached, agent=agent_type, cached=True, timestamp=datetime.utcnow().isoformat())
+
+        # Un double envoi attend la réponse de la requête identique déjà en cours
+        flight_key = self.get_flight_key(message, agent_type, user_settings, context)
+        future, leader = self.join_flight(flight_key)
+        if not leader:
+            result = self.wait_flight(future)
+            if result:
+                return dict(result, coalesced=True)
+            future = None
+
+        result = None
+        started = time.monotonic()
+        try:
+            result = self.get_provider_response(message, agent_type, user_settings, context)
+            self.cache_response(result, message, agent_type, user_settings, context)
+        finally:
+            self.end_flight(flight_key, future, result)
+            self.record_response(agent_type, result, started)
+        return result
+
+    def record_response(self, agent_type, result, started):
+        """Durée de génération par agent et décompte des réponses par modèle"""
+        metrics.observe('waveai_agent_response_duration_seconds', time.monotonic() - started, agent=agent_type)
+        metrics.inc('waveai_responses_total', model=result.get('model', 'unknown') if result else 'none')
+
+    def get_provider_response(self, message, agent_type, user_settings=None, context=None):
+        """Interroge les fournisseurs dans l'ordre, ou en parallèle si le hedging est activé"""
+        providers = self.get_provider_order(user_settings, agent_type)
+
+        # Mode course : le fournisseur préféré a un budget de latence, puis on relance en parallèle
+        if user_settings and getattr(user_settings, 'hedge_enabled', False) and len(providers) > 1:
+            return self.race_providers(message, agent_type, user_settings, providers, context) \
+                or self.get_emergency_response(agent_type)
+
+        # Essayer chaque fournisseur (les disjoncteurs ouverts sont ignorés)
+        for provider in providers:
+            result = self.call_provider(provider, message, agent_type, user_settings, context)
+            if result and result.get('success'):
+                return result
+
+        # Réponse de fallback garantie si tout échoue
+        return self.get_emergency_response(agent_type)
+
+    # -------------------------------------------------------------------------
+    # Single-flight (requêtes identiques simultanées)
+    # -------------------------------------------------------------------------
+
+    def get_flight_key(self, message, agent_type, user_settings=None, context=None):
+        """Clé (utilisateur, agent, fil, message normalisé), None sans utilisateur connu"""
+        user_id = getattr(user_settings, 'user_id', None)
+        if user_id is None:
+            return None
+        thread = context.key[1] if context is not None else ''
+        return f"{user_id}|{agent_type}|{thread}|{normalize_message(message)}"
+
+    def join_flight(self, flight_key):
+        """Retourne (future, True) pour le meneur, (future du meneur, False) pour un suiveur"""
+        if not flight_key:
+            return None, True
+        with self.lock:
+            leader = self.inflight.get(flight_key)
+            if leader is not None:
+                return leader, False
+            future = Future()
+            self.inflight[flight_key] = future
+            return future, True
+
+    def wait_flight(self, future):
+        """Résultat du meneur, ou None s'il a échoué ou tarde trop"""
+        try:
+            return future.result(timeout=self.flight_timeout)
+        except Exception:
+            return None
+
+    def end_flight(self, flight_key, future, result):
+        """Publie le résultat du meneur à ses suiveurs"""
+        if future is None:
+            return
+        with self.lock:
+            if self.inflight.get(flight_key) is future:
+                del self.inflight[flight_key]
+        if not future.done():
+            future.set_result(result)
+
+    def get_cache_key(self, message, agent_type, user_settings=None, context=None, provider=None):
+        """Clé de cache (agent, fournisseur, température arrondie, message normalisé)
+
+        Le fournisseur est par défaut le fournisseur préféré, celui qu'on
+        interroge en lecture. Retourne None si le cache ne s'applique pas :
+        température trop élevée ou message pris dans un fil avec historique.
+        """
+        if not self.cache_enabled or context:
+            return None
+
+        temperature = self.get_temperature(self.get_agent(agent_type), user_settings)
+        if temperature > self.cache_max_temperature:
+            return None
+
+        # L'empreinte de l'agent invalide le cache quand sa configuration change
+        provider = provider or self.get_provider_order(user_settings, agent_type)[0]
+        fingerprint = self.get_agent(agent_type)['fingerprint']
+        raw = f"{agent_type}|{fingerprint}|{provider}|{round(temperature, 1)}|{normalize_message(message)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def cache_response(self, result, message, agent_type, user_settings=None, context=None):
+        """Met en cache une réponse réelle (jamais les réponses de secours)
+
+        La réponse est rangée sous le fournisseur qui l'a produite : celle
+        d'un fournisseur de repli ou du gagnant d'une course n'est servie que
+        lorsque ce fournisseur est le préféré.
+        """
+        if not result or not result.get('success') \
+                or result.get('model') in ('default', 'fallback', 'emergency_fallback'):
+            return
+        cache_key = self.get_cache_key(message, agent_type, user_settings, context, provider=result['model'])
+        if cache_key:
+            self.response_cache.set(cache_key, {'success': True, 'response': result['response'], 'model': result['model']})
+
+    def get_emergency_response(self, agent_type):
+        """Réponse garantie quand aucun fournisseur n'a répondu"""
+        return {
+            'success': True,
+            'response': self.get_agent(agent_type)['emergency'],
+            'agent': agent_type,
+            'model': 'emergency_fallback',
+            'timestamp': datetime.utcnow().isoformat()
+        }
+
+    # -------------------------------------------------------------------------
+    # Disjoncteurs
+    # -------------------------------------------------------------------------
+
+    def get_provider_key(self, provider, settings):
+        """Empreinte courte de la clé API utilisée (jamais la clé elle-même)"""
+        attribute = {
+            'openai': 'openai_api_key',
+            'anthropic': 'anthropic_api_key',
+            'huggingface': 'huggingface_token'
+        }.get(provider)
+        key = getattr(settings, attribute, None) if settings and attribute else None
+        if not key:
+            return 'public'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:8]
+
+    def get_breaker(self, provider, settings):
+        """Disjoncteur associé au fournisseur et à la clé API"""
+        name = (provider, self.get_provider_key(provider, settings))
+        with self.lock:
+            breaker = self.breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(**self.breaker_config)
+                self.breakers[name] = breaker
+                while len(self.breakers) > self.max_breakers:
+                    self.breakers.popitem(last=False)
+            else:
+                self.breakers.move_to_end(name)
+        return breaker
+
+    def provider_allowed(self, provider, settings):
+        """Vérifie le seau à jetons du fournisseur pour la clé API utilisée"""
+        if not self.provider_limiter:
+            return True
+        allowed, _ = self.provider_limiter.acquire(f"provider:{provider}:{self.get_provider_key(provider, settings)}")
+        if not allowed:
+            logger.warning(f"Limite de débit atteinte pour {provider}")
+        return allowed
+
+    def call_provider(self, provider, message, agent_type, settings, context=None):
+        """Appelle un fournisseur à travers son disjoncteur et son limiteur de débit
+
+        Retourne None sans appel réseau si le disjoncteur est ouvert ou si
+        le débit autorisé pour ce fournisseur est dépassé.
+        """
+        if not self.provider_allowed(provider, settings):
+            metrics.inc('waveai_provider_attempts_total', provider=provider, outcome='rate_limited')
+            return None
+
+        breaker = self.get_breaker(provider, settings)
+        if not breaker.allow_request():
+            metrics.inc('waveai_provider_attempts_total', provider=provider, outcome='circuit_open')
+            return None
+
+        started = time.monotonic()
+        result = None
+        try:
+            result = getattr(self, f'get_{provider}_response')(message, agent_type, settings, context)
+        except Exception as e:
+            logger.error(f"Erreur méthode {provider}: {e}")
+
+        # La réponse de secours Hugging Face signale un échec de l'API
+        success = bool(result and result.get('success') and result.get('model') != 'fallback')
+        elapsed = time.monotonic() - started
+        breaker.record(success, elapsed)
+        outcome = 'success' if success else 'failure'
+        metrics.observe('waveai_provider_request_duration_seconds', elapsed, provider=provider, outcome=outcome)
+        metrics.inc('waveai_provider_attempts_total', provider=provider, outcome=outcome)
+        if success:
+            self.record_usage(provider, message, agent_type, settings, context, result, elapsed)
+        return result
+
+    def record_usage(self, provider, message, agent_type, settings, context, result, elapsed):
+        """Consommation d'un appel réussi : tokens renvoyés par le fournisseur, sinon estimés"""
+        try:
+            agent = self.get_agent(agent_type)
+            usage = result.get('usage') or {}
+            prompt_tokens = usage.get('prompt_tokens')
+            if prompt_tokens is None:
+                summary, turns = context.for_model(provider) if context else (None, [])
+                prompt_tokens = estimate_tokens(agent['prompt']) + estimate_tokens(summary) + estimate_tokens(message) \
+                    + sum(estimate_tokens(previous) + estimate_tokens(answer) for previous, answer in turns)
+            completion_tokens = usage.get('completion_tokens')
+            if completion_tokens is None:
+                completion_tokens = estimate_tokens(result.get('response'))
+
+            metrics.inc('waveai_tokens_total', prompt_tokens, provider=provider, kind='prompt')
+            metrics.inc('waveai_tokens_total', completion_tokens, provider=provider, kind='completion')
+
+            user_id = getattr(settings, 'user_id', None)
+            if user_id is not None:
+                usage_ledger.record(user_id, agent_type, provider, agent['models'].get(provider, provider),
+                                    prompt_tokens, completion_tokens, elapsed, estimated=not usage)
+        except Exception as e:
+            logger.error(f"Erreur comptabilité tokens: {e}")
+
+    def get_breaker_states(self):
+        """États des disjoncteurs pour /api/status"""
+        with self.lock:
+            breakers = list(self.breakers.items())
+        return [
+            dict(breaker.to_dict(), provider=provider, key=key)
+            for (provider, key), breaker in breakers
+        ]
+
+    # -------------------------------------------------------------------------
+    # Exécution concurrente
+    # -------------------------------------------------------------------------
+
+    def submit(self, fn, *args, **kwargs):
+        """Soumet un appel fournisseur à l'exécuteur partagé (retourne un Future)"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def race_providers(self, message, agent_type, user_settings, providers, context=None):
+        """Interroge les fournisseurs en mode hedging, la première réponse valide gagne
+
+        Le fournisseur suivant est lancé dès que le précédent échoue ou dépasse
+        hedge_delay_ms. Les appels perdants encore en file sont annulés ; ceux
+        déjà en cours se terminent en arrière-plan et sont ignorés.
+        """
+        delay = max(user_settings.hedge_delay_ms or 2500, 0) / 1000.0
+        settings = user_settings.snapshot() if hasattr(user_settings, 'snapshot') else user_settings
+        pending = {}
+        fallback = None
+        remaining = list(providers)
+
+        def launch_next():
+            provider = remaining.pop(0)
+            future = self.submit(self.call_provider, provider, message, agent_type, settings, context)
+            pending[future] = provider
+
+        launch_next()
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=delay if remaining else None, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    # Budget de latence dépassé : requête de couverture
+                    launch_next()
+                    continue
+
+                failed = False
+                for future in done:
+                    provider = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Erreur méthode {provider}: {e}")
+                        result = None
+
+                    if result and result.get('success'):
+                        # La réponse de secours Hugging Face ne gagne que si tout le reste échoue
+                        if result.get('model') != 'fallback':
+                            return result
+                        fallback = result
+                    failed = True
+
+                # Échec : inutile d'attendre la fin du budget pour lancer le suivant
+                if failed and remaining:
+                    launch_next()
+        finally:
+            for future in pending:
+                future.cancel()
+
+        return fallback
+
+    # -------------------------------------------------------------------------
+    # Streaming (générateurs de tokens)
+    # -------------------------------------------------------------------------
+
+    def stream_openai_response(self, message, agent_type, settings, context=None):
+        """Génère une réponse OpenAI token par token"""
+        if not settings or not settings.openai_api_key:
+            return
+
+        openai = self.get_openai_module()
+
+        agent = self.get_agent(agent_type)
+        max_tokens, temperature = self.get_generation_params(agent, 'openai', settings)
+
+        chunks = openai.ChatCompletion.create(
+            api_key=settings.openai_api_key,
+            request_timeout=self.timeouts['openai'],
+            model=agent['models']['openai'],
+            messages=self.build_openai_messages(agent, message, context),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+
+        for chunk in chunks:
+            text = chunk.choices[0].delta.get('content')
+            if text:
+                yield text
+
+    def stream_anthropic_response(self, message, agent_type, settings, context=None):
+        """Génère une réponse Anthropic Claude token par token"""
+        if not settings or not settings.anthropic_api_key:
+            return
+
+        client = self.get_anthropic_client(settings.anthropic_api_key)
+
+        agent = self.get_agent(agent_type)
+        max_tokens, temperature = self.get_generation_params(agent, 'anthropic', settings)
+
+        events = client.completions.create(
+            model=agent['models']['anthropic'],
+            max_tokens_to_sample=max_tokens,
+            temperature=temperature,
+            prompt=self.build_anthropic_prompt(agent, message, context),
+            stream=True
+        )
+
+        for event in events:
+            if event.completion:
+                yield event.completion
+
+    def stream_huggingface_response(self, message, agent_type, settings=None, context=None):
+        """Génère une réponse Hugging Face token par token (si le modèle le supporte)"""
+        agent = self.get_agent(agent_type)
+        headers, payload = self.build_huggingface_request(message, agent, settings)
+        payload['stream'] = True
+
+        session = self.get_http_session(HUGGINGFACE_API_URL)
+        with session.post(HUGGINGFACE_API_URL, headers=headers, json=payload,
+                          timeout=self.timeouts['huggingface'], stream=True) as response:
+            if response.status_code != 200:
+                return
+
+            # Les modèles sans support du streaming renvoient le JSON complet
+            if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                result = response.json()
+                if isinstance(result, list) and len(result) > 0:
+                    generated = result[0].get('generated_text', '').strip()
+                    if generated and generated != message:
+                        clean_response = self.clean_huggingface_output(generated, message, agent)
+                        if clean_response:
+                            yield clean_response
+                return
+
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                event = json.loads(line[5:])
+                token = (event.get('token') or {})
+                if token.get('special'):
+                    continue
+                if token.get('text'):
+                    yield token['text']
+
+    def stream_response(self, message, agent_type='kai', user_settings=None, context=None):
+        """Génère une réponse en streaming avec le même fallback que get_response
+
+        Produit des événements {'type': 'token', 'text': ...} puis un
+        événement final {'type': 'done', ...} au format de get_response.
+        """
+        if not message or not message.strip():
+            result = self.get_response(message, agent_type, user_settings)
+            yield {'type': 'token', 'text': result['response']}
+            yield dict(result, type='done')
+            return
+
+        cache_key = self.get_cache_key(message, agent_type, user_settings, context)
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            if cached:
+                yield {'type': 'token', 'text': cached['response']}
+                yield dict(cached, type='done', agent=agent_type, cached=True, timestamp=datetime.utcnow().isoformat())
+                return
+
+        # Un double envoi attend la réponse de la requête identique déjà en cours
+        flight_key = self.get_flight_key(message, agent_type, user_settings, context)
+        future, leader = self.join_flight(flight_key)
+        if not leader:
+            result = self.wait_flight(future)
+            if result:
+                yield {'type': 'token', 'text': result['response']}
+                yield dict(result, type='done', coalesced=True)
+                return
+            future = None
+
+        result = None
+        started = time.monotonic()
+        try:
+            for event in self.stream_providers(message, agent_type, user_settings, context):
+                # Une réponse tronquée n'est pas transmise aux suiveurs (ils relanceront)
+                if event['type'] == 'done' and not event.get('truncated'):
+                    result = {key: value for key, value in event.items() if key != 'type'}
+                yield event
+        finally:
+            # Aussi exécuté si le client se déconnecte : les suiveurs reçoivent None
+            self.end_flight(flight_key, future, result)
+            self.record_response(agent_type, result, started)
+
+    def stream_providers(self, message, agent_type, user_settings, context):
+        """Parcourt les fournisseurs en streaming jusqu'au premier qui répond"""
+        for provider in self.get_provider_order(user_settings, agent_type):
+            if not self.provider_allowed(provider, user_settings):
+                metrics.inc('waveai_provider_attempts_total', provider=provider, outcome='rate_limited')
+                continue
+
+            breaker = self.get_breaker(provider, user_settings)
+            if not breaker.allow_request():
+                metrics.inc('waveai_provider_attempts_total', provider=provider, outcome='circuit_open')
+                continue
+
+            streamer = getattr(self, f'stream_{provider}_response')
+            parts = []
+            failed = False
+            started = time.monotonic()
+            try:
+                for text in streamer(message, agent_type, user_settings, context):
+                    parts.append(text)
+                    yield {'type': 'token', 'text': text}
+            except Exception as e:
+                failed = True
+                logger.error(f"Erreur streaming {provider}: {e}")
+            finally:
+                # Aussi exécuté si le client se déconnecte en cours de flux
+                elapsed = time.monotonic() - started
+                success = bool(parts) and not failed
+                outcome = 'success' if success else 'failure'
+                breaker.record(success, elapsed)
+                metrics.observe('waveai_provider_request_duration_seconds', elapsed, provider=provider, outcome=outcome)
+                metrics.inc('waveai_provider_attempts_total', provider=provider, outcome=outcome)
+
+            # Un fournisseur qui a commencé à répondre n'est pas remplacé en cours de route
+            if parts:
+                result = {
+                    'success': True,
+                    'response': ''.join(parts).strip(),
+                    'model': provider,
+                    'agent': agent_type,
+                    'timestamp': datetime.utcnow().isoformat()
+                }
+                # Les flux ne renvoient pas l'usage : tokens estimés
+                self.record_usage(provider, message, agent_type, user_settings, context, result, elapsed)
+                if failed:
+                    # Flux interrompu : réponse incomplète, ni mise en cache ni sauvegardée
+                    yield dict(result, type='done', truncated=True)
+                    return
+                self.cache_response(result, message, agent_type, user_settings, context)
+                yield dict(result, type='done')
+                return
+
+        result = self.get_fallback_response(agent_type)
+        yield {'type': 'token', 'text': result['response']}
+        yield dict(result, type='done')
+
+# Instance globale du système IA
+ai_system = WaveAISystem(
+    agent_registry=AgentRegistry(app.config['AGENTS_CONFIG'], app.config['AGENTS_RELOAD_INTERVAL']),
+    pool_size=app.config['PROVIDER_POOL_SIZE'],
+    max_workers=app.config['PROVIDER_MAX_WORKERS'],
+    timeouts=app.config['PROVIDER_TIMEOUTS'],
+    breaker_config=app.config['BREAKER_CONFIG'],
+    probe_interval=app.config['OLLAMA_PROBE_INTERVAL'],
+    cache_config=app.config['RESPONSE_CACHE'],
+    provider_limiter=RateLimiter(*app.config['RATE_LIMITS']['provider'], path=app.config['RATE_LIMIT_PATH'])
+)
+atexit.register(ai_system.close)
+
+# =============================================================================
+# FONCTIONS UTILITAIRES
+# =============================================================================
+
+def validate_email(email):
+    """Validation robuste des emails"""
+    if not email or not isinstance(email, str):
+        return False
+    email = email.strip().lower()
+    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    return re.match(pattern, email) is not None and len(email) <= 120
+
+class SnapshotCache:
+    """Cache local (par worker) de copies détachées, avec TTL et invalidation explicite"""
+
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+user_cache = SnapshotCache(ttl=app.config['USER_CACHE_TTL'])
+settings_cache = SnapshotCache(ttl=app.config['USER_CACHE_TTL'])
+
+@contextmanager
+def read_replica():
+    """Envoie les lectures du bloc à la réplique si elle est configurée
+
+    Sans effet pendant REPLICA_STICKY_SECONDS après une écriture de
+    l'utilisateur, pour qu'il relise ses propres modifications.
+    """
+    if 'replica' not in app.config.get('SQLALCHEMY_BINDS', {}) or recently_wrote():
+        yield
+        return
+
+    previous = db.session.info.get('replica', False)
+    db.session.info['replica'] = True
+    try:
+        yield
+    finally:
+        db.session.info['replica'] = previous
+
+def recently_wrote():
+    return has_request_context() and \
+        time.time() - session.get('db_write_at', 0) < app.config['REPLICA_STICKY_SECONDS']
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_write(db_session):
+    if has_request_context():
+        g.db_wrote = True
+
+@app.after_request
+def stick_to_primary(response):
+    """Mémorise la dernière écriture de l'utilisateur (lectures suivantes sur le primaire)"""
+    if g.get('db_wrote') and 'replica' in app.config.get('SQLALCHEMY_BINDS', {}):
+        session['db_write_at'] = time.time()
+    return response
+
+def get_cached_user(user_id):
+    """Profil utilisateur en lecture seule, sans requête en régime établi"""
+    user = user_cache.get(user_id)
+    if user is None:
+        instance = db.session.get(User, user_id)
+        if not instance:
+            return None
+        user = instance.snapshot()
+        user_cache.set(user_id, user)
+    return user
+
+def settings_version(settings):
+    """Version des paramètres IA (date de mise à jour), comparable entre workers"""
+    updated_at = getattr(settings, 'updated_at', None)
+    return updated_at.timestamp() if updated_at else 0.0
+
+def get_cached_settings(user_id, min_version=None):
+    """Paramètres IA en lecture seule, sans requête en régime établi
+
+    Invalidé lors de la sauvegarde de /ai-settings dans le worker qui la
+    traite ; les autres workers voient la version enregistrée dans la
+    session (ou transmise avec un travail) et relisent une copie plus ancienne.
+    """
+    if min_version is None and has_request_context():
+        min_version = session.get('settings_version')
+
+    settings = settings_cache.get(user_id)
+    if settings is not None and min_version and settings_version(settings) < min_version:
+        settings = None
+    if settings is None:
+        instance = get_user_settings(user_id)
+        if not instance:
+            return None
+        settings = instance.snapshot()
+        settings_cache.set(user_id, settings)
+    return settings
+
+class BatchWriter:
+    """File d'écriture différée, insérée par lots depuis un thread de fond
+
+    Les lignes sont écrites par lots (batch_size lignes ou flush_interval
+    secondes). Les lots qui ne peuvent pas être écrits, et ceux encore en
+    file à l'arrêt si la base est injoignable, sont déversés dans un fichier
+    par processus (spill_path.<pid>), rejoués toutes les retry_interval
+    secondes et au démarrage suivant. Les sous-classes fournissent persist()
+    et, au besoin, prepare() et restore().
+    """
+
+    label = 'lignes'
+    thread_name = 'waveai-writer'
+    # Champs datetime sérialisés en ISO 8601 dans le fichier de déversement
+    datetime_fields = ('created_at',)
+
+    def __init__(self, batch_size=50, flush_interval=1.0, spill_path=None, retry_interval=30):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.retry_interval = retry_interval
+        self.retry_at = 0.0
+        self.queue = queue.Queue()
+        self.inflight = []
+        self.pid = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    def enqueue(self, **row):
+        self.start()
+        self.queue.put(self.prepare(row))
+
+    def prepare(self, row):
+        row.setdefault('created_at', datetime.utcnow())
+        return row
+
+    def restore(self, row):
+        """Ligne relue depuis le fichier de déversement"""
+        return row
+
+    def persist(self, batch):
+        """Insère le lot (appelé dans un contexte d'application, commit par l'appelant)"""
+        raise NotImplementedError
+
+    def start(self):
+        """Démarre le thread d'écriture (une fois par processus worker)"""
+        pid = os.getpid()
+        if self.pid == pid:
+            return
+
+        with self.lock:
+            if self.pid == pid:
+                return
+            self.pid = pid
+            self.stopping.clear()
+            self.load_spill()
+            self.thread = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopping.is_set():
+            batch = self.drain(self.flush_interval)
+            if batch:
+                self.inflight = batch
+                self.write(batch)
+                self.inflight = []
+
+            # Rejoue les lots déversés pendant une panne passagère de la base
+            if self.spill_path and time.monotonic() >= self.retry_at:
+                self.retry_at = time.monotonic() + self.retry_interval
+                with self.lock:
+                    self.load_spill()
+
+    def drain(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        """Insère un lot en une seule transaction"""
+        try:
+            with app.app_context():
+                self.persist(batch)
+                db.session.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Erreur écriture {self.label} ({len(batch)} lignes): {e}")
+            with app.app_context():
+                db.session.rollback()
+            self.spill(batch)
+            return False
+
+    def pending(self):
+        """Lignes de ce processus en file ou en cours d'écriture, pas encore visibles en base"""
+        with self.queue.mutex:
+            queued = list(self.queue.queue)
+        return list(self.inflight) + queued
+
+    def flush(self):
+        """Écrit immédiatement tout ce qui est en file"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+
+    def close(self):
+        """Vidage à l'arrêt du worker"""
+        self.stopping.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def spill(self, batch):
+        if not self.spill_path:
+            return
+        try:
+            # Un fichier par processus : pas d'entrelacement de lignes entre workers
+            with self.lock, open(f"{self.spill_path}.{os.getpid()}", 'a', encoding='utf-8') as handle:
+                for row in batch:
+                    record = dict(row)
+                    for field in self.datetime_fields:
+                        if isinstance(record.get(field), datetime):
+                            record[field] = record[field].isoformat()
+                    handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.error(f"Erreur sauvegarde disque des {self.label}: {e}")
+
+    def get_spill_files(self):
+        """Fichiers à rejouer : ceux de ce processus et ceux laissés par des processus terminés
+
+        Noms : spill_path (ancien format), spill_path.<pid> et, pendant une
+        reprise, spill_path.replay-<pid>-<id>.
+        """
+        files = []
+        for path in glob.glob(glob.escape(self.spill_path) + '*'):
+            suffix = path[len(self.spill_path):]
+            if suffix in ('', '.replay'):
+                files.append(path)
+                continue
+            owner = suffix[len('.replay-'):].split('-')[0] if suffix.startswith('.replay-') else suffix[1:]
+            if owner.isdigit() and (int(owner) == os.getpid() or not process_alive(int(owner))):
+                files.append(path)
+        return files
+
+    def load_spill(self):
+        """Remet en file les lignes déversées (à appeler sous self.lock)"""
+        if not self.spill_path:
+            return
+        for path in self.get_spill_files():
+            # Renommage atomique et unique : un seul processus reprend chaque fichier
+            pending = f"{self.spill_path}.replay-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            try:
+                os.replace(path, pending)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error(f"Erreur rechargement des {self.label}: {e}")
+                continue
+
+            loaded = 0
+            with open(pending, encoding='utf-8') as handle:
+                for line in handle:
+                    if not line.strip():
+                        continue
+                    try:
+                        row = self.restore(json.loads(line))
+                        for field in self.datetime_fields:
+                            if row.get(field):
+                                row[field] = datetime.fromisoformat(row[field])
+                    except Exception as e:
+                        # Ligne illisible : mise de côté, le reste du fichier est rejoué
+                        logger.error(f"Ligne de {self.label} illisible mise de côté: {e}")
+                        with open(f"{self.spill_path}.bad", 'a', encoding='utf-8') as bad:
+                            bad.write(line if line.endswith('\n') else line + '\n')
+                        continue
+                    self.queue.put(row)
+                    loaded += 1
+            os.remove(pending)
+            if loaded:
+                logger.info(f"{loaded} {self.label} en attente rechargées depuis le disque")
+
+class ConversationWriter(BatchWriter):
+    """File d'écriture différée des conversations (et de leurs statistiques)"""
+
+    label = 'conversations'
+    thread_name = 'waveai-conversations'
+    datetime_fields = ('created_at', 'updated_at')
+
+    def prepare(self, row):
+        row.setdefault('created_at', datetime.utcnow())
+        row.setdefault('updated_at', row['created_at'])
+        return row
+
+    def restore(self, row):
+        row.setdefault('thread_id', None)
+        return row
+
+    def persist(self, batch):
+        db.session.execute(db.insert(Conversation), batch)
+        record_conversation_stats(batch)
+
+conversation_writer = ConversationWriter(
+    batch_size=app.config['CONVERSATION_BATCH_SIZE'],
+    flush_interval=app.config['CONVERSATION_FLUSH_INTERVAL'],
+    spill_path=app.config['CONVERSATION_SPILL_PATH']
+)
+atexit.register(conversation_writer.close)
+
+def process_alive(pid):
+    """Vrai si le processus existe encore (fichiers par pid laissés par un worker terminé)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def estimate_tokens(text):
+    """Estimation grossière du nombre de tokens (≈ 4 caractères par token)"""
+    return (len(text) + 3) // 4 if text else 0
+
+def record_conversation_stats(rows):
+    """Met à jour user_agent_stats pour des conversations insérées
+
+    À appeler dans la même transaction que l'insertion des conversations.
+    """
+    totals = {}
+    for row in rows:
+        key = (row['user_id'], row['agent_type'])
+        count, tokens, last = totals.get(key, (0, 0, None))
+        created_at = row.get('created_at') or datetime.utcnow()
+        totals[key] = (
+            count + 1,
+            tokens + estimate_tokens(row.get('message')) + estimate_tokens(row.get('response')),
+            max(last, created_at) if last else created_at
+        )
+
+    values = [
+        {'user_id': user_id, 'agent_type': agent_type, 'conversation_count': count,
+         'tokens_used': tokens, 'last_activity': last}
+        for (user_id, agent_type), (count, tokens, last) in totals.items()
+    ]
+    if not values:
+        return
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        table = UserAgentStats.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'agent_type'],
+            set_={
+                'conversation_count': table.c.conversation_count + statement.excluded.conversation_count,
+                'tokens_used': table.c.tokens_used + statement.excluded.tokens_used,
+                'last_activity': db.func.coalesce(
+                    db.case((table.c.last_activity > statement.excluded.last_activity, table.c.last_activity),
+                            else_=statement.excluded.last_activity),
+                    statement.excluded.last_activity
+                )
+            }
+        )
+        db.session.execute(statement, values)
+        return
+
+    # Autres bases : lecture puis mise à jour
+    for value in values:
+        stats = UserAgentStats.query.filter_by(user_id=value['user_id'], agent_type=value['agent_type']).first()
+        if not stats:
+            stats = UserAgentStats(user_id=value['user_id'], agent_type=value['agent_type'],
+                                   conversation_count=0, tokens_used=0)
+            db.session.add(stats)
+        stats.conversation_count += value['conversation_count']
+        stats.tokens_used += value['tokens_used']
+        if not stats.last_activity or stats.last_activity < value['last_activity']:
+            stats.last_activity = value['last_activity']
+
+def backfill_user_stats():
+    """Reconstruit user_agent_stats à partir de la table conversations"""
+    UserAgentStats.query.delete()
+    rows = db.session.query(
+        Conversation.user_id,
+        Conversation.agent_type,
+        db.func.count(Conversation.id),
+        db.func.sum(db.func.length(Conversation.message) + db.func.coalesce(db.func.length(Conversation.response), 0)),
+        db.func.max(Conversation.created_at)
+    ).group_by(Conversation.user_id, Conversation.agent_type).all()
+
+    totals = {
+        (user_id, agent_type): [count, ((characters or 0) + 3) // 4, last_activity]
+        for user_id, agent_type, count, characters, last_activity in rows
+    }
+
+    # Les conversations archivées comptent toujours dans les statistiques
+    for archive in ConversationArchive.query.all():
+        total = totals.setdefault((archive.user_id, archive.agent_type), [0, 0, None])
+        total[0] += archive.row_count
+        total[1] += archive.tokens
+        if archive.last_at and (not total[2] or archive.last_at > total[2]):
+            total[2] = archive.last_at
+
+    for (user_id, agent_type), (count, tokens, last_activity) in totals.items():
+        db.session.add(UserAgentStats(
+            user_id=user_id,
+            agent_type=agent_type,
+            conversation_count=count,
+            tokens_used=tokens,
+            last_activity=last_activity
+        ))
+    db.session.commit()
+    return len(totals)
+
+def get_dashboard_stats(user_id):
+    """Statistiques du dashboard depuis la table précalculée"""
+    rows = UserAgentStats.query.filter_by(user_id=user_id).all()
+    return {
+        'total_conversations': sum(row.conversation_count for row in rows),
+        'agents_used': sum(1 for row in rows if row.conversation_count > 0),
+        'tokens_used': sum(row.tokens_used for row in rows),
+        'per_agent': {row.agent_type: row.conversation_count for row in rows}
+    }
+
+class UsageLedger(BatchWriter):
+    """Registre des consommations (tokens, latence, coût estimé)
+
+    Les appels fournisseurs sont ajoutés par lots à usage_events ; chaque
+    lot met à jour dans la même transaction le cumul usage_daily lu par le
+    dashboard et les quotas.
+    """
+
+    label = 'consommations'
+    thread_name = 'waveai-usage'
+
+    def __init__(self, prices=None, **options):
+        super().__init__(**options)
+        self.prices = prices or {}
+
+    def persist(self, batch):
+        db.session.execute(db.insert(UsageEvent), batch)
+        record_usage_rollups(batch)
+
+    def get_cost(self, model, prompt_tokens, completion_tokens):
+        """Coût estimé en dollars (0 pour un modèle sans prix connu)"""
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def record(self, user_id, agent_type, provider, model, prompt_tokens, completion_tokens, latency, estimated=False):
+        cost = self.get_cost(model, prompt_tokens, completion_tokens)
+        self.enqueue(user_id=user_id, agent_type=agent_type, provider=provider, model=model,
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, estimated=estimated,
+                     latency_ms=round(latency * 1000), cost=cost)
+        usage_quota.add(user_id, prompt_tokens + completion_tokens, cost)
+        return cost
+
+usage_ledger = UsageLedger(
+    prices=app.config['USAGE_PRICES'],
+    batch_size=app.config['USAGE_BATCH_SIZE'],
+    flush_interval=app.config['USAGE_FLUSH_INTERVAL'],
+    spill_path=app.config['USAGE_SPILL_PATH']
+)
+atexit.register(usage_ledger.close)
+
+def record_usage_rollups(rows):
+    """Met à jour usage_daily pour des appels ajoutés au registre
+
+    À appeler dans la même transaction que l'insertion dans usage_events.
+    """
+    totals = {}
+    for row in rows:
+        key = (row['user_id'], (row.get('created_at') or datetime.utcnow()).date(), row['agent_type'])
+        total = totals.setdefault(key, [0, 0, 0, 0.0])
+        total[0] += 1
+        total[1] += row['prompt_tokens']
+        total[2] += row['completion_tokens']
+        total[3] += row['cost']
+
+    values = [
+        {'user_id': user_id, 'day': day, 'agent_type': agent_type, 'requests': requests,
+         'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'cost': cost}
+        for (user_id, day, agent_type), (requests, prompt_tokens, completion_tokens, cost) in totals.items()
+    ]
+    if not values:
+        return
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        table = UsageDaily.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'day', 'agent_type'],
+            set_={
+                column: table.c[column] + statement.excluded[column]
+                for column in ('requests', 'prompt_tokens', 'completion_tokens', 'cost')
+            }
+        )
+        db.session.execute(statement, values)
+        return
+
+    # Autres bases : lecture puis mise à jour
+    for value in values:
+        daily = UsageDaily.query.filter_by(user_id=value['user_id'], day=value['day'],
+                                           agent_type=value['agent_type']).first()
+        if not daily:
+            daily = UsageDaily(user_id=value['user_id'], day=value['day'], agent_type=value['agent_type'],
+                               requests=0, prompt_tokens=0, completion_tokens=0, cost=0.0)
+            db.session.add(daily)
+        for column in ('requests', 'prompt_tokens', 'completion_tokens', 'cost'):
+            setattr(daily, column, getattr(daily, column) + value[column])
+
+def rebuild_usage_rollups():
+    """Reconstruit usage_daily à partir du registre usage_events"""
+    UsageDaily.query.delete()
+    day = db.func.date(UsageEvent.created_at)
+    rows = db.session.query(
+        UsageEvent.user_id, day, UsageEvent.agent_type, db.func.count(UsageEvent.id),
+        db.func.sum(UsageEvent.prompt_tokens), db.func.sum(UsageEvent.completion_tokens), db.func.sum(UsageEvent.cost)
+    ).group_by(UsageEvent.user_id, day, UsageEvent.agent_type).all()
+
+    for user_id, event_day, agent_type, requests, prompt_tokens, completion_tokens, cost in rows:
+        db.session.add(UsageDaily(
+            user_id=user_id,
+            day=event_day if not isinstance(event_day, str) else datetime.strptime(event_day, '%Y-%m-%d').date(),
+            agent_type=agent_type,
+            requests=requests,
+            prompt_tokens=prompt_tokens or 0,
+            completion_tokens=completion_tokens or 0,
+            cost=cost or 0.0
+        ))
+    db.session.commit()
+    return len(rows)
+
+class UsageQuota:
+    """Quotas quotidiens par utilisateur, contrôlés en mémoire
+
+    Le total du jour est lu dans usage_daily au premier contrôle (puis toutes
+    les refresh_interval secondes) et incrémenté localement à chaque appel :
+    le contrôle d'une requête ne fait en général aucune requête SQL. Entre
+    deux relectures un worker ne voit que ses propres appels, ce qui borne
+    le dépassement possible.
+    """
+
+    def __init__(self, daily_tokens=0, daily_cost=0.0, refresh_interval=60, max_entries=10000):
+        self.daily_tokens = daily_tokens
+        self.daily_cost = daily_cost
+        self.refresh_interval = refresh_interval
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.daily_tokens or self.daily_cost)
+
+    def load(self, user_id, day):
+        tokens, cost = db.session.query(
+            db.func.sum(UsageDaily.prompt_tokens + UsageDaily.completion_tokens),
+            db.func.sum(UsageDaily.cost)
+        ).filter(UsageDaily.user_id == user_id, UsageDaily.day == day).one()
+        return [day, int(tokens or 0), float(cost or 0.0), time.monotonic()]
+
+    def get(self, user_id):
+        """(tokens, coût) consommés aujourd'hui (UTC)"""
+        day = datetime.utcnow().date()
+        with self.lock:
+            entry = self.entries.get(user_id)
+        if entry is None or entry[0] != day or time.monotonic() - entry[3] >= self.refresh_interval:
+            entry = self.load(user_id, day)
+            with self.lock:
+                self.entries[user_id] = entry
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry[1], entry[2]
+
+    def add(self, user_id, tokens, cost):
+        if not self.enabled:
+            return
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] == datetime.utcnow().date():
+                entry[1] += tokens
+                entry[2] += cost
+
+    def check(self, user_id):
+        """Secondes avant la remise à zéro (minuit UTC) si le quota est atteint, sinon None"""
+        if not self.enabled:
+            return None
+        tokens, cost = self.get(user_id)
+        if (self.daily_tokens and tokens >= self.daily_tokens) or (self.daily_cost and cost >= self.daily_cost):
+            now = datetime.utcnow()
+            return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+        return None
+
+usage_quota = UsageQuota(
+    daily_tokens=app.config['USAGE_DAILY_TOKEN_QUOTA'],
+    daily_cost=app.config['USAGE_DAILY_COST_QUOTA'],
+    refresh_interval=app.config['USAGE_QUOTA_REFRESH']
+)
+
+def get_usage_summary(user_id, days=30):
+    """Consommation des derniers jours depuis le cumul quotidien"""
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+    rows = UsageDaily.query.filter(UsageDaily.user_id == user_id, UsageDaily.day >= since).all()
+
+    daily = {since + timedelta(days=offset): {'tokens': 0, 'cost': 0.0, 'requests': 0} for offset in range(days)}
+    per_agent = {}
+    for row in rows:
+        tokens = row.prompt_tokens + row.completion_tokens
+        for totals in (daily[row.day], per_agent.setdefault(row.agent_type, {'tokens': 0, 'cost': 0.0, 'requests': 0})):
+            totals['tokens'] += tokens
+            totals['cost'] += row.cost
+            totals['requests'] += row.requests
+
+    return {
+        'days': days,
+        'today': daily[today],
+        'tokens': sum(totals['tokens'] for totals in daily.values()),
+        'cost': round(sum(totals['cost'] for totals in daily.values()), 4),
+        'requests': sum(totals['requests'] for totals in daily.values()),
+        'per_agent': sorted(
+            (dict(totals, agent=agent_type, cost=round(totals['cost'], 4)) for agent_type, totals in per_agent.items()),
+            key=lambda totals: totals['tokens'], reverse=True
+        ),
+        'daily': [dict(totals, day=day.isoformat(), cost=round(totals['cost'], 4)) for day, totals in sorted(daily.items())],
+        'token_quota': usage_quota.daily_tokens or None,
+        'cost_quota': usage_quota.daily_cost or None
+    }
+
+thread_history = SnapshotCache(ttl=3600, max_entries=5000)
+summary_cache = SnapshotCache(ttl=3600, max_entries=5000)
+
+def normalize_thread_id(thread_id):
+    """Identifiant de fil fourni par le client, ou un nouveau s'il est absent/invalide"""
+    if isinstance(thread_id, str) and re.fullmatch(r'[A-Za-z0-9-]{8,36}', thread_id):
+        return thread_id
+    return uuid.uuid4().hex
+
+def get_conversation_context(user_id, thread_id):
+    """Historique récent du fil (mémoire locale validée contre la base)
+
+    La copie locale n'est gardée que si la base n'a pas changé pour ce fil
+    depuis son chargement (nombre de lignes et plus grand id, via l'index
+    user_id/thread_id) : un échange traité par un autre worker, ou écrit par
+    la file différée, provoque un rechargement.
+    """
+    key = (user_id, thread_id)
+    version = tuple(db.session.query(db.func.count(Conversation.id), db.func.max(Conversation.id)).filter(
+        Conversation.user_id == user_id, Conversation.thread_id == thread_id
+    ).one())
+    entry = thread_history.get(key)
+    if entry is None or entry[0] != version:
+        entry = (version, load_thread_turns(user_id, thread_id))
+        thread_history.set(key, entry)
+
+    return ConversationContext(key, entry[1], app.config['CONTEXT_TOKEN_BUDGETS'], summary_cache)
+
+def load_thread_turns(user_id, thread_id):
+    """Derniers échanges du fil en base, complétés par ceux encore dans la file d'écriture
+
+    Seule la file de ce processus est visible : un échange d'un autre worker
+    apparaît une fois écrit (au plus CONVERSATION_FLUSH_INTERVAL plus tard).
+    """
+    limit = app.config['CONTEXT_MAX_TURNS']
+    rows = db.session.query(Conversation.created_at, Conversation.message, Conversation.response).filter_by(
+        user_id=user_id, thread_id=thread_id
+    ).order_by(Conversation.created_at.desc(), Conversation.id.desc()).limit(limit).all()
+    rows = [tuple(row) for row in reversed(rows)]
+
+    # Un lot peut être à la fois écrit et encore marqué en cours : pas de doublon
+    stored = {(created_at, message) for created_at, message, _ in rows}
+    queued = [(row['created_at'], row['message'], row.get('response')) for row in conversation_writer.pending()
+              if row.get('user_id') == user_id and row.get('thread_id') == thread_id
+              and (row['created_at'], row['message']) not in stored]
+    if queued:
+        rows = sorted(rows + queued, key=lambda row: row[0] or datetime.min)
+
+    return deque(((message, response or '') for _, message, response in rows), maxlen=limit)
+
+def remember_turn(user_id, thread_id, message, response):
+    """Ajoute un échange à l'historique en mémoire (avant même son écriture en base)"""
+    entry = thread_history.get((user_id, thread_id))
+    if entry is not None:
+        entry[1].append((message, response or ''))
+
+# Marqueurs de surlignage (caractères à usage privé, remplacés après échappement HTML)
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_END = '\ue001'
+
+def setup_search_index():
+    """Crée l'index plein texte adapté à la base (tsvector/GIN ou FTS5)
+
+    Retourne le moteur utilisé : 'postgresql', 'fts5' ou 'like'.
+    """
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        with db.engine.begin() as connection:
+            connection.execute(db.text(
+                "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('french', coalesce(message, '') || ' ' || coalesce(response, ''))) STORED"
+            ))
+            connection.execute(db.text(
+                "CREATE INDEX IF NOT EXISTS ix_conversations_search ON conversations USING GIN (search_vector)"
+            ))
+        return 'postgresql'
+
+    if dialect == 'sqlite':
+        try:
+            with db.engine.begin() as connection:
+                exists = connection.execute(db.text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+                )).first()
+                connection.execute(db.text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5("
+                    "message, response, content='conversations', content_rowid='id', "
+                    "tokenize='unicode61 remove_diacritics 2')"
+                ))
+                connection.execute(db.text(
+                    "CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN "
+                    "INSERT INTO conversations_fts(rowid, message, response) VALUES (new.id, new.message, new.response); END"
+                ))
+                connection.execute(db.text(
+                    "CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN "
+                    "INSERT INTO conversations_fts(conversations_fts, rowid, message, response) "
+                    "VALUES ('delete', old.id, old.message, old.response); END"
+                ))
+                connection.execute(db.text(
+                    "CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE ON conversations BEGIN "
+                    "INSERT INTO conversations_fts(conversations_fts, rowid, message, response) "
+                    "VALUES ('delete', old.id, old.message, old.response); "
+                    "INSERT INTO conversations_fts(rowid, message, response) VALUES (new.id, new.message, new.response); END"
+                ))
+                if not exists:
+                    # Indexer les conversations existantes
+                    connection.execute(db.text("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')"))
+            return 'fts5'
+        except Exception as e:
+            logger.error(f"FTS5 indisponible, recherche par LIKE: {e}")
+
+    return 'like'
+
+def detect_search_engine():
+    """Moteur de recherche d'un schéma déjà initialisé (workers sans init-db)"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return 'postgresql'
+    if dialect == 'sqlite':
+        try:
+            with db.engine.connect() as connection:
+                if connection.execute(db.text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+                )).first():
+                    return 'fts5'
+        except Exception as e:
+            logger.error(f"Erreur détection recherche: {e}")
+    return 'like'
+
+def fts5_query(text):
+    """Requête FTS5 sûre : chaque mot entre guillemets, préfixe sur le dernier"""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = ['"' + word.replace('"', '""') + '"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def render_highlight(text):
+    """Échappe le HTML puis transforme les marqueurs de surlignage en <mark>"""
+    if not text:
+        return ''
+    return str(escape(text)).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+
+def search_conversations(user_id, text, agent_type=None, limit=20, offset=0):
+    """Recherche plein texte classée dans les conversations d'un utilisateur
+
+    Retourne limit + 1 résultats au plus (le dernier indique une page suivante).
+    """
+    engine = app.config.get('SEARCH_ENGINE')
+    if engine is None:
+        engine = app.config['SEARCH_ENGINE'] = detect_search_engine()
+    params = {'user_id': user_id, 'agent_type': agent_type, 'limit': limit + 1, 'offset': offset}
+    agent_filter = 'AND c.agent_type = :agent_type' if agent_type else ''
+
+    if engine == 'postgresql':
+        params.update({
+            'query': text,
+            'options': f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxFragments=2, MaxWords=30, MinWords=10'
+        })
+        # Le surlignage n'est calculé que pour la page retenue
+        sql = f"""
+            WITH q AS (SELECT websearch_to_tsquery('french', :query) AS query),
+            page AS (
+                SELECT c.id, ts_rank(c.search_vector, q.query) AS rank
+                FROM conversations c, q
+                WHERE c.user_id = :user_id {agent_filter} AND c.search_vector @@ q.query
+                ORDER BY rank DESC, c.id DESC
+                LIMIT :limit OFFSET :offset
+            )
+            SELECT c.id, c.agent_type, c.thread_id, c.created_at, page.rank,
+                   ts_headline('french', c.message, q.query, :options) AS message,
+                   ts_headline('french', coalesce(c.response, ''), q.query, :options) AS response
+            FROM page JOIN conversations c ON c.id = page.id, q
+            ORDER BY page.rank DESC, c.id DESC
+        """
+    elif engine == 'fts5':
+        query = fts5_query(text)
+        if not query:
+            return []
+        params.update({'query': query, 'start': HIGHLIGHT_START, 'end': HIGHLIGHT_END})
+        sql = f"""
+            SELECT c.id, c.agent_type, c.thread_id, c.created_at, -bm25(conversations_fts) AS rank,
+                   snippet(conversations_fts, 0, :start, :end, '…', 24) AS message,
+                   snippet(conversations_fts, 1, :start, :end, '…', 32) AS response
+            FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid
+            WHERE conversations_fts MATCH :query AND c.user_id = :user_id {agent_filter}
+            ORDER BY rank DESC, c.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        params['pattern'] = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        sql = f"""
+            SELECT c.id, c.agent_type, c.thread_id, c.created_at, 0 AS rank, c.message, c.response
+            FROM conversations c
+            WHERE c.user_id = :user_id {agent_filter}
+              AND (c.message LIKE :pattern ESCAPE '\\' OR c.response LIKE :pattern ESCAPE '\\')
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+
+    rows = db.session.execute(db.text(sql), params).mappings().all()
+    results = []
+    for row in rows:
+        created_at = row['created_at']
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        results.append({
+            'id': row['id'],
+            'agent': row['agent_type'],
+            'thread_id': row['thread_id'],
+            'created_at': created_at.isoformat() if created_at else None,
+            'rank': round(float(row['rank'] or 0), 4),
+            'message': render_highlight(row['message']),
+            'response': render_highlight(row['response'])
+        })
+    return results
+
+class ConversationArchiver:
+    """Déplace les conversations anciennes vers des archives JSONL gzip
+
+    Un fichier par utilisateur et par mois (ARCHIVE_DIR/<user>/<AAAA-MM>.jsonl.gz),
+    complété par membres gzip successifs, et indexé dans conversation_archives.
+    Le fichier est écrit avant la suppression des lignes : après un arrêt
+    brutal, une ligne peut être archivée deux fois, la lecture dédoublonne.
+
+    Un thread par worker, mais un seul archive à la fois (verrou fichier).
+    """
+
+    def __init__(self, directory, default_days=0, batch_size=500, interval=3600):
+        self.directory = directory
+        self.default_days = default_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pid = None
+
+    def start(self):
+        """Démarre l'archivage périodique (une fois par processus worker)"""
+        if not self.interval or self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        threading.Thread(target=self.run, name='waveai-archiver', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval * random.uniform(0.9, 1.1))
+            try:
+                with app.app_context():
+                    self.run_once()
+            except Exception as e:
+                logger.error(f"Erreur archivage: {e}")
+
+    def run_once(self):
+        """Archive, purge et prépare les partitions ; sans effet si un autre worker s'en charge"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0
+            ensure_partitions()
+            archived = self.archive()
+            self.purge()
+            drop_empty_partitions()
+            return archived
+
+    def get_policies(self):
+        """Délais d'archivage et de suppression personnalisés par utilisateur"""
+        rows = db.session.query(
+            AISettings.user_id, AISettings.archive_after_days, AISettings.delete_after_days
+        ).filter(db.or_(AISettings.archive_after_days.isnot(None), AISettings.delete_after_days.isnot(None))).all()
+        return {user_id: (archive_days, delete_days) for user_id, archive_days, delete_days in rows}
+
+    def archive(self, now=None):
+        now = now or datetime.utcnow()
+        policies = self.get_policies()
+        delays = [days for days in [self.default_days] + [p[0] for p in policies.values()] if days]
+        if not delays:
+            return 0
+
+        # Utilisateurs ayant des lignes plus vieilles que le plus court des délais
+        oldest = now - timedelta(days=min(delays))
+        user_ids = [user_id for (user_id,) in db.session.query(Conversation.user_id)
+                    .filter(Conversation.created_at < oldest).distinct()]
+
+        archived = 0
+        for user_id in user_ids:
+            days = policies.get(user_id, (None, None))[0] or self.default_days
+            if days:
+                archived += self.archive_user(user_id, now - timedelta(days=days))
+        if archived:
+            logger.info(f"📦 {archived} conversations archivées")
+        return archived
+
+    def archive_user(self, user_id, cutoff):
+        """Archive les conversations antérieures à cutoff, par lots
+
+        created_at n'a qu'une valeur par défaut côté Python : les anciennes
+        lignes sans date ne sont rattachées à aucun mois et restent en table.
+        """
+        archived = 0
+        while True:
+            rows = Conversation.query.filter(
+                Conversation.user_id == user_id,
+                Conversation.created_at.isnot(None),
+                Conversation.created_at < cutoff
+            ).order_by(Conversation.id).limit(self.batch_size).all()
+            if not rows:
+                return archived
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(row.created_at.strftime('%Y-%m'), []).append(row)
+
+            for month, month_rows in by_month.items():
+                path = self.get_path(user_id, month)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with gzip.open(path, 'at', encoding='utf-8') as handle:
+                    for row in month_rows:
+                        handle.write(json.dumps(row.to_dict(), ensure_ascii=False) + '\n')
+                self.index(user_id, month, path, month_rows)
+
+            Conversation.query.filter(Conversation.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+            db.session.commit()
+            archived += len(rows)
+
+    def index(self, user_id, month, path, rows):
+        """Met à jour l'index du mois : une lecture et un flush par lot, pas par ligne"""
+        totals = {}
+        for row in rows:
+            count, tokens, first_at, last_at = totals.get(row.agent_type, (0, 0, row.created_at, row.created_at))
+            totals[row.agent_type] = (
+                count + 1,
+                tokens + estimate_tokens(row.message) + estimate_tokens(row.response),
+                min(first_at, row.created_at),
+                max(last_at, row.created_at)
+            )
+
+        entries = {entry.agent_type: entry for entry in ConversationArchive.query.filter(
+            ConversationArchive.user_id == user_id,
+            ConversationArchive.month == month,
+            ConversationArchive.agent_type.in_(list(totals))
+        )}
+        created = []
+        for agent_type, (count, tokens, first_at, last_at) in totals.items():
+            entry = entries.get(agent_type)
+            if entry is None:
+                created.append(ConversationArchive(user_id=user_id, month=month, agent_type=agent_type, path=path,
+                                                   row_count=count, tokens=tokens, first_at=first_at, last_at=last_at))
+                continue
+            entry.row_count += count
+            entry.tokens += tokens
+            entry.first_at = min(entry.first_at, first_at) if entry.first_at else first_at
+            entry.last_at = max(entry.last_at, last_at) if entry.last_at else last_at
+        db.session.add_all(created)
+        db.session.flush()
+
+    def purge(self, now=None):
+        """Supprime l'historique au-delà du délai de suppression de l'utilisateur
+
+        Les archives mensuelles expirées sont effacées, ainsi que les
+        conversations encore en table principale (archivage désactivé ou
+        délai de suppression plus court que celui d'archivage).
+        """
+        now = now or datetime.utcnow()
+        purged = 0
+        for user_id, (_, delete_days) in self.get_policies().items():
+            if not delete_days:
+                continue
+            cutoff = now - timedelta(days=delete_days)
+            self.delete_user(user_id, cutoff)
+            months = db.session.query(ConversationArchive.month, db.func.max(ConversationArchive.last_at)) \
+                .filter_by(user_id=user_id).group_by(ConversationArchive.month).all()
+            for month, last_at in months:
+                if last_at and last_at < cutoff:
+                    path = self.get_path(user_id, month)
+                    if os.path.exists(path):
+                        os.remove(path)
+                    ConversationArchive.query.filter_by(user_id=user_id, month=month).delete()
+                    purged += 1
+        db.session.commit()
+        return purged
+
+    def delete_user(self, user_id, cutoff):
+        """Supprime par lots les conversations de l'utilisateur antérieures à cutoff"""
+        deleted = 0
+        while True:
+            ids = [conversation_id for (conversation_id,) in db.session.query(Conversation.id).filter(
+                Conversation.user_id == user_id, Conversation.created_at < cutoff
+            ).order_by(Conversation.id).limit(self.batch_size)]
+            if not ids:
+                return deleted
+            Conversation.query.filter(Conversation.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+
+    def get_path(self, user_id, month):
+        return os.path.join(self.directory, str(int(user_id)), f'{month}.jsonl.gz')
+
+    def read(self, user_id, month, agent_type=None):
+        """Conversations archivées d'un mois, de la plus récente à la plus ancienne"""
+        path = self.get_path(user_id, month)
+        if not os.path.exists(path):
+            return []
+
+        rows = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            for line in handle:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if agent_type and row['agent'] != agent_type:
+                    continue
+                rows[row['id']] = row
+        return sorted(rows.values(), key=lambda row: (row['created_at'] or '', row['id']), reverse=True)
+
+archiver = ConversationArchiver(
+    directory=app.config['ARCHIVE_DIR'],
+    default_days=app.config['ARCHIVE_AFTER_DAYS'],
+    batch_size=app.config['ARCHIVE_BATCH_SIZE'],
+    interval=app.config['ARCHIVE_INTERVAL']
+)
+
+def is_partitioned():
+    """Vrai si conversations est une table partitionnée PostgreSQL"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(db.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'conversations'"
+    )).first() is not None
+
+def month_start(moment, offset=0):
+    """Premier jour du mois de moment, décalé de offset mois"""
+    index = moment.year * 12 + moment.month - 1 + offset
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def ensure_partitions(months_ahead=2):
+    """Crée les partitions mensuelles du mois courant et des mois suivants"""
+    if not is_partitioned():
+        return
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        for offset in range(months_ahead + 1):
+            create_partition(connection, month_start(now, offset))
+
+def create_partition(connection, start):
+    end = month_start(start, 1)
+    connection.execute(db.text(
+        f"CREATE TABLE IF NOT EXISTS conversations_{start:%Y_%m} PARTITION OF conversations "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+def drop_empty_partitions():
+    """Supprime les partitions mensuelles passées devenues vides après archivage"""
+    if not is_partitioned():
+        return
+    current = f"conversations_{month_start(datetime.utcnow()):%Y_%m}"
+    partitions = db.session.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'conversations' "
+        "AND c.relname ~ '^conversations_[0-9]{4}_[0-9]{2}$' ORDER BY c.relname"
+    )).scalars().all()
+    db.session.commit()
+
+    for name in partitions:
+        if name >= current:
+            break
+        with db.engine.begin() as connection:
+            if connection.execute(db.text(f"SELECT 1 FROM {name} LIMIT 1")).first() is None:
+                connection.execute(db.text(f"ALTER TABLE conversations DETACH PARTITION {name}"))
+                connection.execute(db.text(f"DROP TABLE {name}"))
+                logger.info(f"Partition vide supprimée: {name}")
+
+def partition_conversations():
+    """Convertit conversations en table partitionnée par mois (PostgreSQL)
+
+    Opération ponctuelle, dans une seule transaction : copie des lignes dans
+    une table partitionnée par created_at, puis remplacement de l'ancienne.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError("Le partitionnement nécessite PostgreSQL")
+    if is_partitioned():
+        return False
+    db.session.commit()
+
+    columns = ', '.join(column.name for column in Conversation.__table__.columns)
+    with db.engine.begin() as connection:
+        sequence = connection.execute(db.text("SELECT pg_get_serial_sequence('conversations', 'id')")).scalar()
+        connection.execute(db.text("UPDATE conversations SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL"))
+        oldest = connection.execute(db.text("SELECT MIN(created_at) FROM conversations")).scalar() or datetime.utcnow()
+
+        connection.execute(db.text("ALTER TABLE conversations RENAME TO conversations_unpartitioned"))
+        connection.execute(db.text(
+            "CREATE TABLE conversations (LIKE conversations_unpartitioned INCLUDING DEFAULTS INCLUDING GENERATED) "
+            "PARTITION BY RANGE (created_at)"
+        ))
+        connection.execute(db.text("ALTER TABLE conversations ALTER COLUMN created_at SET NOT NULL"))
+        connection.execute(db.text("ALTER TABLE conversations ADD PRIMARY KEY (id, created_at)"))
+        connection.execute(db.text("ALTER TABLE conversations ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+        connection.execute(db.text("CREATE TABLE conversations_default PARTITION OF conversations DEFAULT"))
+
+        start = month_start(oldest)
+        while start <= month_start(datetime.utcnow(), 2):
+            create_partition(connection, start)
+            start = month_start(start, 1)
+
+        connection.execute(db.text(f"INSERT INTO conversations ({columns}) SELECT {columns} FROM conversations_unpartitioned"))
+        if sequence:
+            connection.execute(db.text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+        connection.execute(db.text("DROP TABLE conversations_unpartitioned"))
+        if sequence:
+            connection.execute(db.text(f"ALTER SEQUENCE {sequence} OWNED BY conversations.id"))
+
+        # Index partitionnés : créés sur la table mère, propagés aux partitions
+        for index in Conversation.__table__.indexes:
+            index.create(bind=connection)
+
+    setup_search_index()
+    return True
+
+def save_conversation(user_id, agent_type, message, response, thread_id=None):
+    """Enregistre une conversation (différée par défaut, synchrone sinon)"""
+    if thread_id:
+        remember_turn(user_id, thread_id, message, response)
+
+    if app.config['CONVERSATION_WRITE_BEHIND']:
+        conversation_writer.enqueue(user_id=user_id, agent_type=agent_type, message=message, response=response,
+                                    thread_id=thread_id)
+        return
+
+    try:
+        conversation = Conversation(
+            user_id=user_id,
+            agent_type=agent_type,
+            thread_id=thread_id,
+            message=message,
+            response=response
+        )
+        db.session.add(conversation)
+        db.session.flush()
+        record_conversation_stats([{
+            'user_id': user_id,
+            'agent_type': agent_type,
+            'message': message,
+            'response': response,
+            'created_at': conversation.created_at
+        }])
+        db.session.commit()
+
+    except Exception as e:
+        logger.error(f"Erreur sauvegarde conversation: {e}")
+        db.session.rollback()
+
+def get_user_settings(user_id):
+    """Récupère les paramètres IA d'un utilisateur"""
+    try:
+        with read_replica():
+            settings = AISettings.query.filter_by(user_id=user_id).first()
+        if not settings:
+            # Absents de la réplique : vérifier le primaire avant de créer
+            settings = AISettings.query.filter_by(user_id=user_id).first()
+        if not settings:
+            settings = AISettings(user_id=user_id)
+            db.session.add(settings)
+            db.session.commit()
+        return settings
+    except Exception as e:
+        logger.error(f"Erreur get_user_settings: {e}")
+        return None
+
+user_limiter = RateLimiter(*app.config['RATE_LIMITS']['user'], path=app.config['RATE_LIMIT_PATH'])
+inflight_chats = threading.BoundedSemaphore(app.config['MAX_INFLIGHT_CHATS'])
+
+def admit_chat(user_id):
+    """Contrôle d'admission d'une requête de chat
+
+    Retourne None si la requête est admise (un créneau est alors réservé et
+    doit être libéré avec inflight_chats.release()), sinon une réponse 429.
+    Une requête refusée après coup rend son jeton au limiteur.
+    """
+    rejected = check_quota(user_id)
+    if rejected:
+        return rejected
+
+    limiter_key = f"user:{user_id}"
+    allowed, retry_after = user_limiter.acquire(limiter_key)
+    if not allowed:
+        return too_many_requests('Trop de messages, veuillez patienter quelques secondes', retry_after)
+
+    if not inflight_chats.acquire(timeout=app.config['ADMISSION_WAIT']):
+        user_limiter.refund(limiter_key)
+        return too_many_requests('Service très sollicité, veuillez réessayer', 1)
+
+    return None
+
+def check_quota(user_id):
+    """Réponse 429 si le quota quotidien de l'utilisateur est atteint, sinon None"""
+    retry_after = usage_quota.check(user_id)
+    if retry_after is None:
+        return None
+    return too_many_requests('Quota quotidien atteint, réessayez demain', retry_after)
+
+def too_many_requests(error, retry_after):
+    response = jsonify({'error': error, 'retry_after': math.ceil(retry_after)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+idempotent_responses = SnapshotCache(ttl=600, max_entries=10000)
+
+def get_idempotency_key(data):
+    """Clé d'idempotence fournie par le client (en-tête Idempotency-Key ou champ JSON)"""
+    key = request.headers.get('Idempotency-Key') or (data or {}).get('idempotency_key')
+    if isinstance(key, str) and 0 < len(key) <= 100:
+        return key
+    return None
+
+def request_fingerprint(data, message, agent_type):
+    """Empreinte du contenu d'une requête de chat (agent, message, fil demandé)"""
+    raw = json.dumps([agent_type, message, (data or {}).get('thread_id')], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def remember_response(user_id, idempotency_key, fingerprint, payload, status=200, kind='chat'):
+    """Mémorise la réponse d'une requête idempotente avec sa nature et son code HTTP
+
+    kind vaut 'chat' pour une réponse complète, 'job' pour un travail mis en file (202).
+    """
+    idempotent_responses.set((user_id, idempotency_key), {
+        'kind': kind, 'status': status, 'payload': payload, 'fingerprint': fingerprint
+    })
+
+def find_replay(user_id, idempotency_key, fingerprint):
+    """Retourne (réponse mémorisée ou None, réponse d'erreur ou None)
+
+    Une clé déjà utilisée pour une autre requête (message, agent ou fil
+    différent) est refusée en 422 plutôt que de rejouer une réponse étrangère.
+    """
+    replay = idempotent_responses.get((user_id, idempotency_key))
+    if replay and replay['fingerprint'] != fingerprint:
+        return None, (jsonify({'error': 'Clé d\'idempotence déjà utilisée pour une autre requête'}), 422)
+    return replay, None
+
+def replay_json(replay):
+    """Rejoue telle quelle une réponse mémorisée (code HTTP et en-têtes compris)"""
+    response = jsonify(replay['payload'])
+    response.status_code = replay['status']
+    if replay['kind'] == 'job':
+        response.headers['Location'] = replay['payload']['status_url']
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def parse_chat_request(data):
+    """Valide le corps JSON d'une requête de chat
+
+    Retourne (message, agent_type, erreur).
+    """
+    if not data:
+        return None, None, 'Données manquantes'
+
+    message = (data.get('message') or '').strip()
+    agent_type = data.get('agent_type', 'kai')
+
+    if not message:
+        return None, None, 'Message vide'
+
+    if len(message) > 5000:
+        return None, None, 'Message trop long'
+
+    if agent_type not in ai_system.agents:
+        return None, None, 'Agent invalide'
+
+    return message, agent_type, None
+
+def answer_chat(user_id, message, agent_type, thread_id, settings_version=None):
+    """Paramètres, historique, appel fournisseur et sauvegarde d'un message
+
+    Retourne la réponse de /api/chat. Utilisé par la requête synchrone et
+    par les travaux de la file asynchrone (settings_version : version des
+    paramètres connue lors de la mise en file).
+    """
+    with timed_phase('settings'):
+        settings = get_cached_settings(user_id, settings_version)
+    with timed_phase('context'):
+        context = get_conversation_context(user_id, thread_id)
+
+    # Générer réponse IA
+    with timed_phase('provider'):
+        response = ai_system.get_response(message, agent_type, settings, context)
+
+    # Sauvegarder conversation (une seule fois pour des envois en double)
+    if not response.get('coalesced'):
+        with timed_phase('persist'):
+            save_conversation(user_id, agent_type, message, response.get('response', ''), thread_id)
+
+    return {
+        'success': True,
+        'response': response.get('response', ''),
+        'agent': agent_type,
+        'model': response.get('model', 'unknown'),
+        'thread_id': thread_id,
+        'timestamp': response.get('timestamp', datetime.utcnow().isoformat())
+    }
+
+def wants_async(data):
+    """Mode asynchrone demandé (champ async ou en-tête Prefer: respond-async)"""
+    mode = app.config['CHAT_JOB_MODE']
+    if mode == 'always':
+        return True
+    if mode != 'optional':
+        return False
+    return bool(data.get('async')) or 'respond-async' in request.headers.get('Prefer', '')
+
+class JobQueue:
+    """File de travaux persistante (SQLite) pour les appels fournisseurs lents
+
+    La requête web insère le travail et répond aussitôt ; un pool de threads
+    (dans chaque worker gunicorn, ou dans un processus dédié via
+    `flask run-jobs`) le traite. Un travail réclamé reçoit un bail : si son
+    processus meurt, il est repris à l'expiration du bail (max_attempts fois).
+
+    Les threads d'un worker web démarrent au premier travail mis en file ou
+    suivi ; au repos, ils se contentent d'une lecture sans verrou d'écriture.
+    """
+
+    def __init__(self, path, workers=4, lease=120, ttl=3600, max_queued=1000, poll_interval=0.5, max_attempts=3):
+        self.path = path
+        self.workers = workers
+        self.lease = lease
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.handlers = {}
+        self.wakeup = threading.Event()
+        self.finished = threading.Condition()
+        self.ready = False
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def connect(self):
+        if not self.ready:
+            with self.lock:
+                if not self.ready:
+                    self.setup()
+                    self.ready = True
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def setup(self):
+        with sqlite3.connect(self.path, timeout=5) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, user_id INTEGER NOT NULL, '
+                'payload TEXT NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, '
+                'created REAL NOT NULL, lease_until REAL, finished REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created)')
+
+    def start(self):
+        """Démarre les threads de traitement (une fois par processus)"""
+        if not self.workers or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        for index in range(self.workers):
+            threading.Thread(target=self.run, name=f'waveai-jobs-{index}', daemon=True).start()
+
+    def enqueue(self, kind, user_id, payload):
+        """Ajoute un travail ; retourne son identifiant, ou None si la file est pleine"""
+        job_id = uuid.uuid4().hex
+        connection = self.connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            queued = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                connection.execute('ROLLBACK')
+                return None
+            connection.execute(
+                "INSERT INTO jobs (id, kind, user_id, payload, status, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, user_id, json.dumps(payload, ensure_ascii=False), time.time())
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+
+        self.wakeup.set()
+        return job_id
+
+    def claim(self):
+        """Réserve le plus ancien travail en attente (ou dont le bail a expiré)"""
+        now = time.time()
+        connection = self.connect()
+        try:
+            # File vide : simple lecture, le verrou d'écriture n'est pris que s'il y a du travail
+            pending = connection.execute(
+                "SELECT 1 FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) LIMIT 1", (now,)
+            ).fetchone()
+            if not pending:
+                return None
+
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute(
+                "SELECT id, kind, user_id, payload, attempts FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) ORDER BY created LIMIT 1", (now,)
+            ).fetchone()
+            if row and row[4] >= self.max_attempts:
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                    ('Nombre maximal de tentatives atteint', now, row[0])
+                )
+                row = None
+            elif row:
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                    (now + self.lease, row[0])
+                )
+            if random.random() < 0.01:
+                connection.execute("DELETE FROM jobs WHERE finished < ?", (now - self.ttl,))
+            connection.execute('COMMIT')
+        except Exception:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+        finally:
+            connection.close()
+        return row
+
+    def finish(self, job_id, result=None, error=None):
+        connection = self.connect()
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, lease_until = NULL WHERE id = ?",
+                ('failed' if error else 'done', json.dumps(result, ensure_ascii=False) if result else None,
+                 error, time.time(), job_id)
+            )
+        finally:
+            connection.close()
+        with self.finished:
+            self.finished.notify_all()
+
+    def run(self):
+        while True:
+            try:
+                job = self.claim()
+            except Exception as e:
+                logger.error(f"Erreur file de travaux: {e}")
+                job = None
+
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+
+            job_id, kind, user_id, payload, _ = job
+            try:
+                with app.app_context():
+                    result = self.handlers[kind](user_id, json.loads(payload))
+                self.finish(job_id, result=result)
+            except Exception as e:
+                logger.error(f"Erreur travail {kind} {job_id}: {e}")
+                self.finish(job_id, error='Erreur de communication avec l\'agent')
+
+    def get(self, job_id, user_id):
+        """État d'un travail de l'utilisateur, None s'il n'existe pas"""
+        connection = self.connect()
+        try:
+            row = connection.execute(
+                'SELECT status, result, error, created, finished FROM jobs WHERE id = ? AND user_id = ?',
+                (job_id, user_id)
+            ).fetchone()
+        finally:
+            connection.close()
+        if not row:
+            return None
+
+        status, result, error, created, finished = row
+        job = {'job_id': job_id, 'status': status, 'created_at': datetime.utcfromtimestamp(created).isoformat()}
+        if result:
+            job['result'] = json.loads(result)
+        if error:
+            job['error'] = error
+        if finished:
+            job['finished_at'] = datetime.utcfromtimestamp(finished).isoformat()
+        return job
+
+    def wait(self, job_id, user_id, timeout):
+        """Attente longue : retourne l'état dès que le travail est terminé ou à l'expiration"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id, user_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in ('done', 'failed') or remaining <= 0:
+                return job
+            # Réveil immédiat si le travail est traité par ce processus
+            with self.finished:
+                self.finished.wait(min(remaining, self.poll_interval))
+
+def process_chat_job(user_id, payload):
+    return answer_chat(user_id, payload['message'], payload['agent_type'], payload['thread_id'],
+                       payload.get('settings_version'))
+
+job_queue = JobQueue(
+    path=app.config['JOB_QUEUE_PATH'],
+    workers=app.config['JOB_WORKERS'],
+    lease=app.config['JOB_LEASE'],
+    ttl=app.config['JOB_RESULT_TTL'],
+    max_queued=app.config['JOB_QUEUE_MAX'],
+    poll_interval=app.config['JOB_POLL_INTERVAL']
+)
+job_queue.register('chat', process_chat_job)
+
+def encode_cursor(conversation):
+    """Curseur opaque (created_at, id) de la dernière ligne d'une page"""
+    raw = f"{conversation.created_at.isoformat()}|{conversation.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Retourne (created_at, id) ou None si le curseur est invalide"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, conversation_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(conversation_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def format_sse(event, data, event_id=None):
+    """Formate un événement Server-Sent Events"""
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def get_status_state():
+    """État public diffusé aux clients (sans horodatage, pour détecter les changements)"""
+    providers = {}
+    for breaker in ai_system.get_breaker_states():
+        states = providers.setdefault(breaker['provider'], set())
+        states.add(breaker['state'])
+
+    return {
+        'status': 'ok',
+        'version': '1.0.0',
+        'agents_available': len(ai_system.agents),
+        'agents': sorted(ai_system.agents),
+        'ollama_available': ai_system.check_ollama_availability(),
+        # Un fournisseur est ouvert si toutes ses clés le sont
+        'providers': {
+            provider: CircuitBreaker.OPEN if states == {CircuitBreaker.OPEN}
+            else CircuitBreaker.HALF_OPEN if CircuitBreaker.HALF_OPEN in states
+            else CircuitBreaker.CLOSED
+            for provider, states in sorted(providers.items())
+        }
+    }
+
+class StatusBroadcaster:
+    """Source unique de l'état diffusé par /api/status/stream
+
+    Un thread par worker recalcule l'état en mémoire toutes les
+    check_interval secondes et ne réveille les flux abonnés que s'il a
+    changé. Les identifiants d'événement incluent un jeton propre au
+    processus : un client reconnecté sur un autre worker reçoit l'état.
+    """
+
+    def __init__(self, check_interval=5, max_streams=2):
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        self.version = 0
+        self.state = None
+        self.token = None
+        self.streams = threading.BoundedSemaphore(max_streams) if max_streams else None
+        self.pid = None
+
+    def start(self):
+        """Démarre le suivi de l'état (une fois par processus worker)"""
+        if self.pid == os.getpid():
+            return
+        with self.condition:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.token = secrets.token_hex(4)
+        self.refresh()
+        threading.Thread(target=self.run, name='waveai-status', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Erreur suivi du statut: {e}")
+
+    def refresh(self):
+        state = get_status_state()
+        with self.condition:
+            if state != self.state:
+                self.state = state
+                self.version += 1
+                self.condition.notify_all()
+
+    def event_id(self, version):
+        return f"{self.token}-{version}"
+
+    def current(self):
+        with self.condition:
+            return self.version, self.state
+
+    def wait(self, version, timeout):
+        """Attend un état plus récent que version ; retourne (version, état)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version, self.state
+
+    def acquire_stream(self):
+        return self.streams is not None and self.streams.acquire(blocking=False)
+
+    def release_stream(self):
+        self.streams.release()
+
+status_broadcaster = StatusBroadcaster(
+    check_interval=app.config['STATUS_CHECK_INTERVAL'],
+    max_streams=app.config['STATUS_STREAM_MAX']
+)
+
+# =============================================================================
+# ASSETS STATIQUES ET CACHE HTTP
+# =============================================================================
+
+class AssetPipeline:
+    """Fichiers statiques versionnés par empreinte et précompressés en mémoire
 
-            import openai
-            openai.api_key = settings.openai_api_key
-            
-            agent = self.agents.get(agent_type, self.agents['kai'])
+    asset_url('css/base.css') donne /assets/css/base.<empreinte>.css, servi
+    avec un cache long (immutable) : toute modification du fichier change
+    son URL. Les variantes gzip (et brotli si installé) sont calculées une
+    seule fois, au démarrage.
+    """
 
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": agent['prompt']},
-                    {"role": "user", "content": message}
-                ],
-                max_tokens=min(settings.max_tokens or 1000, 2000),
-                temperature=settings.temperature or 0.7
-            )
+    COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt', '.html')
 
-            return {
-                'success': True,
-                'response': response.choices[0].message.content.strip(),
-                'model': 'openai',
-                'agent': agent_type,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Erreur OpenAI: {e}")
-            return None
+    def __init__(self, directory, max_age=31536000):
+        self.directory = directory
+        self.max_age = max_age
+        self.urls = {}
+        self.files = {}
+        self.built_mtime = None
+        self.lock = threading.Lock()
 
-    def get_anthropic_response(self, message, agent_type, settings):
-        """Génère une réponse via Anthropic Claude"""
-        try:
-            if not settings or not settings.anthropic_api_key:
-                return None
+    def get_mtime(self):
+        mtimes = [os.path.getmtime(path) for path in glob.glob(os.path.join(self.directory, '**', '*'), recursive=True)]
+        return max(mtimes, default=0)
 
-            import anthropic
-            client = anthropic.Client(api_key=settings.anthropic_api_key)
-            
-            agent = self.agents.get(agent_type, self.agents['kai'])
+    def build(self):
+        urls, files = {}, {}
+        for path in sorted(glob.glob(os.path.join(self.directory, '**', '*'), recursive=True)):
+            if not os.path.isfile(path):
+                continue
+            name = os.path.relpath(path, self.directory).replace(os.sep, '/')
+            with open(path, 'rb') as handle:
+                body = handle.read()
 
-            response = client.completions.create(
-                model="claude-instant-1.2",
-                max_tokens_to_sample=min(settings.max_tokens or 1000, 1500),
-                temperature=settings.temperature or 0.7,
-                prompt=f"\n\nHuman: {agent['prompt']}\n\n{message}\n\nAssistant:"
-            )
+            digest = hashlib.sha256(body).hexdigest()[:12]
+            stem, extension = os.path.splitext(name)
+            hashed = f'{stem}.{digest}{extension}'
+            entry = {'identity': body, 'etag': digest, 'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+            if extension in self.COMPRESSIBLE:
+                entry['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+                if brotli:
+                    entry['br'] = brotli.compress(body, quality=11)
+            urls[name] = hashed
+            files[hashed] = entry
 
-            return {
-                'success': True,
-                'response': response.completion.strip(),
-                'model': 'anthropic',
-                'agent': agent_type,
-                'timestamp': datetime.utcnow().isoformat()
-            }
-            
-        except Exception as e:
-            logger.error(f"Erreur Anthropic: {e}")
-            return None
+        self.urls, self.files = urls, files
+        self.built_mtime = self.get_mtime()
+        logger.info(f"Assets: {len(files)} fichiers versionnés")
 
-    def get_response(self, message, agent_type='kai', user_settings=None):
-        """Génère une réponse avec système de fallback robuste"""
-        if not message or not message.strip():
-            agent = self.agents.get(agent_type, self.agents['kai'])
-            return {
-                'success': True,
-                'response': f"Bonjour ! Je suis {agent['name']}, {agent['speciality'].lower()}. Comment puis-je vous aider aujourd'hui ?",
-                'agent': agent_type,
-                'model': 'default',
-                'timestamp': datetime.utcnow().isoformat()
-            }
+    def ensure_built(self):
+        # En développement, les fichiers modifiés sont repris sans redémarrage
+        if self.built_mtime is None or (app.debug and self.get_mtime() > self.built_mtime):
+            with self.lock:
+                if self.built_mtime is None or (app.debug and self.get_mtime() > self.built_mtime):
+                    self.build()
 
-        # Ordre des tentatives selon les préférences utilisateur
-        methods = []
-        
-        if user_settings:
-            if user_settings.default_model == 'openai' and user_settings.openai_api_key:
-                methods.append(self.get_openai_response)
-            elif user_settings.default_model == 'anthropic' and user_settings.anthropic_api_key:
-                methods.append(self.get_anthropic_response)
+    def url(self, name):
+        """URL versionnée d'un fichier de static/ (nom d'origine si inconnu)"""
+        self.ensure_built()
+        return url_for('asset', filename=self.urls.get(name, name))
 
-            # Ajouter les autres APIs disponibles
-            if user_settings.openai_api_key and self.get_openai_response not in methods:
-                methods.append(self.get_openai_response)
-            if user_settings.anthropic_api_key and self.get_anthropic_response not in methods:
-                methods.append(self.get_anthropic_response)
+    def send(self, filename):
+        self.ensure_built()
+        entry = self.files.get(filename)
+        if entry is None:
+            return Response('Not found', status=404, mimetype='text/plain')
 
-        # Hugging Face comme fallback gratuit (toujours disponible)
-        methods.append(self.get_huggingface_response)
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in entry and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
 
-        # Essayer chaque méthode
-        for method in methods:
-            try:
-                result = method(message, agent_type, user_settings)
-                if result and result.get('success'):
-                    return result
-            except Exception as e:
-                logger.error(f"Erreur méthode {method.__name__}: {e}")
-                continue
+        response = Response(entry[encoding], mimetype=entry['mimetype'])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}, immutable'
+        response.set_etag(entry['etag'] if encoding == 'identity' else f"{entry['etag']}-{encoding}")
+        return response.make_conditional(request)
 
-        # Réponse de fallback garantie si tout échoue
-        agent = self.agents.get(agent_type, self.agents['kai'])
-        return {
-            'success': True,
-            'response': f"Je suis {agent['name']}, {agent['speciality'].lower()}. Je rencontre des difficultés techniques temporaires. Pouvez-vous reformuler votre question ?",
-            'agent': agent_type,
-            'model': 'emergency_fallback',
-            'timestamp': datetime.utcnow().isoformat()
-        }
+assets = AssetPipeline(os.path.join(app.root_path, 'static'), app.config['ASSET_MAX_AGE'])
+app.add_template_global(assets.url, 'asset_url')
 
-# Instance globale du système IA
-ai_system = WaveAISystem()
+def precompile_templates():
+    """Compile tous les templates au démarrage du worker (cache Jinja en mémoire)"""
+    if app.config['JINJA_CACHE_DIR']:
+        os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Assets versionnés (cache d'un an, variantes précompressées)"""
+    return assets.send(filename)
+
+@app.after_request
+def add_page_etag(response):
+    """ETag des pages HTML : 304 si le rendu est identique à la copie du navigateur"""
+    if request.method == 'GET' and response.status_code == 200 \
+            and response.mimetype == 'text/html' and not response.is_streamed:
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        response.add_etag()
+        response.make_conditional(request)
+    return response
 
 # =============================================================================
-# FONCTIONS UTILITAIRES
+# INSTRUMENTATION HTTP
 # =============================================================================
 
-def validate_email(email):
-    """Validation robuste des emails"""
-    if not email or not isinstance(email, str):
-        return False
-    email = email.strip().lower()
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None and len(email) <= 120
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-def get_user_settings(user_id):
-    """Récupère les paramètres IA d'un utilisateur"""
-    try:
-        settings = AISettings.query.filter_by(user_id=user_id).first()
-        if not settings:
-            settings = AISettings(user_id=user_id)
-            db.session.add(settings)
-            db.session.commit()
-        return settings
-    except Exception as e:
-        logger.error(f"Erreur get_user_settings: {e}")
-        return None
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Gabarit de route (pas l'URL) pour borner la cardinalité des labels
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(
+            'waveai_http_request_duration_seconds', time.perf_counter() - started,
+            route=route, method=request.method, status=str(response.status_code)
+        )
+    return response
 
 # =============================================================================
 # ROUTES PRINCIPALES
@@ -425,6 +3962,7 @@ def login():
             # Connexion
             user.last_login = datetime.utcnow()
             db.session.commit()
+            user_cache.invalidate(user.id)
 
             session['user_id'] = user.id
             session['user_email'] = user.email
@@ -455,23 +3993,30 @@ def dashboard():
         return redirect(url_for('login'))
 
     try:
-        user = User.query.get(session['user_id'])
+        with read_replica():
+            user = get_cached_user(session['user_id'])
+        if not user:
+            # Compte pas encore répliqué : relire sur le primaire
+            user = get_cached_user(session['user_id'])
         if not user:
             session.clear()
             return redirect(url_for('login'))
 
-        # Statistiques utilisateur
-        stats = {
-            'total_conversations': Conversation.query.filter_by(user_id=user.id).count(),
-            'agents_used': db.session.query(Conversation.agent_type).filter_by(user_id=user.id).distinct().count(),
+        # Statistiques utilisateur (table précalculée)
+        with read_replica():
+            stats = get_dashboard_stats(user.id)
+            usage = get_usage_summary(user.id)
+        stats.update({
             'last_activity': user.last_login.strftime('%d/%m/%Y') if user.last_login else 'Jamais',
             'member_since': user.created_at.strftime('%d/%m/%Y') if user.created_at else 'Inconnu'
-        }
+        })
 
         return render_template('dashboard_clean.html', 
                              user=user, 
                              stats=stats, 
+                             usage=usage,
                              agents=ai_system.agents,
+                             agents_info=ai_system.registry.describe(),
                              ollama_available=ai_system.check_ollama_availability())
                              
     except Exception as e:
@@ -500,6 +4045,7 @@ def ai_settings():
                 settings.huggingface_token = request.form.get('huggingface_token', '').strip()
                 settings.default_model = request.form.get('default_model', 'huggingface')
                 settings.use_ollama = 'use_ollama' in request.form
+                settings.hedge_enabled = 'hedge_enabled' in request.form
 
                 # Validation des paramètres numériques
                 try:
@@ -514,13 +4060,30 @@ def ai_settings():
                 except (ValueError, TypeError):
                     settings.max_tokens = 1000
 
+                try:
+                    delay = int(request.form.get('hedge_delay_ms', 2500))
+                    settings.hedge_delay_ms = max(500, min(15000, delay))
+                except (ValueError, TypeError):
+                    settings.hedge_delay_ms = 2500
+
+                # Conservation : champ vide = valeur par défaut du serveur
+                for field in ('archive_after_days', 'delete_after_days'):
+                    try:
+                        days = int(request.form.get(field) or 0)
+                        setattr(settings, field, max(1, min(3650, days)) if days > 0 else None)
+                    except (ValueError, TypeError):
+                        setattr(settings, field, None)
+
                 settings.updated_at = datetime.utcnow()
                 db.session.commit()
+                settings_cache.invalidate(user.id)
+                session['settings_version'] = settings_version(settings)
 
                 flash('Paramètres IA mis à jour avec succès !', 'success')
                 return redirect(url_for('ai_settings'))
 
-        return render_template('ai_settings_clean.html', user=user, settings=settings)
+        return render_template('ai_settings_clean.html', user=user, settings=settings,
+                               default_archive_days=app.config['ARCHIVE_AFTER_DAYS'])
 
     except Exception as e:
         logger.error(f"Erreur ai_settings: {e}")
@@ -533,13 +4096,14 @@ def chat(agent_type):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    if agent_type not in ai_system.agents:
+    # Une seule lecture : le registre peut être rechargé entre deux accès
+    agent = ai_system.agents.get(agent_type)
+    if agent is None:
         flash('Agent non trouvé', 'error')
         return redirect(url_for('dashboard'))
 
-    user = User.query.get(session['user_id'])
-    agent = ai_system.agents[agent_type]
-    
+    user = get_cached_user(session['user_id'])
+
     return render_template('chat_clean.html', user=user, agent=agent, agent_type=agent_type)
 
 # =============================================================================
@@ -554,102 +4118,479 @@ def api_chat():
 
     try:
         data = request.get_json()
-        if not data:
-            return jsonify({'error': 'Données manquantes'}), 400
+        message, agent_type, error = parse_chat_request(data)
+        if error:
+            return jsonify({'error': error}), 400
 
-        message = data.get('message', '').strip()
-        agent_type = data.get('agent_type', 'kai')
+        # Récupérer utilisateur, paramètres et historique du fil
+        user_id = session['user_id']
 
-        if not message:
-            return jsonify({'error': 'Message vide'}), 400
+        # Nouvel envoi d'une requête déjà traitée : même réponse, aucun nouvel appel
+        idempotency_key = get_idempotency_key(data)
+        fingerprint = request_fingerprint(data, message, agent_type)
+        if idempotency_key:
+            replay, conflict = find_replay(user_id, idempotency_key, fingerprint)
+            if conflict:
+                return conflict
+            if replay:
+                return replay_json(replay)
 
-        if len(message) > 5000:
-            return jsonify({'error': 'Message trop long'}), 400
+        thread_id = normalize_thread_id(data.get('thread_id'))
 
-        if agent_type not in ai_system.agents:
-            return jsonify({'error': 'Agent invalide'}), 400
+        # Mode asynchrone : le travail est mis en file, le worker web est libéré
+        if wants_async(data):
+            return enqueue_chat(user_id, message, agent_type, thread_id, idempotency_key, fingerprint)
+
+        rejected = admit_chat(user_id)
+        if rejected:
+            return rejected
+
+        try:
+            payload = answer_chat(user_id, message, agent_type, thread_id)
+        finally:
+            inflight_chats.release()
+
+        if idempotency_key:
+            remember_response(user_id, idempotency_key, fingerprint, payload)
+
+        return jsonify(payload)
+
+    except Exception as e:
+        logger.error(f"Erreur API chat: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+def enqueue_chat(user_id, message, agent_type, thread_id, idempotency_key=None, fingerprint=None):
+    """Met un message en file ; réponse 202 avec l'URL de suivi du travail"""
+    rejected = check_quota(user_id)
+    if rejected:
+        return rejected
+
+    limiter_key = f"user:{user_id}"
+    allowed, retry_after = user_limiter.acquire(limiter_key)
+    if not allowed:
+        return too_many_requests('Trop de messages, veuillez patienter quelques secondes', retry_after)
+
+    job_id = job_queue.enqueue('chat', user_id, {
+        'message': message,
+        'agent_type': agent_type,
+        'thread_id': thread_id,
+        'settings_version': session.get('settings_version')
+    })
+    if not job_id:
+        user_limiter.refund(limiter_key)
+        return too_many_requests('Serveur occupé, veuillez réessayer', 5)
+    job_queue.start()
+
+    payload = {
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'thread_id': thread_id,
+        'status_url': url_for('api_job', job_id=job_id)
+    }
+    if idempotency_key:
+        remember_response(user_id, idempotency_key, fingerprint, payload, status=202, kind='job')
+
+    response = jsonify(payload)
+    response.status_code = 202
+    response.headers['Location'] = payload['status_url']
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """État d'un travail de chat asynchrone (?wait=N : attente longue, 25 s max)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    try:
+        try:
+            wait_seconds = max(0.0, min(25.0, float(request.args.get('wait', 0))))
+        except (ValueError, TypeError):
+            wait_seconds = 0.0
+
+        # Travail laissé en file par un processus redémarré : le traiter ici aussi
+        job_queue.start()
+        job = job_queue.wait(job_id, session['user_id'], wait_seconds)
+        if job is None:
+            return jsonify({'error': 'Travail introuvable'}), 404
+
+        response = jsonify(job)
+        if job['status'] in ('queued', 'running'):
+            response.status_code = 202
+            response.headers['Retry-After'] = '1'
+        return response
+
+    except Exception as e:
+        logger.error(f"Erreur suivi travail: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """API de chat en streaming (Server-Sent Events)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    try:
+        data = request.get_json()
+        message, agent_type, error = parse_chat_request(data)
+        if error:
+            return jsonify({'error': error}), 400
 
-        # Récupérer utilisateur et paramètres
         user_id = session['user_id']
-        settings = get_user_settings(user_id)
 
-        # Générer réponse IA
-        response = ai_system.get_response(message, agent_type, settings)
+        idempotency_key = get_idempotency_key(data)
+        fingerprint = request_fingerprint(data, message, agent_type)
+        if idempotency_key:
+            replay, conflict = find_replay(user_id, idempotency_key, fingerprint)
+            if conflict:
+                return conflict
+            # Un travail mis en file est rejoué tel quel (202 et URL de suivi)
+            if replay and replay['kind'] != 'chat':
+                return replay_json(replay)
+            if replay:
+                payload = replay['payload']
+                body = format_sse('token', {'text': payload['response']}) + format_sse('done', payload)
+                response = Response(body, mimetype='text/event-stream')
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
 
-        # Sauvegarder conversation
+        rejected = admit_chat(user_id)
+        if rejected:
+            return rejected
+
+    except Exception as e:
+        logger.error(f"Erreur API chat stream: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+    try:
+        settings = get_cached_settings(user_id)
+        thread_id = normalize_thread_id(data.get('thread_id'))
+        context = get_conversation_context(user_id, thread_id)
+
+    except Exception as e:
+        inflight_chats.release()
+        logger.error(f"Erreur API chat stream: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+    def generate():
+        result = None
         try:
-            conversation = Conversation(
-                user_id=user_id,
-                agent_type=agent_type,
-                message=message,
-                response=response.get('response', '')
-            )
-            db.session.add(conversation)
-            db.session.commit()
-            
+            for event in ai_system.stream_response(message, agent_type, settings, context):
+                if event['type'] == 'token':
+                    yield format_sse('token', {'text': event['text']})
+                else:
+                    result = event
         except Exception as e:
-            logger.error(f"Erreur sauvegarde conversation: {e}")
+            logger.error(f"Erreur streaming chat: {e}")
 
-        return jsonify({
+        if not result:
+            yield format_sse('error', {'error': 'Erreur de communication avec l\'agent'})
+            return
+
+        payload = {
             'success': True,
-            'response': response.get('response', ''),
+            'response': result.get('response', ''),
             'agent': agent_type,
-            'model': response.get('model', 'unknown'),
-            'timestamp': response.get('timestamp', datetime.utcnow().isoformat())
+            'model': result.get('model', 'unknown'),
+            'thread_id': thread_id,
+            'timestamp': result.get('timestamp', datetime.utcnow().isoformat())
+        }
+
+        # Flux interrompu par le fournisseur : réponse incomplète, ni sauvegardée ni rejouée
+        if result.get('truncated'):
+            yield format_sse('done', dict(payload, success=False, truncated=True))
+            return
+
+        # Sauvegarder la conversation une fois le flux terminé (une seule fois pour des envois en double)
+        if not result.get('coalesced'):
+            save_conversation(user_id, agent_type, message, result.get('response', ''), thread_id)
+
+        if idempotency_key:
+            remember_response(user_id, idempotency_key, fingerprint, payload)
+
+        yield format_sse('done', payload)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Le créneau reste réservé jusqu'à la fin du flux (ou la déconnexion du client)
+    response.call_on_close(inflight_chats.release)
+    return response
+
+@app.route('/api/conversations')
+def api_conversations():
+    """Historique paginé par curseur (du plus récent au plus ancien)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    try:
+        agent_type = request.args.get('agent_type')
+        if agent_type and agent_type not in ai_system.agents:
+            return jsonify({'error': 'Agent invalide'}), 400
+
+        try:
+            limit = max(1, min(100, int(request.args.get('limit', 20))))
+        except (ValueError, TypeError):
+            limit = 20
+
+        query = Conversation.query.filter_by(user_id=session['user_id'])
+        if agent_type:
+            query = query.filter_by(agent_type=agent_type)
+
+        cursor = request.args.get('before')
+        if cursor:
+            position = decode_cursor(cursor)
+            if not position:
+                return jsonify({'error': 'Curseur invalide'}), 400
+            created_at, conversation_id = position
+            query = query.filter(db.or_(
+                Conversation.created_at < created_at,
+                db.and_(Conversation.created_at == created_at, Conversation.id < conversation_id)
+            ))
+
+        with read_replica():
+            rows = query.order_by(Conversation.created_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        response = jsonify({
+            'conversations': [row.to_dict() for row in rows],
+            'next_cursor': encode_cursor(rows[-1]) if has_more else None
         })
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
 
     except Exception as e:
-        logger.error(f"Erreur API chat: {e}")
+        logger.error(f"Erreur historique conversations: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+@app.route('/api/conversations/archives')
+def api_conversation_archives():
+    """Mois archivés de l'utilisateur, du plus récent au plus ancien"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    try:
+        rows = db.session.query(
+            ConversationArchive.month,
+            db.func.sum(ConversationArchive.row_count),
+            db.func.min(ConversationArchive.first_at),
+            db.func.max(ConversationArchive.last_at)
+        ).filter_by(user_id=session['user_id']).group_by(ConversationArchive.month) \
+            .order_by(ConversationArchive.month.desc()).all()
+
+        return jsonify({'archives': [
+            {
+                'month': month,
+                'conversations': int(count or 0),
+                'first_at': first_at.isoformat() if first_at else None,
+                'last_at': last_at.isoformat() if last_at else None
+            }
+            for month, count, first_at, last_at in rows
+        ]})
+
+    except Exception as e:
+        logger.error(f"Erreur liste archives: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+@app.route('/api/conversations/archives/<month>')
+def api_conversation_archive(month):
+    """Conversations archivées d'un mois (AAAA-MM), lues à la demande"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    if not re.fullmatch(r'\d{4}-\d{2}', month):
+        return jsonify({'error': 'Mois invalide'}), 400
+
+    agent_type = request.args.get('agent_type')
+    if agent_type and agent_type not in ai_system.agents:
+        return jsonify({'error': 'Agent invalide'}), 400
+
+    try:
+        rows = archiver.read(session['user_id'], month, agent_type)
+        response = jsonify({'month': month, 'conversations': rows})
+        # Une archive n'est modifiée que par l'archivage suivant
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.add_etag()
+        return response.make_conditional(request)
+
+    except Exception as e:
+        logger.error(f"Erreur lecture archive: {e}")
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+@app.route('/api/search')
+def api_search():
+    """Recherche plein texte dans l'historique de l'utilisateur"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    try:
+        text = request.args.get('q', '').strip()
+        if not text:
+            return jsonify({'error': 'Recherche vide'}), 400
+        if len(text) > 200:
+            return jsonify({'error': 'Recherche trop longue'}), 400
+
+        agent_type = request.args.get('agent_type')
+        if agent_type and agent_type not in ai_system.agents:
+            return jsonify({'error': 'Agent invalide'}), 400
+
+        try:
+            limit = max(1, min(50, int(request.args.get('limit', 20))))
+            page = max(1, min(50, int(request.args.get('page', 1))))
+        except (ValueError, TypeError):
+            limit, page = 20, 1
+
+        with read_replica():
+            results = search_conversations(session['user_id'], text, agent_type, limit, (page - 1) * limit)
+        return jsonify({
+            'results': results[:limit],
+            'page': page,
+            'has_more': len(results) > limit
+        })
+
+    except Exception as e:
+        logger.error(f"Erreur recherche: {e}")
+        db.session.rollback()
+        return jsonify({'error': 'Erreur serveur'}), 500
+
+@app.route('/api/usage')
+def api_usage():
+    """Consommation de tokens et coût estimé de l'utilisateur (?days=N, 90 max)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Non connecté'}), 401
+
+    try:
+        try:
+            days = max(1, min(90, int(request.args.get('days', 30))))
+        except (ValueError, TypeError):
+            days = 30
+
+        with read_replica():
+            usage = get_usage_summary(session['user_id'], days)
+        return jsonify(usage)
+
+    except Exception as e:
+        logger.error(f"Erreur consommation: {e}")
         return jsonify({'error': 'Erreur serveur'}), 500
 
 @app.route('/api/status')
 def api_status():
     """Status de l'application"""
     try:
+        ollama = ai_system.get_ollama_status()
         return jsonify({
             'status': 'ok',
             'version': '1.0.0',
             'timestamp': datetime.utcnow().isoformat(),
             'agents_available': len(ai_system.agents),
-            'ollama_available': ai_system.check_ollama_availability()
+            'ollama_available': ollama['available'],
+            'ollama': ollama,
+            'providers': ai_system.get_breaker_states(),
+            'response_cache': ai_system.response_cache.stats()
         })
     except Exception as e:
         logger.error(f"Erreur status: {e}")
         return jsonify({'error': 'Erreur status'}), 500
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métriques au format texte Prometheus, agrégées sur les workers"""
+    token = app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Non autorisé'}), 401
+
+    try:
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        logger.error(f"Erreur metrics: {e}")
+        return jsonify({'error': 'Erreur metrics'}), 500
+
+@app.route('/api/status/stream')
+def api_status_stream():
+    """Statut poussé (Server-Sent Events) : un événement à chaque changement
+
+    Remplace le polling de /api/status. Un commentaire de heartbeat est
+    envoyé régulièrement et le flux est fermé après STATUS_STREAM_TTL
+    secondes (le navigateur se reconnecte seul, avec Last-Event-ID).
+    """
+    if not status_broadcaster.acquire_stream():
+        response = jsonify({'error': 'Canal de statut saturé, utilisez /api/status'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+
+    try:
+        status_broadcaster.start()
+    except Exception as e:
+        status_broadcaster.release_stream()
+        logger.error(f"Erreur canal de statut: {e}")
+        return jsonify({'error': 'Erreur status'}), 500
+
+    last_event_id = request.headers.get('Last-Event-ID')
+    heartbeat = app.config['STATUS_HEARTBEAT']
+    ttl = app.config['STATUS_STREAM_TTL']
+
+    def generate():
+        yield f"retry: {int(app.config['STATUS_CHECK_INTERVAL'] * 1000)}\n\n"
+        version, state = status_broadcaster.current()
+        if last_event_id != status_broadcaster.event_id(version):
+            yield format_sse('status', state, status_broadcaster.event_id(version))
+
+        deadline = time.monotonic() + ttl
+        while time.monotonic() < deadline:
+            latest, state = status_broadcaster.wait(version, min(heartbeat, max(0.0, deadline - time.monotonic())))
+            if latest == version:
+                yield ": heartbeat\n\n"
+                continue
+            version = latest
+            yield format_sse('status', state, status_broadcaster.event_id(version))
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(status_broadcaster.release_stream)
+    return response
+
 # =============================================================================
 # PWA ET MANIFEST
 # =============================================================================
 
+MANIFEST = {
+    "name": "WaveAI - Agents IA Intelligents",
+    "short_name": "WaveAI",
+    "description": "Plateforme d'agents IA spécialisés pour la productivité",
+    "start_url": "/",
+    "display": "standalone",
+    "background_color": "#0f172a",
+    "theme_color": "#0ea5e9",
+    "icons": [
+        {
+            "src": "/static/icon-192.png",
+            "sizes": "192x192",
+            "type": "image/png"
+        },
+        {
+            "src": "/static/icon-512.png",
+            "sizes": "512x512",
+            "type": "image/png"
+        }
+    ]
+}
+
+# Sérialisé une seule fois : le manifest ne change qu'au déploiement
+MANIFEST_JSON = json.dumps(MANIFEST, ensure_ascii=False).encode('utf-8')
+MANIFEST_ETAG = hashlib.sha256(MANIFEST_JSON).hexdigest()[:16]
+
 @app.route('/manifest.json')
 def manifest():
     """Manifest PWA"""
     try:
-        manifest_data = {
-            "name": "WaveAI - Agents IA Intelligents",
-            "short_name": "WaveAI",
-            "description": "Plateforme d'agents IA spécialisés pour la productivité",
-            "start_url": "/",
-            "display": "standalone",
-            "background_color": "#0f172a",
-            "theme_color": "#0ea5e9",
-            "icons": [
-                {
-                    "src": "/static/icon-192.png",
-                    "sizes": "192x192",
-                    "type": "image/png"
-                },
-                {
-                    "src": "/static/icon-512.png",
-                    "sizes": "512x512",
-                    "type": "image/png"
-                }
-            ]
-        }
-        
-        response = make_response(jsonify(manifest_data))
-        response.headers['Content-Type'] = 'application/manifest+json'
-        return response
+        response = Response(MANIFEST_JSON, mimetype='application/manifest+json')
+        response.headers['Cache-Control'] = 'public, max-age=86400'
+        response.set_etag(MANIFEST_ETAG)
+        return response.make_conditional(request)
         
     except Exception as e:
         logger.error(f"Erreur manifest: {e}")
@@ -672,12 +4613,47 @@ def internal_error(error):
 # INITIALISATION SÉCURISÉE
 # =============================================================================
 
+def upgrade_schema():
+    """Ajoute les colonnes manquantes aux tables existantes
+
+    db.create_all() ne modifie pas les tables déjà créées : les nouvelles
+    colonnes (nullables) sont ajoutées ici pour les bases déjà déployées.
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = inspector.get_table_names()
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns or column.primary_key:
+                continue
+
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"Colonne ajoutée: {table.name}.{column.name}")
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=db.engine)
+                logger.info(f"Index ajouté: {index.name}")
+
 def init_database():
     """Initialise la base de données avec gestion d'erreur"""
     try:
         with app.app_context():
             # Créer toutes les tables
             db.create_all()
+            upgrade_schema()
+            app.config['SEARCH_ENGINE'] = setup_search_index()
+
+            # Statistiques précalculées absentes pour des conversations existantes
+            if not UserAgentStats.query.first() and Conversation.query.first():
+                logger.info(f"Statistiques recalculées pour {backfill_user_stats()} couples utilisateur/agent")
 
             # Version par défaut
             if not AppVersion.query.filter_by(is_current=True).first():
@@ -696,20 +4672,131 @@ def init_database():
         logger.error(f"❌ Erreur critique initialisation DB: {e}")
         return False
 
+# Clés lues à l'import pour construire db, les caches, les limiteurs, les files
+# et WaveAISystem : les changer dans create_app() n'aurait aucun effet
+IMPORT_TIME_CONFIG = frozenset({
+    'SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_BINDS', 'SQLALCHEMY_ENGINE_OPTIONS',
+    'METRICS_DIR', 'METRICS_FLUSH_INTERVAL',
+    'AGENTS_CONFIG', 'AGENTS_RELOAD_INTERVAL',
+    'PROVIDER_POOL_SIZE', 'PROVIDER_MAX_WORKERS', 'PROVIDER_TIMEOUTS', 'BREAKER_CONFIG', 'OLLAMA_PROBE_INTERVAL',
+    'RESPONSE_CACHE', 'RATE_LIMITS', 'RATE_LIMIT_PATH', 'MAX_INFLIGHT_CHATS', 'USER_CACHE_TTL',
+    'CONVERSATION_BATCH_SIZE', 'CONVERSATION_FLUSH_INTERVAL', 'CONVERSATION_SPILL_PATH',
+    'USAGE_PRICES', 'USAGE_BATCH_SIZE', 'USAGE_FLUSH_INTERVAL', 'USAGE_SPILL_PATH',
+    'USAGE_DAILY_TOKEN_QUOTA', 'USAGE_DAILY_COST_QUOTA', 'USAGE_QUOTA_REFRESH',
+    'ARCHIVE_DIR', 'ARCHIVE_AFTER_DAYS', 'ARCHIVE_BATCH_SIZE', 'ARCHIVE_INTERVAL',
+    'JOB_QUEUE_PATH', 'JOB_WORKERS', 'JOB_LEASE', 'JOB_RESULT_TTL', 'JOB_QUEUE_MAX', 'JOB_POLL_INTERVAL',
+    'STATUS_CHECK_INTERVAL', 'STATUS_STREAM_MAX', 'ASSET_MAX_AGE',
+})
+
+def create_app(config=None, init_db=None):
+    """Démarrage explicite de l'application, une fois par processus
+
+    L'import du module ne touche ni la base ni les SDK. create_app()
+    initialise la base si demandé (WAVEAI_INIT_DB, désactivé par
+    gunicorn.conf.py qui le fait une seule fois via init-db), charge les SDK
+    fournisseurs et mesure le temps de démarrage par rapport au budget.
+
+    Ce n'est pas une fabrique au sens Flask : le module porte une seule
+    application, et db, les caches, les limiteurs et WaveAISystem sont
+    construits à l'import à partir des variables d'environnement. config
+    complète app.config avant le démarrage, pour les clés lues au démarrage
+    ou à chaque requête (budgets, délais, modes...). Une clé de
+    IMPORT_TIME_CONFIG qui diffère de la valeur en place lève ValueError,
+    tout comme une configuration passée après le démarrage.
+    """
+    if config:
+        if app.extensions.get('waveai_started'):
+            raise ValueError("create_app() déjà appelé : configuration à fournir au premier appel")
+        frozen = sorted(key for key, value in config.items()
+                        if key in IMPORT_TIME_CONFIG and value != app.config.get(key))
+        if frozen:
+            raise ValueError(f"Clés lues à l'import, à définir par variables d'environnement : {', '.join(frozen)}")
+        app.config.update(config)
+
+    if app.extensions.get('waveai_started'):
+        return app
+
+    started = time.perf_counter()
+    if init_db is None:
+        init_db = os.environ.get('WAVEAI_INIT_DB', 'true').lower() == 'true'
+    if init_db and not init_database():
+        logger.error("❌ Échec initialisation - Démarrage en mode dégradé")
+
+    ai_system.warm_up()
+    assets.ensure_built()
+    precompile_templates()
+    archiver.start()
+    app.extensions['waveai_started'] = True
+
+    import_ms = (started - IMPORT_STARTED) * 1000
+    startup_ms = (time.perf_counter() - started) * 1000
+    metrics.observe('waveai_startup_duration_seconds', import_ms / 1000, phase='import')
+    metrics.observe('waveai_startup_duration_seconds', startup_ms / 1000, phase='create_app')
+    if import_ms + startup_ms > app.config['STARTUP_BUDGET_MS']:
+        logger.warning(f"⚠️ Démarrage en {import_ms + startup_ms:.0f} ms (import {import_ms:.0f} ms), "
+                       f"budget {app.config['STARTUP_BUDGET_MS']} ms dépassé")
+    else:
+        logger.info(f"🌊 Worker prêt en {import_ms + startup_ms:.0f} ms (import {import_ms:.0f} ms)")
+    return app
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Crée ou met à jour le schéma (une fois avant le démarrage des workers)"""
+    if not init_database():
+        raise SystemExit(1)
+
+@app.cli.command('run-jobs')
+def run_jobs_command():
+    """Traite la file de chat asynchrone dans un processus dédié (JOB_WORKERS threads)"""
+    job_queue.workers = job_queue.workers or 4
+    job_queue.start()
+    print(f"✅ {job_queue.workers} threads de traitement démarrés (Ctrl+C pour arrêter)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command('archive-conversations')
+def archive_conversations_command():
+    """Archive les conversations anciennes et purge les archives expirées"""
+    count = archiver.run_once()
+    print(f"✅ {count} conversations archivées")
+
+@app.cli.command('partition-conversations')
+def partition_conversations_command():
+    """Convertit la table conversations en partitions mensuelles (PostgreSQL)"""
+    if partition_conversations():
+        print("✅ Table conversations partitionnée par mois")
+    else:
+        print("ℹ️ Table conversations déjà partitionnée")
+
+@app.cli.command('backfill-stats')
+def backfill_stats_command():
+    """Recalcule les statistiques précalculées des utilisateurs"""
+    count = backfill_user_stats()
+    print(f"✅ Statistiques recalculées pour {count} couples utilisateur/agent")
+
+@app.cli.command('rebuild-usage')
+def rebuild_usage_command():
+    """Recalcule le cumul quotidien des consommations depuis le registre"""
+    usage_ledger.flush()
+    count = rebuild_usage_rollups()
+    print(f"✅ Consommation recalculée pour {count} couples utilisateur/jour/agent")
+
 # =============================================================================
 # POINT D'ENTRÉE PRINCIPAL
 # =============================================================================
 
+# Production : gunicorn -c gunicorn.conf.py "waveai_main:create_app()"
+
 if __name__ == '__main__':
     # Mode développement local
     if init_database():
+        create_app(init_db=False)
         port = int(os.environ.get('PORT', 5000))
         debug = os.environ.get('FLASK_ENV') == 'development'
         logger.info(f"🌊 Démarrage WaveAI sur le port {port}")
         app.run(host='0.0.0.0', port=port, debug=debug)
     else:
         logger.error("❌ Échec initialisation - Arrêt de l'application")
-else:
-    # Mode production (Render, Heroku, etc.)
-    logger.info("🌊 WaveAI en mode production")
-    init_database()